@@ -6,11 +6,89 @@ BASE_DIR=Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 OUTPUT_DIR = BASE_DIR / "outputs"
 
-# Create directories if they don't exist
-UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
+
+def ensure_dirs():
+    """
+    Create the upload/output directories if they don't exist.
+    Called by the app and the worker at startup, not on import, so importing
+    config (tools, benchmarks, tests) never touches the filesystem.
+    """
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    OUTPUT_DIR.mkdir(exist_ok=True)
+
 # print(UPLOAD_DIR)
 # print(OUTPUT_DIR)
 # Demucs configuration
 DEMUXS_MODEL = "music-demucs"
-SAMPLE_RATE = 44100
\ No newline at end of file
+SAMPLE_RATE = 44100
+
+# Separation job queue
+SEPARATION_WORKERS = int(os.getenv("SEPARATION_WORKERS", 2))
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", 32))
+# Job store shared by the API and workers: "sqlite" (multi-process) or "memory"
+# SEPARATION_WORKERS=0 makes the API enqueue only; run `python worker.py` instead
+JOB_STORE = os.getenv("JOB_STORE", "sqlite")
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", BASE_DIR / "jobs.sqlite3"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 300))   # requeue jobs of dead workers (running jobs heartbeat)
+
+# Separation engine (runtime settings, overridable per call)
+DEMUCS_MODEL = os.getenv("DEMUCS_MODEL", "htdemucs")
+DEMUCS_SHIFTS = int(os.getenv("DEMUCS_SHIFTS", 1))         # shift trick for better quality
+DEMUCS_OVERLAP = float(os.getenv("DEMUCS_OVERLAP", 0.25))  # prevents boundary artifacts
+DEMUCS_SEGMENT = float(os.getenv("DEMUCS_SEGMENT")) if os.getenv("DEMUCS_SEGMENT") else None  # seconds, None = model default
+
+# Preview tier: quick stems of the first PREVIEW_SECONDS (no shift trick,
+# small overlap, optionally a lighter model) published before the full
+# separation runs. PREVIEW_SECONDS=0 turns the tier off
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", 30))
+PREVIEW_MODEL = os.getenv("PREVIEW_MODEL", DEMUCS_MODEL)   # same resident weights by default
+PREVIEW_SHIFTS = int(os.getenv("PREVIEW_SHIFTS", 0))
+PREVIEW_OVERLAP = float(os.getenv("PREVIEW_OVERLAP", 0.1))
+
+# Separation result cache (LRU over OUTPUT_DIR)
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 20 * 1024**3))
+
+# Drum classifier backend (.onnx / .pt / .ts model, unset = heuristic)
+DRUM_CLASSIFIER_MODEL = os.getenv("DRUM_CLASSIFIER_MODEL")
+CLASSIFIER_MICRO_BATCH = int(os.getenv("CLASSIFIER_MICRO_BATCH", 32))
+CLASSIFIER_THREADS = int(os.getenv("CLASSIFIER_THREADS", 0)) or None  # None = all cores
+
+# Mel window storage (uint8 / float16 / float32)
+MEL_STORE_DTYPE = os.getenv("MEL_STORE_DTYPE", "uint8")
+
+# Upload limits (enforced while the upload streams in)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 500 * 1024**2))
+MAX_UPLOAD_SECONDS = float(os.getenv("MAX_UPLOAD_SECONDS", 2 * 60 * 60))
+
+# Long audio: memory-bounded, windowed separation
+SEPARATION_MAX_MEMORY_MB = int(os.getenv("SEPARATION_MAX_MEMORY_MB", 3072))
+LONG_AUDIO_SECONDS = float(os.getenv("LONG_AUDIO_SECONDS", 20 * 60))   # longer inputs use windowed mode
+LONG_AUDIO_CROSSFADE = float(os.getenv("LONG_AUDIO_CROSSFADE", 5.0))   # seconds
+
+# Bulk imports (AudioProcessor.separate_many): decoded audio per separate_batch
+# call, files are grouped up to this many seconds so memory stays bounded
+BULK_GROUP_SECONDS = float(os.getenv("BULK_GROUP_SECONDS", 15 * 60))
+
+# Analysis after separation: independent stages (onsets, mel, beats) run in parallel
+ANALYSIS_STAGE_WORKERS = int(os.getenv("ANALYSIS_STAGE_WORKERS", 3))
+
+# Analysis sample rate for onsets, beats and mel windows. Every feature stops at
+# 12 kHz, so decoding at 24 kHz halves the FFT work and memory of those stages
+# without losing anything they use ("0" = analyse at the stem's native rate)
+ANALYSIS_SR = int(os.getenv("ANALYSIS_SR", 24000)) or None
+
+# /hits pagination: largest page a client may ask for
+MAX_HITS_PAGE = int(os.getenv("MAX_HITS_PAGE", 50000))
+
+# Job push channel (/ws/jobs/{id}): hits per message, and how often the job
+# store is checked for jobs run by a separate worker.py process
+HIT_EVENT_BATCH = int(os.getenv("HIT_EVENT_BATCH", 256))
+WS_POLL_SECONDS = float(os.getenv("WS_POLL_SECONDS", 2.0))
+
+# Compressed stem delivery (/stems), kbps
+STEM_MP3_BITRATE = int(os.getenv("STEM_MP3_BITRATE", 192))
+
+# Startup: heavy libraries (torch, demucs, librosa) load on first use; these
+# warm them up in the background right after startup instead ("0" = stay lazy)
+PREWARM_MODEL = os.getenv("PREWARM_MODEL", "1") == "1"        # Demucs weights
+PREWARM_ANALYSIS = os.getenv("PREWARM_ANALYSIS", "1") == "1"  # librosa / numba JIT caches
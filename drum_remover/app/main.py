@@ -1,104 +1,352 @@
-import json
-from fastapi import FastAPI, UploadFile, File, HTTPException, status, BackgroundTasks
+import asyncio
+import hashlib
+import logging
+from contextlib import ExitStack, asynccontextmanager
+from pathlib import Path
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, JSONResponse, Response
+from fastapi.responses import FileResponse
 from fastapi import Request
 from fastapi.staticfiles import StaticFiles
-import shutil
-import os
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import threading
 
-from config import UPLOAD_DIR, BASE_DIR, OUTPUT_DIR
-from services.audio_processor import AudioProcessor
-from services.background_tasks import detect_onsets_task
+import numpy as np
 
+from config import UPLOAD_DIR, BASE_DIR, OUTPUT_DIR, SEPARATION_WORKERS, MAX_PENDING_JOBS
+from config import JOB_STORE, JOB_DB_PATH, JOB_STALE_SECONDS, MAX_HITS_PAGE
+from config import PREWARM_MODEL, PREWARM_ANALYSIS, ensure_dirs
+from config import HIT_EVENT_BATCH, WS_POLL_SECONDS, PREVIEW_SECONDS
+from services.audio_buffer import DecodedAudio
+from services.job_queue import JobQueue, QueueFullError, DONE, FAILED
+from services.job_store import make_job_store
+from services.ingest import ingest_upload, UploadRejected
+from services.metrics import metrics
+from services.event_bus import events
+from services.hit_store import HitStore, hits_index_path, WIRE_DTYPE
+from services.drum_classifier import CLASS_LABELS
+from services.transcoder import StemTranscoder, MEDIA_TYPES
+from services.result_cache import ResultCache
 
-app = FastAPI()
+
+# torch / demucs and librosa are not imported here: they load in the worker
+# threads on first use (or in the pre-warm thread), so the app starts and
+# answers requests within a second or two.
+def build_processor():
+    from services.audio_processor import AudioProcessor
+    return AudioProcessor(output_dir=OUTPUT_DIR)
+
+
+def analyse_drums(drums_path: Path, audio: Optional[DecodedAudio] = None):
+    from services.background_tasks import detect_onsets_task
+    detect_onsets_task(drums_path, audio)
+
+
+def prewarm():
+    """
+    Load the Demucs weights and warm librosa's caches before the first upload.
+    Runs in a daemon thread; a failure only costs the first job the time saved.
+    """
+    try:
+        if PREWARM_MODEL:
+            jobs.processor.engine.warm_up()
+        if PREWARM_ANALYSIS:
+            from services import background_tasks
+            background_tasks.warm_up()
+        logger.info("Pre-warm finished")
+    except Exception:
+        logger.exception("Pre-warm failed, models will load on first use")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SEPARATION_WORKERS > 0:   # 0 = enqueue-only API, separation runs in worker.py
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+        jobs.start()
+    yield
+    jobs.shutdown(wait=False)
+
+
+ensure_dirs()
+app = FastAPI(lifespan=lifespan)
 # Mount the outputs folder to play audio locally.
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 
 templates = Jinja2Templates(directory=(f"{BASE_DIR}/templates"))
+logger = logging.getLogger(__name__)
+hit_store = HitStore()
+transcoder = StemTranscoder()
+cache = ResultCache(OUTPUT_DIR)
 
 
-processor = AudioProcessor() # Initialize processor
+# Jobs live in a store shared with any `worker.py` processes; the processor
+# is built by the first worker thread that needs it
+jobs = JobQueue(build_processor, store=make_job_store(JOB_STORE, JOB_DB_PATH),
+                max_workers=SEPARATION_WORKERS, max_pending=MAX_PENDING_JOBS,
+                post_process=analyse_drums, stale_after=JOB_STALE_SECONDS,
+                preview_seconds=PREVIEW_SECONDS)
+
 
 @app.get("/", response_class=HTMLResponse)
-def read_form(request: Request, drums: str = None, rest: str = None):
+def read_form(request: Request, drums: str = None, rest: str = None, job: str = None,
+              tier: str = "full"):
     # results = getattr(app.state, "last_results", None)
     # print(results)
     results = None
     if drums and rest:
         results = {
             "drums": drums,
-            "rest": rest
+            "rest": rest,
+            "job": job,
+            "tier": tier
         }
     return templates.TemplateResponse("index.html", {"request": request, "results": results})
 
-# @app.post("/upload")
-# async def upload_audio(file: UploadFile = File(...)):
-
-#     upload_path = UPLOAD_DIR / file.filename
-#     # Save file
-#     with open(upload_path, "wb") as f:
-#         f.write(await file.read())
-#     # Async processing
-#     results = await processor.separate_drums_async(upload_path)
-#     return {
-#         "drums_file": str(results["drums"]),
-#         "rest_file": str(results["rest"])
-#     }
-@app.post("/upload")
-def upload_audio(file: UploadFile = File(...), background_tasks: BackgroundTasks = None):
-    # Check if file is provided
-    if not file.filename:
+@app.post("/upload", status_code=status.HTTP_202_ACCEPTED)
+async def upload_audio(request: Request):
+    # Stream the upload to disk; hashing, format sniffing and size/duration
+    # limits happen while it arrives (multipart field name: "file")
+    try:
+        upload = await ingest_upload(request, UPLOAD_DIR)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    logger.info("Upload stored at %s", upload.path)
+
+    # Queue separation (+ onset detection) and return right away
+    try:
+        job = jobs.submit(upload.path)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e))
+
+    return {"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}",
+            "events_url": f"/ws/jobs/{job.id}", "upload": upload.to_dict()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="No file provided")
-    
-    # Check if file is audio
-    ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.flac'}
-    if not any(file.filename.endswith(ext) for ext in ALLOWED_EXTENSIONS):
+            detail=f"Unknown job: {job_id}")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/progress")
+def get_job_progress(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Invalid file type. Allowed file extensions: {ALLOWED_EXTENSIONS}")
-    
-    # Save the uploaded file
-    upload_path = UPLOAD_DIR / file.filename
-    output_path = OUTPUT_DIR / file.filename
-    print("upload_path -> ", upload_path)
-    with open(upload_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-        
-    # Process audio
-    processor = AudioProcessor(output_dir=OUTPUT_DIR)
-
-    results = processor.separate_drums(upload_path)
-    drums_path = results["drums"]
-    # # Schedule onset detection in background
-    if background_tasks:
-        background_tasks.add_task(detect_onsets_task, drums_path)
-
-    # Pass results into state so index can render it
-    # Redirect back to index with query params
-    return RedirectResponse(
-        url=f"/?drums={results['drums'].name}&rest={results['rest'].name}",
-        status_code=status.HTTP_303_SEE_OTHER
-    )
+            detail=f"Unknown job: {job_id}")
+    # Per-stage wall/CPU time, peak memory and item counts recorded so far
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": round(job.progress, 3),
+        "stages": metrics.job_stages(job.id),
+    }
+
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_events(websocket: WebSocket, job_id: str):
+    """
+    Push channel for one job, instead of polling /jobs/{id} and /hits:
+      {"type": "job", ...}     status / stage / progress / result changes
+                               (the first message is the full job)
+      {"type": "hits", "offset": n, "hits": [{time, label}, ...]}
+                               classified hits in time order, as they are produced
+      {"type": "end", "status": ..., "total_hits": n}, then the socket closes
+    Jobs run by a separate worker.py don't reach this process's event bus:
+    their state is read from the job store every WS_POLL_SECONDS instead, and
+    their hits are sent from the index once the job is done.
+    """
+    job = await run_in_threadpool(jobs.get, job_id)
+    if job is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Unknown job: {job_id}")
+        return
+    await websocket.accept()
+
+    sent_hits = 0
+    with events.subscribe(job_id) as sub:   # before the snapshot, so nothing falls in between
+        closed = asyncio.ensure_future(websocket.receive())
+        next_event = None
+        try:
+            job = await run_in_threadpool(jobs.get, job_id)
+            last = job.to_dict()
+            await websocket.send_json({"type": "job", **last})
+            job_status = job.status
+
+            while job_status not in (DONE, FAILED):
+                next_event = next_event or asyncio.ensure_future(sub.get())
+                done, _ = await asyncio.wait({next_event, closed}, timeout=WS_POLL_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if closed in done:
+                    if closed.result()["type"] == "websocket.disconnect":
+                        return
+                    closed = asyncio.ensure_future(websocket.receive())   # client messages are ignored
+                if next_event in done:
+                    event, next_event = next_event.result(), None
+                    if event["type"] == "hits":
+                        sent_hits = max(sent_hits, event["offset"] + len(event["hits"]))
+                    job_status = event.get("status", job_status)
+                    await websocket.send_json(event)
+                elif not done:
+                    # Nothing on the bus for a while: the job may run in another process
+                    job = await run_in_threadpool(jobs.get, job_id)
+                    snapshot = job.to_dict()
+                    if snapshot != last:
+                        await websocket.send_json({"type": "job", **snapshot})
+                    last, job_status = snapshot, job.status
+
+            # Hits not streamed from this process (other worker, or job already done)
+            job = await run_in_threadpool(jobs.get, job_id)
+            total = sent_hits
+            index_path = hits_index_path(OUTPUT_DIR / job.result["drums"]) if job.result else None
+            if job.status == DONE and index_path is not None and index_path.exists():
+                index, _ = await run_in_threadpool(hit_store.open, index_path)
+                total = len(index)
+                for offset in range(sent_hits, total, HIT_EVENT_BATCH):
+                    page, _ = index.query(offset=offset, limit=HIT_EVENT_BATCH)
+                    await websocket.send_json({
+                        "type": "hits", "offset": offset,
+                        "hits": [{"time": round(float(t), 6), "label": CLASS_LABELS[l]}
+                                 for t, l in zip(page["time"], page["label"])]})
+            await websocket.send_json({"type": "end", "status": job.status, "total_hits": total})
+            await websocket.close()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            closed.cancel()
+            if next_event is not None:
+                next_event.cancel()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus scrape endpoint
+    body = metrics.render_prometheus({"drum_jobs": jobs.counts()})
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown job: {job_id}")
+    if job.result is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job {job_id} is {job.status}, no result yet")
+    # While only the preview tier exists, drums / rest are the preview stems and
+    # there are no hits yet (they are detected on the full drums)
+    full = job.result.get("tier", "full") == "full"
+    return {
+        **job.result,
+        "analysis_done": job.status == DONE,
+        "hits_url": f"/hits?file={job.result['drums']}" if full else None,
+        "stream_urls": {name: f"/stems/{job.result[name]}?format=mp3" for name in ("drums", "rest")},
+    }
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match check: "*" or any tag of the comma-separated list equal to
+    etag, compared whole and ignoring W/ (weak comparison, as for GET).
+    """
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    if "*" in tags:
+        return True
+    weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+    return weak(etag) in {weak(tag) for tag in tags if tag}
 
 
 @app.get("/hits")
-def get_hits(file: str):
-    hits_path = OUTPUT_DIR / file.replace(".wav", ".hits.json")
-    print("Looking for hits file:", hits_path, "Exists:", hits_path.exists())
-    if not hits_path.exists():
-        return {"hits": []}
+def get_hits(request: Request, file: str, start: Optional[float] = None, end: Optional[float] = None,
+             label: Optional[list[str]] = Query(None), offset: int = Query(0, ge=0),
+             limit: Optional[int] = Query(None, ge=1, le=MAX_HITS_PAGE),
+             fmt: str = Query("json", alias="format", pattern="^(json|columnar|binary)$")):
+    """
+    Hits of a drum stem, from its time-sorted index.
+    start / end (seconds, end exclusive) and label (repeatable) filter, offset /
+    limit paginate. format: json (list of {time, label}), columnar (parallel
+    arrays) or binary (packed float32 time + uint8 label id, 5 bytes per hit).
+    Responses carry an ETag; send it back in If-None-Match to get a 304.
+    """
+    drums_path = (OUTPUT_DIR / file).resolve()
+    if not drums_path.is_relative_to(OUTPUT_DIR.resolve()):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown file: {file}")
+    index_path = hit_store.ensure_index(drums_path)
+    if index_path is None:
+        logger.info("No hits for %s yet", file)
+        return {"hits": [], "total": 0, "offset": offset, "next_offset": None}
+
+    index, st = hit_store.open(index_path)
+    query = (start, end, tuple(label or ()), offset, limit, fmt)
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}-{hashlib.sha1(repr(query).encode()).hexdigest()[:12]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        page, total = index.query(start, end, label, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    next_offset = offset + len(page) if offset + len(page) < total else None
+
+    if fmt == "binary":
+        wire = np.empty(len(page), dtype=WIRE_DTYPE)
+        wire["time"], wire["label"] = page["time"], page["label"]
+        headers.update({"X-Total-Count": str(total), "X-Hit-Labels": ",".join(CLASS_LABELS),
+                        "X-Next-Offset": "" if next_offset is None else str(next_offset)})
+        return Response(wire.tobytes(), media_type="application/octet-stream", headers=headers)
+
+    body = {"total": total, "offset": offset, "next_offset": next_offset}
+    if fmt == "columnar":
+        body.update({"time": page["time"].round(6).tolist(), "label": page["label"].tolist(),
+                     "labels": CLASS_LABELS})
+    else:
+        body["hits"] = [{"time": round(float(t), 6), "label": CLASS_LABELS[l]}
+                        for t, l in zip(page["time"], page["label"])]
+    return JSONResponse(body, headers=headers)
 
-    with open(hits_path, "r") as f:
-        data = json.load(f)  # data is a list
 
-    print("Hits loaded:", len(data))  # just len(data)
-    return {"hits": data}  # wrap list in dict so JS can use data.hits  # { "hits": [ { "time": ..., "label": ... }, ... ] }
+@app.get("/stems/{file:path}")
+def get_stem(file: str, fmt: str = Query("mp3", alias="format", pattern="^(mp3|wav)$"),
+             bitrate: Optional[int] = None):
+    """
+    A separated stem, compressed on first request and cached next to the WAV.
+    Served as a file response, so Range requests (seeking) get 206 partial content.
+    """
+    source = (OUTPUT_DIR / file).resolve()
+    if (not source.is_relative_to(OUTPUT_DIR.resolve()) or source.suffix != ".wav"
+            or not source.is_file()):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown stem: {file}")
+    # Hold the cache entry until the response is sent, eviction would pull the file away
+    lease = ExitStack()
+    lease.enter_context(cache.in_use(source.relative_to(OUTPUT_DIR.resolve()).parts[0]))
+    if fmt == "wav":
+        return FileResponse(source, media_type="audio/wav", background=BackgroundTask(lease.close))
+    try:
+        target = transcoder.mp3(source, bitrate)
+    except ValueError as e:
+        lease.close()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except BaseException:
+        lease.close()
+        raise
+    # Stems live under content-addressed cache keys, so a URL never changes content
+    return FileResponse(target, media_type=MEDIA_TYPES[fmt], background=BackgroundTask(lease.close),
+                        headers={"Cache-Control": "public, max-age=86400"})
 
 
 @app.get("/home")
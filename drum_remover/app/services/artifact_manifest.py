@@ -0,0 +1,109 @@
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Stable hash of JSON-serialisable parts (hashes, parameter dicts, ...).
+    """
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ArtifactManifest:
+    """
+    Provenance of the analysis artefacts of one drum stem (<stem>.manifest.json).
+    For every stage it records a fingerprint of the stage inputs (content
+    hashes + parameters) and a hash of its output, so a stage is only
+    recomputed when something it depends on actually changed; downstream
+    stages key on the upstream *output* hash, so a rerun that produces the
+    same onsets keeps the mel windows and hits.
+    """
+
+    def __init__(self, drums_path: Path):
+        self.drums_path = Path(drums_path)
+        self.path = self.drums_path.with_suffix(".manifest.json")
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"version": MANIFEST_VERSION, "source": {}, "stages": {}}
+        if data.get("version") != MANIFEST_VERSION:
+            logger.info("Ignoring manifest %s (version %s)", self.path, data.get("version"))
+            return {"version": MANIFEST_VERSION, "source": {}, "stages": {}}
+        return data
+
+    def source_hash(self) -> str:
+        """
+        Content hash of the drum stem, re-hashed only when its size or mtime changed.
+        """
+        st = self.drums_path.stat()
+        with self._lock:
+            source = self._data["source"]
+            if source.get("size") == st.st_size and source.get("mtime_ns") == st.st_mtime_ns:
+                return source["sha256"]
+        sha = file_sha256(self.drums_path)
+        with self._lock:
+            self._data["source"] = {"name": self.drums_path.name, "size": st.st_size,
+                                    "mtime_ns": st.st_mtime_ns, "sha256": sha}
+        return sha
+
+    def entry(self, stage: str) -> Optional[dict]:
+        with self._lock:
+            return self._data["stages"].get(stage)
+
+    def is_fresh(self, stage: str, stage_fingerprint: str, output: Path) -> bool:
+        """
+        True when output exists and was produced from inputs with this fingerprint.
+        """
+        entry = self.entry(stage)
+        return (entry is not None and entry["fingerprint"] == stage_fingerprint
+                and Path(output).exists())
+
+    def output_hash(self, stage: str) -> Optional[str]:
+        entry = self.entry(stage)
+        return entry["output_hash"] if entry else None
+
+    def record(self, stage: str, stage_fingerprint: str, output: Path, output_hash: str,
+               params: Optional[dict] = None):
+        """
+        Register a freshly written artefact and persist the manifest.
+        """
+        with self._lock:
+            self._data["stages"][stage] = {
+                "fingerprint": stage_fingerprint,
+                "output": Path(output).name,
+                "output_hash": output_hash,
+                "params": params or {},
+                "created_at": time.time(),
+            }
+            self._save()
+
+    def _save(self):
+        # Write-then-rename so a crash never leaves a half-written manifest
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._data, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,115 @@
+import json
+import math
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from config import ANALYSIS_SR, SAMPLE_RATE
+
+
+def stft_sizes(hop: int, n_fft: int, sr: int, ref_sr: int = SAMPLE_RATE) -> tuple[int, int]:
+    """
+    (hop, n_fft) tuned for ref_sr, rescaled for audio at sr. The hop keeps its
+    duration, so frame times are as precise at any rate; n_fft keeps roughly
+    its duration too but stays a power of two for the FFT.
+    """
+    if sr == ref_sr:
+        return hop, n_fft
+    scale = sr / ref_sr
+    return max(1, round(hop * scale)), 2 ** max(0, round(math.log2(n_fft * scale)))
+
+
+class DecodedAudio:
+    """
+    Mono float32 waveform decoded once and shared by every analysis stage
+    (onsets, mel windows, beat tracking). When it comes from a file, the samples
+    are cached next to it as raw float32 (.pcm.<rate>.npy) and memory-mapped,
+    so later stages and later runs read the same pages instead of decoding again.
+    """
+
+    def __init__(self, y: np.ndarray, sr: int, path: Optional[Path] = None):
+        self.y = y
+        self.sr = sr
+        self.path = path
+
+    @property
+    def duration(self) -> float:
+        return len(self.y) / self.sr if self.sr else 0.0
+
+    @property
+    def empty(self) -> bool:
+        return self.y.size == 0 or self.sr == 0
+
+    def resampled(self, sr: Optional[int]) -> "DecodedAudio":
+        """
+        The same audio at sr (polyphase FIR filter, scipy's resample_poly).
+        Returns self when sr is None or already the rate.
+        """
+        if not sr or sr == self.sr or self.empty:
+            return self
+        from scipy.signal import resample_poly
+
+        g = math.gcd(int(sr), int(self.sr))
+        y = resample_poly(self.y, sr // g, self.sr // g).astype(np.float32, copy=False)
+        return DecodedAudio(y, sr, self.path)
+
+    @staticmethod
+    def cache_paths(path: Path, sr: Optional[int] = None) -> tuple[Path, Path]:
+        # One cache per rate: decoding at another rate never replaces a file in use
+        tag = sr or "native"
+        return path.with_suffix(f".pcm.{tag}.npy"), path.with_suffix(f".pcm.{tag}.json")
+
+    @staticmethod
+    def _write_atomic(target: Path, write):
+        # Write-then-rename: other threads may have the old file memory-mapped
+        tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def from_file(cls, path: Path, sr: Optional[int] = None, cache: bool = True) -> "DecodedAudio":
+        """
+        Decode path to mono float32 (native rate if sr is None, else resampled
+        once with resampled()).
+        With cache=True the raw samples are written once and memory-mapped after.
+        """
+        path = Path(path)
+        raw_path, meta_path = cls.cache_paths(path, sr)
+        stat = path.stat()
+        source = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+        if cache and raw_path.exists() and meta_path.exists():
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("source") == source:
+                return cls(np.load(raw_path, mmap_mode="r"), meta["sr"], path)
+
+        import librosa   # heavy, only needed on a cache miss
+
+        y, native_sr = librosa.load(path, sr=None, mono=True, dtype=np.float32)
+        audio = cls(y, native_sr, path).resampled(sr)
+        if not cache:
+            return audio
+
+        # Samples first, the metadata marks the cache valid
+        cls._write_atomic(raw_path, lambda f: np.save(f, audio.y))
+        meta = {"sr": audio.sr, "native_sr": native_sr, "source": source}
+        cls._write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+        return cls(np.load(raw_path, mmap_mode="r"), audio.sr, path)
+
+
+def as_decoded(audio: Union[Path, str, DecodedAudio], sr: Optional[int] = ANALYSIS_SR) -> DecodedAudio:
+    """
+    Accept either an already decoded buffer (used as is) or a path to decode at sr.
+    """
+    if isinstance(audio, DecodedAudio):
+        return audio
+    return DecodedAudio.from_file(Path(audio), sr=sr)
@@ -1,83 +1,312 @@
 from pathlib import Path
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from demucs.separate import main as demucs_main
-from config import OUTPUT_DIR
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+import torch
+
+from config import OUTPUT_DIR, DEMUCS_MODEL, LONG_AUDIO_SECONDS, BULK_GROUP_SECONDS
+from config import PREVIEW_SECONDS, PREVIEW_MODEL, PREVIEW_SHIFTS, PREVIEW_OVERLAP
+from services.separation_engine import SeparationEngine, get_engine, decode_audio, encode_audio
+from services.result_cache import ResultCache
+from services.metrics import metrics
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+class SeparationResult:
+    """
+    Stems of one separation, kept in memory.
+    paths are where the stems live (on_disk) or will be written (write pending).
+    When on_disk (cache hit, long-audio mode) the arrays are None.
+    """
+
+    def __init__(self, key: str, song_name: str, samplerate: int, paths: dict,
+                 drums: Optional[torch.Tensor] = None, no_drums: Optional[torch.Tensor] = None,
+                 on_disk: bool = False):
+        self.key = key
+        self.song_name = song_name
+        self.samplerate = samplerate
+        self.paths = paths
+        self.drums = drums
+        self.no_drums = no_drums
+        self.on_disk = on_disk
+
+    def drums_mono(self) -> np.ndarray:
+        """
+        Drum stem as mono float32, ready for the analysis stages.
+        """
+        return self.drums.mean(0).numpy().astype(np.float32, copy=False)
+
+
 # Demucs processor class
 class AudioProcessor:
-    def __init__(self, output_dir: str = OUTPUT_DIR, model: str = "htdemucs"):
+    def __init__(self, output_dir: str = OUTPUT_DIR, model: str = DEMUCS_MODEL,
+                 engine: SeparationEngine = None, cache: ResultCache = None,
+                 preview_engine: SeparationEngine = None):
         '''
         Args:
             input_file -> Path to input audio file
             output_dir -> directory to save seperated tracks. seperated/
+            engine -> SeparationEngine to use, defaults to the shared one for `model`
+            cache -> ResultCache for finished stems, defaults to one over output_dir
+            preview_engine -> SeparationEngine for previews, defaults to the shared
+                              one for PREVIEW_MODEL (the same engine unless it differs)
         Returns:
             Path to separated drums file
         '''
         self.model = model
-        self.output_dir = output_dir
+        self.output_dir = Path(output_dir)
+        self.engine = engine or get_engine(model)
+        if preview_engine is None:
+            preview_engine = self.engine if PREVIEW_MODEL == self.engine.model_name else get_engine(PREVIEW_MODEL)
+        self.preview_engine = preview_engine
+        self.cache = cache or ResultCache(self.output_dir)
+        self._writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stem-writer")
 
-    def _run_demucs(self, input_file: str):
+    def _run_demucs(self, wav) -> dict:
         """
-            Run Demucs separation for drums + rest.
+            Run Demucs separation for drums + rest on the resident model.
+            Returns {"drums": tensor, "no_drums": tensor}
         """
-        args = [
-            "--two-stems", "drums",
-            "-n", self.model,
-            "-o", str(self.output_dir),
-            "--shifts", "1",           # Adds shift trick for better quality
-            "--overlap", "0.25",       # Prevents boundary artifacts
-            str(input_file)
-        ]
         try:
-            demucs_main(args)
+            return self.engine.separate(wav)
         except Exception as e:
             raise RuntimeError(f"Demucs failed: {e}")
         
-    def _get_output_paths(self, input_file: Path) -> dict:
-        # Get base information
+    def _get_output_paths(self, input_file: Path, key: str) -> dict:
+        # Outputs live in the cache entry for this audio, so equal names never collide
         song_name = input_file.stem
-        print("song_name -> ", song_name)
-        model_dir = self.output_dir / self.model / song_name
-
-        # Create standard paths
-        drums_path = self.output_dir / f"{song_name}_drums.wav"
-        rest_path = self.output_dir / f"{song_name}_no_drums.wav"
-
-        # Flatten files
-        # Handle model directory files if they exist
-        if model_dir.exists(): # First check: does the model's directory exist?
-            orig_drums = model_dir / "drums.wav"
-            print("orig_drums -> ", orig_drums)
-            orig_rest = model_dir / "no_drums.wav"
-            print("orig_rest -> ", orig_rest)
-
-            if orig_drums.exists(): # Second check: does drums.wav exist?
-                orig_drums.rename(drums_path) # Move/rename if it exists
-
-            if orig_rest.exists():  # Third check: does no_drums.wav exist?
-                orig_rest.rename(rest_path)  # Move/rename if it exists
-        
-        return {"drums": drums_path, "rest": rest_path}
+        output_paths = self.cache.paths(key, song_name)
+        output_paths["drums"].parent.mkdir(parents=True, exist_ok=True)
+        return output_paths
     
-    def separate_drums(self, input_file: str) -> dict:
+    def separate_drums(self, input_file: str, in_memory: bool = False,
+                       on_miss: Optional[Callable[[Optional[torch.Tensor]], None]] = None):
         """
         Synchronously separate drums from input file.
         Returns dictionary with paths to drums and rest.
+        With in_memory=True nothing is written: returns a SeparationResult holding
+        the stem tensors; write them later with save_stems / save_stems_async.
+        on_miss is called right before the model runs, only when the result is
+        not cached, with the decoded input (None in long-audio mode); the job
+        runner publishes its preview tier from there.
         """
         input_file = Path(input_file)
         if not input_file.exists():
             raise FileNotFoundError(f"Input file not found: {input_file}")
-        self._run_demucs(input_file)
-        output_paths = self._get_output_paths(input_file)
+        if self.engine.duration(input_file) > LONG_AUDIO_SECONDS:
+            output_paths = self.separate_long(input_file, on_miss)
+            if in_memory:
+                return SeparationResult(output_paths["key"], input_file.stem,
+                                        self.engine.samplerate, output_paths, on_disk=True)
+            return output_paths
+        try:
+            with metrics.stage("decode") as st:
+                wav = self.engine.load(input_file)
+                st.items = wav.shape[-1]
+        except Exception as e:
+            raise RuntimeError(f"Failed to decode {input_file}: {e}")
+
+        params = self.engine.settings()
+        key = self.cache.make_key(wav, self.engine.model_name, params)
+        with self.cache.key_lock(key):
+            cached = self.cache.lookup(key)
+            if cached:
+                logger.info("✅ Reusing cached separation: %s", cached)
+                if in_memory:
+                    return SeparationResult(key, input_file.stem, self.engine.samplerate,
+                                            cached, on_disk=True)
+                return cached
+
+            if on_miss:
+                on_miss(wav)
+            with metrics.stage("separation", items=wav.shape[-1]):
+                stems = self._run_demucs(wav)
+            result = SeparationResult(key, input_file.stem, self.engine.samplerate,
+                                      self._get_output_paths(input_file, key),
+                                      drums=stems["drums"], no_drums=stems["no_drums"])
+            if in_memory:
+                return result
+            output_paths = self.save_stems(result)
 
         logger.info("✅ Separation complete. Files saved: %s", output_paths)
         return output_paths
-    
+
+    def separate_preview(self, input_file: str, seconds: float = PREVIEW_SECONDS,
+                         wav: Optional[torch.Tensor] = None) -> dict:
+        """
+        Quick, lower-quality stems of the first `seconds` of the input, to play
+        while the full separation runs: preview engine, no shift trick, small
+        overlap, and only `seconds` of audio decoded. Cached like full results.
+        wav: the whole input, already decoded by the main engine; its head is
+        used instead of decoding again when the preview engine's rate matches.
+        Returns dictionary with paths to drums and rest.
+        """
+        input_file = Path(input_file)
+        if not input_file.exists():
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+        engine = self.preview_engine
+        with metrics.stage("preview") as st:
+            if wav is not None and engine.samplerate == self.engine.samplerate:
+                wav = wav[..., :int(seconds * engine.samplerate)]
+            else:
+                wav = engine.load(input_file, duration=seconds)
+            st.items = wav.shape[-1]
+            params = {"shifts": PREVIEW_SHIFTS, "overlap": PREVIEW_OVERLAP, "segment": engine.segment,
+                      "preview_seconds": seconds}
+            key = self.cache.make_key(wav, engine.model_name, params)
+            with self.cache.key_lock(key):
+                output_paths = self.cache.lookup(key)
+                if output_paths is None:
+                    try:
+                        stems = engine.separate(wav, shifts=PREVIEW_SHIFTS, overlap=PREVIEW_OVERLAP)
+                    except Exception as e:
+                        raise RuntimeError(f"Demucs failed: {e}")
+                    output_paths = self._get_output_paths(input_file, key)
+                    engine.save(stems["drums"], output_paths["drums"])
+                    engine.save(stems["no_drums"], output_paths["rest"])
+                    self.cache.commit(key, input_file.stem, engine.model_name, params)
+        logger.info("✅ Preview ready (%gs): %s", seconds, output_paths)
+        return output_paths
+
+    def separate_long(self, input_file: str,
+                      on_miss: Optional[Callable[[Optional[torch.Tensor]], None]] = None) -> dict:
+        """
+        Memory-bounded separation for very long inputs: windows with crossfaded
+        joins, stems streamed to disk (see SeparationEngine.separate_long).
+        Cached by the raw file content; on_miss as in separate_drums.
+        Returns dictionary with paths to drums and rest (+ the cache key).
+        """
+        input_file = Path(input_file)
+        params = self.engine.settings()
+        key = self.cache.make_file_key(input_file, self.engine.model_name, params)
+        with self.cache.key_lock(key):
+            output_paths = self.cache.lookup(key)
+            if output_paths is None:
+                if on_miss:
+                    on_miss(None)
+                output_paths = self._get_output_paths(input_file, key)
+                try:
+                    with metrics.stage("separation"):
+                        self.engine.separate_long(input_file, output_paths)
+                except Exception as e:
+                    raise RuntimeError(f"Demucs failed: {e}")
+                self.cache.commit(key, input_file.stem, self.engine.model_name, params)
+                logger.info("✅ Long separation complete. Files saved: %s", output_paths)
+        return {**output_paths, "key": key}
+
+    def save_stems(self, result: SeparationResult) -> dict:
+        """
+        Encode and write the stems of an in-memory result, then register them in the cache.
+        """
+        if not result.on_disk:
+            self.engine.save(result.drums, result.paths["drums"])
+            self.engine.save(result.no_drums, result.paths["rest"])
+            self.cache.commit(result.key, result.song_name, self.engine.model_name,
+                              self.engine.settings())
+        return result.paths
+
+    def save_stems_async(self, result: SeparationResult) -> Future:
+        """
+        save_stems on a background writer thread. The Future resolves to the paths.
+        """
+        return self._writer.submit(self.save_stems, result)
+
+    def _bulk_pool(self, workers: int) -> Executor:
+        # spawn: forking after torch has started its thread pool can deadlock
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _decoded_groups(self, pool: Executor, input_files: list[Path],
+                        group_seconds: float) -> Iterator[list[tuple[Path, torch.Tensor]]]:
+        """
+        Decode input_files one ahead on pool and yield them in order, grouped
+        up to group_seconds of audio (a longer file makes a group of its own).
+        """
+        sr = self.engine.samplerate
+        channels = self.engine.model.audio_channels
+        limit = int(group_seconds * sr)
+        group, length = [], 0
+        decode = pool.submit(decode_audio, input_files[0], sr, channels) if input_files else None
+        for i, input_file in enumerate(input_files):
+            wav = torch.from_numpy(decode.result())
+            if i + 1 < len(input_files):
+                decode = pool.submit(decode_audio, input_files[i + 1], sr, channels)
+            if group and length + wav.shape[-1] > limit:
+                yield group
+                group, length = [], 0
+            group.append((input_file, wav))
+            length += wav.shape[-1]
+        if group:
+            yield group
+
+    def separate_many(self, input_files: list, batch_size: int = 8, workers: int = None,
+                      group_seconds: float = BULK_GROUP_SECONDS) -> list[dict]:
+        """
+        Separate several files (bulk imports).
+        Files are decoded in a process pool (one ahead of the model) and grouped
+        up to group_seconds of audio, so memory stays bounded; each group is one
+        separate_batch call, which packs segments from all of its files into
+        shared batches of batch_size. A group holds the cache key locks of its
+        files, like separate_drums, so a job with the same audio never
+        separates it twice.
+        The forward pass runs on torch's current intra-op threads: that setting
+        is process-wide and shared with the job workers, so it is left alone
+        (run bulk imports in their own process to give them every core).
+        Returns one {"drums": path, "rest": path} dict per input, in order.
+        """
+        input_files = [Path(f) for f in input_files]
+        for input_file in input_files:
+            if not input_file.exists():
+                raise FileNotFoundError(f"Input file not found: {input_file}")
+
+        workers = workers or os.cpu_count() or 1
+        sr = self.engine.samplerate
+        params = self.engine.settings()
+        results, separated = [], 0
+
+        with self._bulk_pool(workers) as pool:
+            for group in self._decoded_groups(pool, input_files, group_seconds):
+                keys = [self.cache.make_key(wav, self.engine.model_name, params) for _, wav in group]
+                with ExitStack() as held:
+                    # Sorted, so two bulk imports sharing files can't wait on each other;
+                    # in_use keeps this group's commits from evicting each other
+                    for key in sorted(set(keys)):
+                        held.enter_context(self.cache.key_lock(key))
+                        held.enter_context(self.cache.in_use(key))
+                    paths = {key: self.cache.lookup(key) for key in keys}
+                    todo, wavs = {}, []   # key -> file to separate, its audio
+                    for (input_file, wav), key in zip(group, keys):
+                        if paths[key] is None and key not in todo:
+                            todo[key] = input_file
+                            wavs.append(wav)
+                    del group
+                    if todo:
+                        with metrics.stage("separation", items=sum(w.shape[-1] for w in wavs)):
+                            stems = self.engine.separate_batch(wavs, batch_size=batch_size)
+                        del wavs
+                        writes = []
+                        for (key, input_file), stem in zip(todo.items(), stems):
+                            paths[key] = self._get_output_paths(input_file, key)
+                            writes.append(pool.submit(encode_audio, stem["drums"].numpy(), paths[key]["drums"], sr))
+                            writes.append(pool.submit(encode_audio, stem["no_drums"].numpy(), paths[key]["rest"], sr))
+                        del stems
+                        for write in writes:
+                            write.result()
+                        for key, input_file in todo.items():
+                            self.cache.commit(key, input_file.stem, self.engine.model_name, params)
+                        separated += len(todo)
+                    results.extend(paths[key] for key in keys)
+
+        logger.info("✅ Batch separation complete: %d files, %d separated, %d cached",
+                    len(input_files), separated, len(input_files) - separated)
+        return results
+
     async def separate_drums_async(self, input_file: str) -> dict:
         """
         Async wrapper to run separation in a thread pool.
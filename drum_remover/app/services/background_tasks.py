@@ -1,65 +1,172 @@
 from pathlib import Path
+from typing import Optional
 import json
 
-import librosa
 import numpy as np
+import soundfile as sf
 
-from services.onset_detector import OnsetDetector
+from config import ANALYSIS_SR, ANALYSIS_STAGE_WORKERS, SAMPLE_RATE, HIT_EVENT_BATCH, LONG_AUDIO_SECONDS
+from services.audio_buffer import DecodedAudio
+from services.onset_detector import OnsetDetector, BeatGrid
 from services.cnn_preparer import CNNPreparer
-from services.drum_classifier import DrumClassifier
+from services.drum_classifier import DrumClassifier, CLASS_LABELS, labels_to_names
 from services.midi_writer import MIDIWriter
+from services.metrics import metrics, current_job
+from services.event_bus import events
+from services.stage_graph import StageGraph
+from services.hit_store import HitStore, hits_index_path
 
 detector = OnsetDetector()
 cnn = CNNPreparer()
 dclassifier = DrumClassifier()
 
-def detect_onsets_task(drum_path: Path):
+
+def warm_up(seconds: float = 2.0):
+    """
+    Run the analysis on a short noise burst so librosa's lazy submodules and
+    numba's JIT caches are built before the first real stem arrives.
+    """
+    y = np.random.default_rng(0).standard_normal(int(seconds * SAMPLE_RATE)).astype(np.float32) * 0.1
+    audio = DecodedAudio(y, SAMPLE_RATE).resampled(ANALYSIS_SR)
+    onset_env = detector.onset_envelope(audio.y, audio.sr)
+    detector.detect_onsets(audio.y, audio.sr, onset_env)
+    detector.beat_grid(onset_env, audio.sr)
+    cnn.mel_spectrogram(audio.y, audio.sr)
+
+def detect_onsets_task(drum_path: Path, audio: Optional[DecodedAudio] = None):
     """
     Background task to detect onsets for a drum stem.
     Saves results to a JSON file with same name as drum stem.
+    audio: the drum stem already in memory (straight from separation); when
+    missing it is decoded from drum_path. Either way it is resampled once to
+    ANALYSIS_SR before any stage runs.
+    Stages run as a graph: the onset envelope and the mel spectrogram start
+    together; onsets and the beat grid are both read off the one envelope,
+    mel windows follow once onsets are known, MIDI once hits and the tempo
+    map are both in.
+    Stems longer than LONG_AUDIO_SECONDS that only exist on disk (windowed
+    separation) get their onsets and envelope from stream_onsets, block by
+    block, instead of one STFT over the whole stem.
+    Failures are re-raised so the job running the analysis reports them.
     """
     try:
-        y, sr = detector.load_audio(drum_path)
-        if y.size == 0:
+        streamed = audio is None and sf.info(str(drum_path)).duration > LONG_AUDIO_SECONDS
+
+        # Decode once, every stage below reads the same buffer
+        if audio is None:
+            with metrics.stage("decode") as st:
+                audio = DecodedAudio.from_file(drum_path, sr=ANALYSIS_SR)
+                st.items = len(audio.y)
+        elif ANALYSIS_SR and audio.sr != ANALYSIS_SR:
+            with metrics.stage("resample") as st:
+                audio = audio.resampled(ANALYSIS_SR)
+                st.items = len(audio.y)
+        if audio.empty:
             print(f"[OnsetTask] Empty audio {drum_path}")
             return
-        # Detect onsets
-        onset_times = detector.detect_onsets(y, sr)
-
-        # Save to JSON
-        out_json = drum_path.with_suffix(".onsets.json")
-        with open(out_json, "w") as f:
-            json.dump({"onsets": onset_times}, f)
-
-        print(f"✅ Onset detection complete: {len(onset_times)} hits saved to {out_json}")
-
-        # CNN PREP (MEL WINDOWS EXTRACTION)
-        print(f"[Task] Running CNN preparation...")
-        cnn_batch = cnn.prepare_for_cnn(drum_path, onset_times)
-        cnn_out_path = drum_path.with_suffix(".mel_windows.npy")
-        np.save(cnn_out_path, cnn_batch)
-
-        # Drum Classification
-        print(f"[Task] Classifying drum hits...")
-        labels = dclassifier.classify_batch(cnn_batch)
-
-        # Combine times + labels
-        hits = [{"time": t, "label": l} for t, l in zip(onset_times, labels)]
-        hits_json_path = drum_path.with_suffix(".hits.json")
-        with open(hits_json_path, "w") as f:
-            json.dump(hits, f)
-        print(f"✅ Drum hits classified and saved: {hits_json_path}")
-
-        # --- DETECT SONG BPM DYNAMICALLY ---
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        tempo = float(tempo)  # <-- convert from numpy scalar to Python float
-        print(f"[INFO] Detected BPM: {tempo:.2f}")
-
-        # --- GENERATE MIDI ---
-        midi_writer = MIDIWriter(bpm=tempo)                # Pass dynamic BPM
-        midi_path = drum_path.with_suffix(".mid")          # same filename but .mid
-        midi_writer.write(hits, midi_path)
-        print(f"✅ MIDI drum track generated at {tempo:.2f} BPM → {midi_path}")
+
+        def envelope():
+            with metrics.stage("onset_envelope"):
+                return detector.onset_envelope(audio.y, audio.sr)
+
+        def stream():
+            # Native rate, read block by block: (onset times, envelope, its rate)
+            blocks = []
+            with metrics.stage("onsets") as st:
+                onset_times = list(detector.stream_onsets(drum_path, envelope=blocks))
+                st.items = len(onset_times)
+            return onset_times, np.concatenate(blocks), sf.info(str(drum_path)).samplerate
+
+        def onsets(onset_env) -> list[float]:
+            with metrics.stage("onsets") as st:
+                onset_times = detector.detect_onsets(audio.y, audio.sr, onset_env)
+                st.items = len(onset_times)
+            return save_onsets(onset_times)
+
+        def save_onsets(onset_times) -> list[float]:
+            # Save to JSON
+            out_json = drum_path.with_suffix(".onsets.json")
+            with open(out_json, "w") as f:
+                json.dump({"onsets": onset_times}, f)
+            print(f"✅ Onset detection complete: {len(onset_times)} hits saved to {out_json}")
+            return onset_times
+
+        def mel_spectrogram():
+            # Independent of the onsets: the expensive half of the CNN prep
+            with metrics.stage("mel_spectrogram"):
+                return cnn.mel_spectrogram(audio.y, audio.sr)
+
+        def beats(onset_env, sr=None) -> BeatGrid:
+            # --- DETECT SONG BPM + TEMPO MAP DYNAMICALLY (same envelope as the onsets) ---
+            with metrics.stage("bpm") as st:
+                grid = detector.beat_grid(onset_env, sr or audio.sr)
+                st.items = len(grid.beats)
+            with open(drum_path.with_suffix(".beats.json"), "w") as f:
+                json.dump(grid.to_dict(), f)
+            print(f"[INFO] Detected BPM: {grid.bpm:.2f} ({len(grid.tempo_map)} tempo segments)")
+            return grid
+
+        def mel_windows(onset_times, mel) -> Path:
+            # CNN PREP (MEL WINDOWS EXTRACTION)
+            print(f"[Task] Running CNN preparation...")
+            cnn_out_path = drum_path.with_suffix(".mel_windows.npy")
+            with metrics.stage("mel_prep", items=len(onset_times)):
+                cnn.save_windows(audio, onset_times, cnn_out_path, mel=mel)
+            return cnn_out_path
+
+        def classify(onset_times, cnn_out_path) -> list[dict]:
+            # Drum Classification
+            print(f"[Task] Classifying drum hits...")
+            job_id = current_job.get()
+            batches = []
+            with metrics.stage("classify") as st:
+                # Hits go out to the job's push channel batch by batch
+                for batch in dclassifier.iter_classify_from_file(cnn_out_path, HIT_EVENT_BATCH):
+                    offset = sum(len(b) for b in batches)
+                    batches.append(batch)
+                    events.publish(job_id, {
+                        "type": "hits", "offset": offset,
+                        "hits": [{"time": round(float(t), 6), "label": CLASS_LABELS[l]}
+                                 for t, l in zip(onset_times[offset:offset + len(batch)], batch)],
+                    }, keep=True)
+                label_ids = np.concatenate(batches) if batches else np.empty(0, dtype=np.uint8)
+                st.items = len(label_ids)
+            labels = labels_to_names(label_ids)
+
+            # Combine times + labels
+            hits = [{"time": t, "label": l} for t, l in zip(onset_times, labels)]
+            hits_json_path = drum_path.with_suffix(".hits.json")
+            with open(hits_json_path, "w") as f:
+                json.dump(hits, f)
+            # Time-sorted index served by /hits
+            HitStore.write(hits_index_path(drum_path), onset_times[:len(label_ids)], label_ids)
+            print(f"✅ Drum hits classified and saved: {hits_json_path}")
+            return hits
+
+        def midi(hits, grid):
+            # --- GENERATE MIDI ---
+            tempo = grid.bpm or 120.0
+            midi_writer = MIDIWriter(bpm=tempo, tempo_map=grid.tempo_map)   # Pass dynamic tempo
+            midi_path = drum_path.with_suffix(".mid")          # same filename but .mid
+            with metrics.stage("midi", items=len(hits)):
+                midi_writer.write(hits, midi_path)
+            print(f"✅ MIDI drum track generated at {tempo:.2f} BPM → {midi_path}")
+
+        graph = StageGraph(max_workers=ANALYSIS_STAGE_WORKERS).add("mel", mel_spectrogram)
+        if streamed:
+            (graph.add("stream", stream)
+                .add("onsets", lambda s: save_onsets(s[0]), deps=("stream",))
+                .add("beats", lambda s: beats(s[1], s[2]), deps=("stream",)))
+        else:
+            (graph.add("envelope", envelope)
+                .add("onsets", onsets, deps=("envelope",))
+                .add("beats", beats, deps=("envelope",)))
+        (graph
+            .add("windows", mel_windows, deps=("onsets", "mel"))
+            .add("hits", classify, deps=("onsets", "windows"))
+            .add("midi", midi, deps=("hits", "beats"))
+            .run())
 
     except Exception as e:
         print(f"[OnsetTask] Failed for {drum_path}: {e}")
+        raise
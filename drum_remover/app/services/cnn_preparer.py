@@ -1,17 +1,39 @@
 import numpy as np
 import librosa
 from pathlib import Path
-from skimage.transform import resize
+from typing import Iterator, Optional, Union
+
+from config import ANALYSIS_SR
+from services.audio_buffer import DecodedAudio, as_decoded, stft_sizes
+from services.feature_store import MelWindowStore
+
+
+def _resize_matrix(n_in: int, n_out: int) -> np.ndarray:
+    """
+    (n_out, n_in) matrix doing 1-D linear interpolation with the same pixel
+    mapping as skimage resize(order=1, mode="constant", cval=0).
+    Applying one of these per axis resizes a whole batch in two matmuls.
+    """
+    coords = (np.arange(n_out) + 0.5) * (n_in / n_out) - 0.5
+    lo = np.floor(coords).astype(int)
+    frac = coords - lo
+    matrix = np.zeros((n_out, n_in))
+    rows = np.arange(n_out)
+    for idx, w in ((lo, 1.0 - frac), (lo + 1, frac)):
+        valid = (idx >= 0) & (idx < n_in)   # outside the input counts as cval=0
+        matrix[rows[valid], idx[valid]] += w[valid]
+    return matrix
+
 
 class CNNPreparer:
-    def __init__(self, target_shape: tuple[int, int]= (256, 256),
+    def __init__(self, target_shape: Optional[tuple[int, int]] = (256, 256),
                  window_size_sec: float = 0.32,
                  pre_offset_sec: float = 0.03,
                  n_mels: int = 64,
                  fmax: int = 12000):
         """
         Args:
-            target_shape: Desired (height, width) for CNN input
+            target_shape: Desired (height, width) for CNN input, None keeps native n_mels x frames
             window_size_sec: Total duration of each window
             pre_offset_sec: Time before onset to include in window
             n_mels: Number of mel frequency bins
@@ -22,6 +44,27 @@ class CNNPreparer:
         self.pre_offset_sec = pre_offset_sec
         self.n_mels = n_mels
         self.fmax = fmax
+        self.n_fft = 2048   # at 44.1 kHz, rescaled for the analysis rate (see _stft)
+        self.hop = 512
+        self._resize_cache: dict[tuple[int, int, int, int], tuple[np.ndarray, np.ndarray]] = {}
+
+    def params(self) -> dict:
+        """
+        Settings that change the windows (for artefact manifests).
+        """
+        return {
+            "target_shape": list(self.target_shape) if self.target_shape else None,
+            "window_size_sec": self.window_size_sec,
+            "pre_offset_sec": self.pre_offset_sec,
+            "n_mels": self.n_mels,
+            "fmax": self.fmax,
+            "n_fft": self.n_fft,
+            "hop": self.hop,
+            "analysis_sr": ANALYSIS_SR,
+        }
+
+    def _stft(self, sr: int) -> tuple[int, int]:
+        return stft_sizes(self.hop, self.n_fft, sr)
 
     def _extract_window(self, y: np.ndarray, sr: int, onset_time: float) -> np.ndarray:
         """
@@ -33,44 +76,128 @@ class CNNPreparer:
         return y[start:end]
 
 
-    def prepare_for_cnn(self, audio_path: Path, onset_times: list[float]) -> np.ndarray:
+    def _resizers(self, n_mels: int, n_frames: int) -> tuple[np.ndarray, np.ndarray]:
+        key = (n_mels, n_frames, *self.target_shape)
+        if key not in self._resize_cache:
+            self._resize_cache[key] = (
+                _resize_matrix(n_mels, self.target_shape[0]).astype(np.float32),
+                _resize_matrix(n_frames, self.target_shape[1]).astype(np.float32))
+        return self._resize_cache[key]
+
+    def _frames_per_window(self, sr: int) -> int:
+        return 1 + int(self.window_size_sec * sr) // self._stft(sr)[0]
+
+    def window_shape(self, sr: int) -> tuple[int, int]:
+        """
+        (height, width) of every window: target_shape, or native n_mels x frames
+        when target_shape is None.
+        """
+        if self.target_shape is None:
+            return (self.n_mels, self._frames_per_window(sr))
+        return tuple(self.target_shape)
+
+    def _window_frames(self, n_samples: int, sr: int, onset_times: list[float]) -> np.ndarray:
+        """
+        First spectrogram frame of every usable window (onsets past the end are skipped).
+        """
+        onsets = np.asarray(onset_times, dtype=np.float64)
+        starts = np.maximum(((onsets - self.pre_offset_sec) * sr).astype(int), 0)
+        starts = starts[starts < n_samples]   # same as skipping empty windows
+        return np.rint(starts / self._stft(sr)[0]).astype(int)
+
+    def count_windows(self, y: np.ndarray, sr: int, onset_times: list[float]) -> int:
+        return len(self._window_frames(len(y), sr, onset_times))
+
+    def mel_spectrogram(self, y: np.ndarray, sr: int) -> np.ndarray:
+        """
+        Mel power spectrogram of the whole stem, padded so every window fits.
+        Does not depend on the onsets, so it can be computed while they are detected.
+        """
+        hop, n_fft = self._stft(sr)
+        mel = librosa.feature.melspectrogram(
+            y=y,
+            sr=sr,
+            n_fft=n_fft,
+            hop_length=hop,
+            n_mels=self.n_mels,
+            fmax=min(self.fmax, sr / 2)
+        )
+        n_frames = self._frames_per_window(sr)
+        return np.pad(mel, ((0, 0), (0, n_frames)))   # frames past the end stay silent
+
+    def iter_windows(self, y: np.ndarray, sr: int, onset_times: list[float],
+                     chunk_size: int = 256, mel: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+        """
+        Batched mel-window extraction on a decoded waveform.
+        One mel spectrogram is computed for the whole stem (or passed in as mel,
+        see mel_spectrogram), onset windows are gathered from it with strided
+        indexing, and dB conversion, resize and normalisation run over
+        (chunk_size, H, W) arrays at once.
+        Yields float32 arrays of shape (n, height, width, 1), n <= chunk_size.
+        """
+        first = self._window_frames(len(y), sr, onset_times)
+        if first.size == 0:
+            return
+
+        # 1 - one mel spectrogram for the whole stem
+        if mel is None:
+            mel = self.mel_spectrogram(y, sr)
+        n_frames = self._frames_per_window(sr)
+
+        for i in range(0, len(first), chunk_size):
+            # 2 - gather (n, n_mels, n_frames) windows
+            frames = first[i:i + chunk_size, None] + np.arange(n_frames)[None, :]
+            windows = np.moveaxis(mel[:, frames], 1, 0)
+            # 3 - power_to_db(ref=np.max, top_db=80) per window
+            amin = 1e-10
+            mel_db = 10.0 * np.log10(np.maximum(windows, amin))
+            mel_db -= 10.0 * np.log10(np.maximum(windows.max(axis=(1, 2), keepdims=True), amin))
+            mel_db = np.maximum(mel_db, mel_db.max(axis=(1, 2), keepdims=True) - 80.0)
+            # 4 - resize for cnn: rows @ window @ cols^T for the whole chunk
+            if self.target_shape is not None:
+                rows, cols = self._resizers(self.n_mels, n_frames)
+                mel_db = np.einsum("hm,nmf,wf->nhw", rows, mel_db, cols, optimize=True)
+            # 5 - Normalize 0-1 per window
+            lo = mel_db.min(axis=(1, 2), keepdims=True)
+            hi = mel_db.max(axis=(1, 2), keepdims=True)
+            mel_norm = ((mel_db - lo) / (hi - lo + 1e-6)).astype(np.float32)
+            # 6 - Add channel dimension
+            yield mel_norm[..., np.newaxis]
+
+    def prepare_windows(self, y: np.ndarray, sr: int, onset_times: list[float]) -> np.ndarray:
+        """
+        All windows as one array.
+        Returns:
+            Array of shape (num_windows, height, width, 1) ready for CNN
+        """
+        chunks = list(self.iter_windows(y, sr, onset_times))
+        if not chunks:
+            return np.empty((0, *self.window_shape(sr), 1), dtype=np.float32)
+        return np.concatenate(chunks, axis=0)
+
+    def save_windows(self, audio: Union[Path, DecodedAudio], onset_times: list[float],
+                     out_path: Path, store: MelWindowStore = None,
+                     mel: Optional[np.ndarray] = None) -> int:
+        """
+        Write windows to a compact store chunk by chunk, without holding the
+        whole batch in memory. Returns the number of windows written.
+        mel: precomputed mel_spectrogram of the stem
+        """
+        audio = as_decoded(audio)
+        store = store or MelWindowStore()
+        n = self.count_windows(audio.y, audio.sr, onset_times)
+        print(f"[CNN] Processing {n} windows → {out_path}")
+        store.write(out_path, self.iter_windows(audio.y, audio.sr, onset_times, mel=mel),
+                    n, self.window_shape(audio.sr))
+        return n
+
+    def prepare_for_cnn(self, audio: Union[Path, DecodedAudio], onset_times: list[float]) -> np.ndarray:
         """
         Full pipeline: extract windows → convert to mel-spectrogram → normalize → resize
+        audio: already decoded stem (shared with the other stages) or a path to it
         Returns:
             Array of shape (num_windows, height, width, 1) ready for CNN
         """
-        # Load audio
-        y, sr = librosa.load(audio_path, sr=None, mono=True)
-
-        mel_batches = []
-
-        for i, onset in enumerate(onset_times):
-            if i % 50 == 0:
-                print(f"[CNN] Processing window {i+1}/{len(onset_times)}")
-            # 1 - extract raw audio window
-            window = self._extract_window(y, sr, onset)
-            if len(window) == 0:
-                continue
-            # 2 - mel spectrogram
-            mel = librosa.feature.melspectrogram(
-                y=window,
-                sr=sr,
-                n_mels=self.n_mels,
-                fmax = self.fmax
-            )
-            mel_db = librosa.power_to_db(mel, ref=np.max)
-            # 3 - resize for cnn
-            mel_resized = resize(mel_db, self.target_shape, mode="constant")
-            # 4 - Normalize 0-1
-            mel_norm = (
-                mel_resized - mel_resized.min()
-            ) / (mel_resized.max() - mel_resized.min() + 1e-6)
-            # 5 - Add channel dimension
-            mel_norm = np.expand_dims(mel_norm, axis=-1)
-
-            mel_batches.append(mel_norm)
-
-        if not mel_batches:
-            return np.empty((0, *self.target_shape, 1))
-        
-        return np.stack(mel_batches, axis=0)
+        audio = as_decoded(audio)
+        print(f"[CNN] Processing {len(onset_times)} windows")
+        return self.prepare_windows(audio.y, audio.sr, onset_times)
@@ -4,120 +4,292 @@
 	3.	Predict class per window
 	4.	Save result next to the file:
 """
-# IMPORTANT NOTE: THIS IS MVP VERSION! SO NO ML IS USED
+# IMPORTANT NOTE: THE DEFAULT IS STILL THE MVP HEURISTIC! A trained CNN exported to
+# ONNX or TorchScript can be plugged in with DRUM_CLASSIFIER_MODEL.
 # services/drum_classifier.py
+import logging
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator, List, Dict, Optional
+
 import numpy as np
-from typing import List, Dict
+
+from config import DRUM_CLASSIFIER_MODEL, CLASSIFIER_MICRO_BATCH, CLASSIFIER_THREADS
+from services.feature_store import MelWindowStore
+
+logger = logging.getLogger(__name__)
 
 # Labels supported by the MVP classifier
 CLASS_LABELS = ["kick", "snare", "hihat", "tom1", "tom2", "tom3", "crash", "ride"]
 
-class DrumClassifier:
+# Column order of the (N, 5) band-energy array
+BANDS = ["low", "low_mid", "mid", "high_mid", "high"]
+LABEL_INDEX = {label: i for i, label in enumerate(CLASS_LABELS)}
+
+
+def labels_to_names(label_ids: np.ndarray) -> List[str]:
+    """
+    Map integer labels from classify_batch back to CLASS_LABELS strings.
+    """
+    return [CLASS_LABELS[i] for i in label_ids]
+
+
+class ClassifierBackend(ABC):
+    """
+    Inference backend interface.
+    predict() takes a (N, H, W, 1) batch and returns uint8 indices into CLASS_LABELS.
+    """
+    name = "base"
+
+    def params(self) -> dict:
+        """
+        What identifies this backend's predictions (for artefact manifests).
+        """
+        return {"backend": self.name}
+
+    @abstractmethod
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        ...
+
+
+class HeuristicBackend(ClassifierBackend):
     """
     Rule-based (heuristic) drum classifier for MVP.
-    Input: mel-window (H x W x 1) or batch (N, H, W, 1).
-    Output: label per window.
+    Also the fallback when no CNN model is configured or it fails to load.
     """
+    name = "heuristic"
 
-    def __init__(self):
-        self.labels = CLASS_LABELS
+    def _band_energies(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Split every mel window into coarse frequency bands and return mean energies.
+        batch: (N, n_mels, n_frames)
+        Returns (N, 5) array, columns in BANDS order.
+        """
+        n, n_mels = batch.shape[0], batch.shape[1]
+        # Define approximate band indices (these are heuristics; tune per your n_mels)
+        # We assume n_mels is ~64; adapt if different.
+        edges = [
+            0,
+            int(n_mels * 0.12),   # ~ <200Hz region
+            int(n_mels * 0.30),   # toms / mid
+            int(n_mels * 0.60),   # snare region / mid-high
+            int(n_mels * 0.80),   # high-mid
+            n_mels,
+        ]
+        energies = np.zeros((n, len(BANDS)), dtype=np.float64)
+        for b, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+            if hi > lo:
+                energies[:, b] = batch[:, lo:hi].mean(axis=(1, 2), dtype=np.float64)
+        return energies
 
     def _energy_bands(self, mel: np.ndarray) -> Dict[str, float]:
         """
         Split mel spectrogram into coarse frequency bands and return mean energy.
         Assumes mel.shape = (n_mels, n_frames)
         """
-        n_mels = mel.shape[0]
-        # Define approximate band indices (these are heuristics; tune per your n_mels)
-        # We assume n_mels is ~64; adapt if different.
-        low_end = int(n_mels * 0.12)      # ~ <200Hz region
-        low_mid_end = int(n_mels * 0.30)  # toms / mid
-        mid_end = int(n_mels * 0.60)      # snare region / mid-high
-        high_mid_end = int(n_mels * 0.80) # high-mid
-        # bands
-        low = mel[:low_end].mean() if low_end > 0 else 0.0
-        low_mid = mel[low_end:low_mid_end].mean() if low_mid_end > low_end else 0.0
-        mid = mel[low_mid_end:mid_end].mean() if mid_end > low_mid_end else 0.0
-        high_mid = mel[mid_end:high_mid_end].mean() if high_mid_end > mid_end else 0.0
-        high = mel[high_mid_end:].mean() if n_mels > high_mid_end else 0.0
-
-        return {
-            "low": float(low),
-            "low_mid": float(low_mid),
-            "mid": float(mid),
-            "high_mid": float(high_mid),
-            "high": float(high),
-        }
+        energies = self._band_energies(mel[np.newaxis])[0]
+        return {band: float(e) for band, e in zip(BANDS, energies)}
 
-    def predict_window(self, window: np.ndarray) -> str:
+    def _apply_rules(self, energies: np.ndarray) -> np.ndarray:
         """
-        Predict label for a single window.
-        window: shape (H, W, 1) or (H, W)
-        Returns a string label.
+        Heuristic decision rules over (N, 5) band energies.
+        Rules are checked in order, the first one that matches wins.
         """
-        if window.ndim == 3:
-            mel = window[:, :, 0]
-        else:
-            mel = window
+        low, low_mid, mid, high_mid, high = energies.T
 
-        bands = self._energy_bands(mel)
+        # Basic heuristics (ratios) — tune these if needed.
+        rules = [
+            # Kick: strong low energy relative to others
+            ("kick", low > np.maximum.reduce([low_mid * 1.2, mid * 1.4, high * 1.5])),
+            # Hi-hat: very strong high energy
+            ("hihat", high > np.maximum.reduce([high_mid * 1.1, mid * 1.5, low * 2.0])),
+            # Crash: wideband high/sting and longer decay — captured as strong high_mid + high
+            # Heuristic: both high_mid and high significant relative to mid
+            ("crash", ((high + high_mid) > mid * 1.6) & ((high + high_mid) > low_mid * 1.2)),
+            # Snare: mid + high_mid prominent
+            ("snare", ((mid + high_mid) > low_mid * 1.2) & (mid > low * 0.9)),
+            # Toms: energy concentrated in low-mid / mid (different relative thresholds)
+            # High tom: higher low_mid
+            ("tom1", (low_mid > mid * 1.1) & (low_mid > low * 1.0)),
+            # Mid tom:
+            ("tom2", (low_mid > low) & (mid > low_mid * 0.8)),
+            # Floor tom: more low than low_mid
+            ("tom3", (low > low_mid * 1.1) & (low_mid > mid * 0.8)),
+            # Fallbacks: prefer snare if mid present, else hihat if high present, else unknown->kick
+            ("snare", (mid > low) | (high_mid > low)),
+            ("hihat", high > 0.01),
+        ]
+        return np.select(
+            [mask for _, mask in rules],
+            [LABEL_INDEX[label] for label, _ in rules],
+            default=LABEL_INDEX["kick"],
+        ).astype(np.uint8)
 
-        low = bands["low"]
-        low_mid = bands["low_mid"]
-        mid = bands["mid"]
-        high_mid = bands["high_mid"]
-        high = bands["high"]
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self._apply_rules(self._band_energies(batch[..., 0]))
 
-        # Basic heuristics (ratios) — tune these if needed.
 
-        # Kick: strong low energy relative to others
-        if low > max(low_mid * 1.2, mid * 1.4, high * 1.5):
-            return "kick"
+class CNNBackend(ClassifierBackend):
+    """
+    Base for exported CNN models run on CPU.
+    The model is loaded once; batches are fed in fixed-size micro-batches so
+    memory stays flat and latency per call is predictable.
+    """
+
+    def __init__(self, model_path: Path, micro_batch: int = CLASSIFIER_MICRO_BATCH,
+                 num_threads: Optional[int] = CLASSIFIER_THREADS, layout: str = "NHWC"):
+        """
+        Args:
+            model_path: exported model file
+            micro_batch: windows per forward pass
+            num_threads: intra-op threads of the backend's own session, None = all cores
+            layout: input layout the model expects, NHWC or NCHW
+        """
+        if layout not in ("NHWC", "NCHW"):
+            raise ValueError(f"Unknown layout: {layout}")
+        self.model_path = Path(model_path)
+        self.micro_batch = micro_batch
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.layout = layout
+
+    def params(self) -> dict:
+        st = self.model_path.stat()
+        return {"backend": self.name, "model": self.model_path.name, "model_size": st.st_size,
+                "model_mtime_ns": st.st_mtime_ns, "layout": self.layout}
+
+    @abstractmethod
+    def _forward(self, x: np.ndarray) -> np.ndarray:
+        """
+        Run one micro-batch, return (n, len(CLASS_LABELS)) scores.
+        """
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(batch), dtype=np.uint8)
+        for start in range(0, len(batch), self.micro_batch):
+            x = np.asarray(batch[start:start + self.micro_batch], dtype=np.float32)
+            if self.layout == "NCHW":
+                x = np.ascontiguousarray(x.transpose(0, 3, 1, 2))
+            scores = self._forward(x)
+            if scores.shape[-1] != len(CLASS_LABELS):
+                raise ValueError(
+                    f"Model returned {scores.shape[-1]} classes, expected {len(CLASS_LABELS)}")
+            labels[start:start + len(x)] = scores.argmax(axis=-1)
+        return labels
+
+
+class OnnxBackend(CNNBackend):
+    name = "onnx"
+
+    def __init__(self, model_path: Path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, x: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: x})[0]
 
-        # Hi-hat: very strong high energy
-        if high > max(high_mid * 1.1, mid * 1.5, low * 2.0):
-            return "hihat"
 
-        # Crash: wideband high/sting and longer decay — captured as strong high_mid + high
-        # Heuristic: both high_mid and high significant relative to mid
-        if (high + high_mid) > mid * 1.6 and (high + high_mid) > low_mid * 1.2:
-            return "crash"
+class TorchScriptBackend(CNNBackend):
+    """
+    Runs on torch's process-wide intra-op pool, shared with the separation
+    model; num_threads is not applied (torch only has the global setting).
+    """
+    name = "torchscript"
+
+    def __init__(self, model_path: Path, layout: str = "NCHW", **kwargs):
+        super().__init__(model_path, layout=layout, **kwargs)
+        import torch
+
+        self.torch = torch
+        self.model = torch.jit.load(str(self.model_path), map_location="cpu").eval()
+
+    def _forward(self, x: np.ndarray) -> np.ndarray:
+        with self.torch.inference_mode():
+            return self.model(self.torch.from_numpy(x)).numpy()
 
-        # Snare: mid + high_mid prominent
-        if (mid + high_mid) > low_mid * 1.2 and mid > low * 0.9:
-            return "snare"
 
-        # Toms: energy concentrated in low-mid / mid (different relative thresholds)
-        # High tom: higher low_mid
-        if low_mid > mid * 1.1 and low_mid > low * 1.0:
-            return "tom1"
+BACKENDS = {
+    ".onnx": OnnxBackend,
+    ".pt": TorchScriptBackend,
+    ".ts": TorchScriptBackend,
+}
 
-        # Mid tom:
-        if low_mid > low and mid > low_mid * 0.8:
-            return "tom2"
 
-        # Floor tom: more low than low_mid
-        if low > low_mid * 1.1 and low_mid > mid * 0.8:
-            return "tom3"
+def load_backend(model_path: Optional[str] = DRUM_CLASSIFIER_MODEL, **kwargs) -> ClassifierBackend:
+    """
+    Pick a backend from the model file extension.
+    Falls back to the heuristic when no model is given or it can't be loaded.
+    """
+    if not model_path:
+        return HeuristicBackend()
+    model_path = Path(model_path)
+    backend_cls = BACKENDS.get(model_path.suffix)
+    if backend_cls is None:
+        logger.warning("Unsupported classifier model %s, using heuristic", model_path)
+        return HeuristicBackend()
+    try:
+        backend = backend_cls(model_path, **kwargs)
+    except Exception as e:
+        logger.warning("Failed to load classifier model %s (%s), using heuristic", model_path, e)
+        return HeuristicBackend()
+    logger.info("Loaded %s drum classifier from %s", backend.name, model_path)
+    return backend
 
-        # Fallbacks: prefer snare if mid present, else hihat if high present, else unknown->kick
-        if mid > low or high_mid > low:
-            return "snare"
-        if high > 0.01:
-            return "hihat"
-        return "kick"
 
-    def classify_batch(self, batch: np.ndarray) -> List[str]:
+class DrumClassifier:
+    """
+    Drum hit classifier.
+    Input: mel-window (H x W x 1) or batch (N, H, W, 1).
+    Output: label per window.
+    Runs on a pluggable backend (ONNX / TorchScript CNN or the MVP heuristic).
+    """
+
+    def __init__(self, backend: Optional[ClassifierBackend] = None):
+        self.labels = CLASS_LABELS
+        self.backend = backend or load_backend()
+
+    def params(self) -> dict:
+        return {**self.backend.params(), "labels": list(self.labels)}
+
+    def predict_window(self, window: np.ndarray) -> str:
+        """
+        Predict label for a single window.
+        window: shape (H, W, 1) or (H, W)
+        Returns a string label.
+        """
+        if window.ndim == 2:
+            window = window[:, :, np.newaxis]
+        return CLASS_LABELS[self.classify_batch(window[np.newaxis])[0]]
+
+    def classify_batch(self, batch: np.ndarray) -> np.ndarray:
         """
         batch: (N, H, W, 1)
-        returns list of labels length N
+        returns uint8 array of length N, values index CLASS_LABELS
+        (use labels_to_names() for strings)
         """
-        labels = []
-        for win in batch:
-            labels.append(self.predict_window(win))
-        return labels
+        if len(batch) == 0:
+            return np.empty(0, dtype=np.uint8)
+        return self.backend.predict(batch)
 
-    def classify_from_file(self, cnn_file_path) -> List[str]:
-        batch = np.load(str(cnn_file_path))
-        return self.classify_batch(batch)
-    
\ No newline at end of file
+    def iter_classify_from_file(self, cnn_file_path, batch_size: int = 256) -> Iterator[np.ndarray]:
+        """
+        Labels of a MelWindowStore file, one array per batch_size windows,
+        as soon as each batch is classified.
+        """
+        for batch in MelWindowStore.iter_batches(cnn_file_path, batch_size):
+            yield self.classify_batch(batch)
+
+    def classify_from_file(self, cnn_file_path, batch_size: int = 256) -> np.ndarray:
+        """
+        Classify windows from a MelWindowStore file, memory-mapped and
+        dequantised batch_size windows at a time.
+        """
+        labels = list(self.iter_classify_from_file(cnn_file_path, batch_size))
+        return np.concatenate(labels) if labels else np.empty(0, dtype=np.uint8)
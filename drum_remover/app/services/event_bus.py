@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One listener's view of a job's events, read from an asyncio loop while
+    they are published from worker threads.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, event: dict):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:   # loop already closed, the listener is gone
+            pass
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of job events (stage changes, hit batches),
+    feeding the /ws/jobs/{id} push channel.
+    Events published with keep=True (hit batches) are also kept until the job
+    is closed and replayed to late subscribers, so a page opened mid-analysis
+    still receives every hit.
+    """
+
+    def __init__(self, max_kept: int = 10000):
+        """
+        Args:
+            max_kept: kept events per job, older ones are dropped first
+        """
+        self.max_kept = max_kept
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, list[Subscription]] = {}
+        self._kept: dict[str, deque] = {}
+
+    def publish(self, job_id: Optional[str], event: dict, keep: bool = False):
+        if job_id is None:
+            return   # not running for a job (e.g. run_full_pipeline from a script)
+        with self._lock:
+            if keep:
+                self._kept.setdefault(job_id, deque(maxlen=self.max_kept)).append(event)
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for sub in subscribers:
+            sub.put(event)
+
+    def close(self, job_id: str):
+        """
+        Forget the kept events of a finished job (its results are on disk by now).
+        """
+        with self._lock:
+            self._kept.pop(job_id, None)
+
+    @contextmanager
+    def subscribe(self, job_id: str) -> Iterator[Subscription]:
+        """
+        Receive the job's events for the duration of the with block.
+        Must be called from the event loop that reads the subscription.
+        """
+        sub = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            for event in self._kept.get(job_id, ()):
+                sub.queue.put_nowait(event)
+            self._subscribers.setdefault(job_id, []).append(sub)
+        try:
+            yield sub
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id, [])
+                if sub in subscribers:
+                    subscribers.remove(sub)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+
+# Global bus shared by the job runner, the analysis stages and the API
+events = EventBus()
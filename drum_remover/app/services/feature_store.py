@@ -0,0 +1,95 @@
+import os
+import uuid
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from config import MEL_STORE_DTYPE
+
+# Storage dtypes for 0-1 normalised mel windows
+SUPPORTED_DTYPES = ("uint8", "float16", "float32")
+
+
+class MelWindowStore:
+    """
+    Compact on-disk store for mel windows (.npy, so any numpy can read it).
+    Windows are 0-1 normalised, so they are kept as uint8 (1/255 steps) or
+    float16 instead of float64: 8x / 4x smaller. Writes go chunk by chunk into
+    a preallocated memory-mapped file, renamed into place once complete; reads
+    are memory-mapped and dequantised one batch at a time.
+    """
+
+    def __init__(self, dtype: str = MEL_STORE_DTYPE):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported mel store dtype: {dtype}. Use one of {SUPPORTED_DTYPES}")
+        self.dtype = np.dtype(dtype)
+
+    def encode(self, windows: np.ndarray) -> np.ndarray:
+        if self.dtype == np.uint8:
+            return np.rint(np.clip(windows, 0.0, 1.0) * 255).astype(np.uint8)
+        return windows.astype(self.dtype)
+
+    @staticmethod
+    def decode(windows: np.ndarray) -> np.ndarray:
+        """
+        Stored windows (any supported dtype) back to float32 in 0-1.
+        """
+        if windows.dtype == np.uint8:
+            return windows.astype(np.float32) / 255.0
+        return windows.astype(np.float32)
+
+    def write(self, out_path: Path, chunks: Iterable[np.ndarray], n: int,
+              window_shape: tuple[int, int]) -> Path:
+        """
+        Stream (k, H, W, 1) chunks into out_path. n is the total window count.
+        A failed write leaves no file behind (a preallocated file would read
+        back as n blank windows).
+        """
+        out_path = Path(out_path)
+        tmp = out_path.with_name(f".{out_path.name}.{uuid.uuid4().hex}.part")
+        try:
+            out = np.lib.format.open_memmap(
+                str(tmp), mode="w+", dtype=self.dtype, shape=(n, *window_shape, 1))
+            pos = 0
+            for chunk in chunks:
+                if pos + len(chunk) > n:
+                    raise ValueError(f"Expected {n} windows, got more")
+                out[pos:pos + len(chunk)] = self.encode(chunk)
+                pos += len(chunk)
+            if pos != n:
+                raise ValueError(f"Expected {n} windows, got {pos}")
+            out.flush()
+            del out
+            os.replace(tmp, out_path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return out_path
+
+    @staticmethod
+    def open(path: Path) -> np.ndarray:
+        """
+        Memory-mapped view of the stored windows, in their storage dtype.
+        Raises ValueError for a truncated, corrupt or foreign file.
+        """
+        try:
+            windows = np.load(str(path), mmap_mode="r")
+        except (ValueError, EOFError) as e:
+            raise ValueError(f"Unreadable mel window store {path}: {e}") from e
+        if windows.dtype.name not in SUPPORTED_DTYPES or windows.ndim != 4 or windows.shape[-1] != 1:
+            raise ValueError(f"Not a mel window store {path}: {windows.dtype} {windows.shape}")
+        return windows
+
+    @classmethod
+    def count(cls, path: Path) -> int:
+        return cls.open(path).shape[0]
+
+    @classmethod
+    def iter_batches(cls, path: Path, batch_size: int = 256) -> Iterator[np.ndarray]:
+        """
+        Yield float32 (k, H, W, 1) batches read from the memory map.
+        """
+        windows = cls.open(path)
+        for i in range(0, len(windows), batch_size):
+            yield cls.decode(windows[i:i + batch_size])
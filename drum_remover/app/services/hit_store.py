@@ -0,0 +1,149 @@
+from pathlib import Path
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+
+from services.drum_classifier import CLASS_LABELS, LABEL_INDEX
+from services.key_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# On disk: one record per hit, sorted by time (memory-mappable .npy)
+HIT_DTYPE = np.dtype([("time", "<f8"), ("label", "u1")])
+# Binary responses: packed little-endian float32 seconds + uint8 label id, 5 bytes per hit
+WIRE_DTYPE = np.dtype([("time", "<f4"), ("label", "u1")])
+
+
+def hits_index_path(drums_path: Path) -> Path:
+    return Path(drums_path).with_suffix(".hits.npy")
+
+
+class HitIndex:
+    """
+    Time-sorted hits of one stem; time windows are found by binary search.
+    """
+
+    def __init__(self, records: np.ndarray):
+        self.records = records
+        self.times = records["time"]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              labels: Optional[Iterable[str]] = None, offset: int = 0,
+              limit: Optional[int] = None) -> tuple[np.ndarray, int]:
+        """
+        Hits with start <= time < end, optionally restricted to labels,
+        then paginated. Returns (records page, total matching before pagination).
+        """
+        lo = int(np.searchsorted(self.times, start, "left")) if start is not None else 0
+        hi = int(np.searchsorted(self.times, end, "left")) if end is not None else len(self.times)
+        selected = self.records[lo:max(lo, hi)]
+        if labels:
+            unknown = [l for l in labels if l not in LABEL_INDEX]
+            if unknown:
+                raise ValueError(f"Unknown labels: {unknown}. Use any of {CLASS_LABELS}")
+            selected = selected[np.isin(selected["label"], [LABEL_INDEX[l] for l in labels])]
+        total = len(selected)
+        stop = None if limit is None else offset + limit
+        return selected[offset:stop], total
+
+
+class HitStore:
+    """
+    Indexed hit storage next to the stems (<stem>.hits.npy).
+    Opened indexes are memory-mapped and kept in a small LRU keyed by the
+    file's mtime and size, so repeated queries never re-read or re-parse it.
+    """
+
+    def __init__(self, max_open: int = 64):
+        self.max_open = max_open
+        self._open: OrderedDict[tuple, HitIndex] = OrderedDict()
+        self._lock = threading.Lock()
+        self._migrations = KeyedLocks()
+
+    @staticmethod
+    def write(out_path: Path, times: Iterable[float], label_ids: Iterable[int]) -> Path:
+        """
+        Store hits sorted by time (write-then-rename, readers never see a partial file).
+        """
+        times = np.asarray(list(times), dtype=np.float64)
+        records = np.empty(len(times), dtype=HIT_DTYPE)
+        records["time"] = times
+        records["label"] = np.asarray(list(label_ids), dtype=np.uint8)
+        records = records[np.argsort(records["time"], kind="stable")]
+
+        out_path = Path(out_path)
+        tmp = out_path.with_name(f".{out_path.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, records)
+            os.replace(tmp, out_path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return out_path
+
+    @classmethod
+    def write_hits(cls, out_path: Path, hits: list[dict]) -> Path:
+        """
+        Store [{time, label}] dicts (label names).
+        """
+        return cls.write(out_path, (h["time"] for h in hits), (LABEL_INDEX[h["label"]] for h in hits))
+
+    @classmethod
+    def migrate_json(cls, json_path: Path, out_path: Path) -> Path:
+        """
+        Build the index from a legacy .hits.json (a list, or {"hits": [...]}).
+        """
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        hits = data.get("hits", []) if isinstance(data, dict) else data
+        logger.info("Indexing %d hits from %s", len(hits), json_path)
+        return cls.write_hits(out_path, hits)
+
+    def ensure_index(self, drums_path: Path) -> Optional[Path]:
+        """
+        Index path for a drum stem, migrating a legacy .hits.json on first use
+        (once: concurrent requests for the same stem wait for the first).
+        Returns None when the stem has no hits yet.
+        """
+        index_path = hits_index_path(drums_path)
+        if index_path.exists():
+            return index_path
+        legacy_json = Path(drums_path).with_suffix(".hits.json")
+        with self._migrations.hold(index_path):
+            if index_path.exists():
+                return index_path
+            if not legacy_json.exists():
+                return None
+            return self.migrate_json(legacy_json, index_path)
+
+    def open(self, path: Path) -> tuple[HitIndex, os.stat_result]:
+        """
+        Index for path plus the stat it was loaded from (for ETags).
+        """
+        st = os.stat(path)
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            index = self._open.get(key)
+            if index is not None:
+                self._open.move_to_end(key)
+                return index, st
+        try:
+            records = np.load(str(path), mmap_mode="r")
+        except ValueError:
+            records = np.load(str(path))   # zero hits: nothing to map
+        index = HitIndex(records)
+        with self._lock:
+            self._open[key] = index
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return index, st
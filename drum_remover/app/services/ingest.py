@@ -0,0 +1,300 @@
+from pathlib import Path
+import hashlib
+import os
+import uuid
+from typing import Optional
+
+from fastapi import Request, status
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from config import UPLOAD_DIR, MAX_UPLOAD_BYTES, MAX_UPLOAD_SECONDS
+
+ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.flac'}
+# Bytes we are willing to buffer before the container must be recognised
+# (ID3 tags with cover art can be large)
+MAX_SNIFF_BYTES = 4 * 1024 * 1024
+
+# MPEG audio layer III tables
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class AudioProbe:
+    """
+    What the first bytes of an upload tell us.
+    duration is exact when the header carries it; otherwise byte_rate lets us
+    estimate it from the running byte count.
+    """
+
+    def __init__(self, fmt: str, duration: Optional[float] = None,
+                 byte_rate: Optional[float] = None, audio_offset: int = 0, codec: str = ""):
+        self.format = fmt
+        self.codec = codec
+        self.duration = duration
+        self.byte_rate = byte_rate
+        self.audio_offset = audio_offset
+
+
+class IngestResult:
+    def __init__(self, path: Path, sha256: str, size: int, probe: AudioProbe, original_name: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.probe = probe
+        self.original_name = original_name
+
+    def to_dict(self) -> dict:
+        return {
+            "filename": self.original_name,
+            "sha256": self.sha256,
+            "size": self.size,
+            "format": self.probe.format,
+            "codec": self.probe.codec,
+            "duration": self.probe.duration,
+        }
+
+
+def _probe_wav(head: bytes) -> Optional[AudioProbe]:
+    pos, byte_rate, codec = 12, None, "pcm"
+    while pos + 8 <= len(head):
+        chunk_id = head[pos:pos + 4]
+        chunk_size = int.from_bytes(head[pos + 4:pos + 8], "little")
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if body + 16 > len(head):
+                return None
+            audio_format = int.from_bytes(head[body:body + 2], "little")
+            codec = {1: "pcm", 3: "float", 0xFFFE: "extensible"}.get(audio_format, f"0x{audio_format:x}")
+            byte_rate = int.from_bytes(head[body + 8:body + 12], "little")
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "WAV without fmt chunk")
+            # 0 / 0xFFFFFFFF mean "unknown size" (streamed WAV)
+            known = 0 < chunk_size < 0xFFFFFFFF
+            return AudioProbe("wav", duration=chunk_size / byte_rate if known else None,
+                              byte_rate=byte_rate, audio_offset=body, codec=codec)
+        pos = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _probe_flac(head: bytes) -> Optional[AudioProbe]:
+    # "fLaC" + block header (4) + STREAMINFO (34)
+    if len(head) < 42:
+        return None
+    info = head[8:42]
+    bits = int.from_bytes(info[10:18], "big")
+    sample_rate = bits >> 44
+    total_samples = bits & ((1 << 36) - 1)
+    if sample_rate == 0:
+        raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Invalid FLAC STREAMINFO")
+    duration = total_samples / sample_rate if total_samples else None
+    return AudioProbe("flac", duration=duration, codec="flac")
+
+
+def _probe_mp3(head: bytes) -> Optional[AudioProbe]:
+    pos = 0
+    if head[:3] == b"ID3":
+        if len(head) < 10:
+            return None
+        size = 0
+        for b in head[6:10]:   # syncsafe integer
+            size = (size << 7) | (b & 0x7F)
+        pos = 10 + size + (10 if head[5] & 0x10 else 0)
+    if pos + 4 > len(head):
+        return None
+
+    header = int.from_bytes(head[pos:pos + 4], "big")
+    if header >> 21 != 0x7FF:
+        raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "No MPEG frame after ID3 tag")
+    version = {3: 1, 2: 2, 0: 2.5}.get((header >> 19) & 0x3)
+    layer = (header >> 17) & 0x3
+    bitrate_idx = (header >> 12) & 0xF
+    sr_idx = (header >> 10) & 0x3
+    if version is None or layer != 1 or bitrate_idx in (0, 15) or sr_idx == 3:
+        raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Not an MPEG layer III stream")
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_idx] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sr_idx]
+    samples_per_frame = 1152 if version == 1 else 576
+
+    # VBR files carry the frame count in a Xing/Info header in the first frame
+    mono = (header >> 6) & 0x3 == 3
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = pos + 4 + side_info
+    if len(head) < xing + 12:
+        return None
+    duration = None
+    if head[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(head[xing + 4:xing + 8], "big")
+        if flags & 0x1:
+            frames = int.from_bytes(head[xing + 8:xing + 12], "big")
+            duration = frames * samples_per_frame / sample_rate
+    return AudioProbe("mp3", duration=duration, byte_rate=bitrate / 8, audio_offset=pos, codec="mp3")
+
+
+def probe_audio(head: bytes) -> Optional[AudioProbe]:
+    """
+    Identify the real container/codec from the first bytes of a file.
+    Returns None when more bytes are needed, raises UploadRejected if the
+    content is not a supported audio file.
+    """
+    if len(head) < 12:
+        return None
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return _probe_wav(head)
+    if head[:4] == b"fLaC":
+        return _probe_flac(head)
+    if head[:3] == b"ID3" or (head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return _probe_mp3(head)
+    raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                         "File content is not MP3, WAV or FLAC audio")
+
+
+class _MultipartFileReader:
+    """
+    Incremental multipart/form-data parser that hands out the bytes of one
+    file field as they arrive (Starlette's form parsing spools the whole file first).
+    """
+
+    def __init__(self, content_type: str, field: str):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadRejected(status.HTTP_400_BAD_REQUEST, "Expected multipart/form-data upload")
+        self.field = field.encode()
+        self.filename: Optional[str] = None
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._data: list[bytes] = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") == self.field and b"filename" in options and self.filename is None:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._data.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        self._in_file = False
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        self._parser.write(chunk)
+        data, self._data = self._data, []
+        return data
+
+
+async def ingest_upload(request: Request, dest_dir: Path = UPLOAD_DIR, field: str = "file",
+                        max_bytes: int = MAX_UPLOAD_BYTES,
+                        max_seconds: float = MAX_UPLOAD_SECONDS) -> IngestResult:
+    """
+    Stream a multipart upload to disk chunk by chunk.
+    The content hash is computed on the way in, the real format is sniffed from
+    the first bytes, and size / duration limits are enforced as soon as they
+    can be, so a bad upload is rejected before the whole file has landed.
+    The file ends up at dest_dir/<hash prefix>/<original name>.
+    """
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > max_bytes + 64 * 1024:   # allow for multipart overhead
+        raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                             f"Upload larger than {max_bytes} bytes")
+
+    reader = _MultipartFileReader(request.headers.get("content-type", ""), field)
+    digest = hashlib.sha256()
+    size = 0
+    head = bytearray()
+    probe: Optional[AudioProbe] = None
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    part_path = dest_dir / f".{uuid.uuid4().hex}.part"
+
+    try:
+        with open(part_path, "wb") as out:
+            async for body in request.stream():
+                for chunk in reader.feed(body):
+                    if size == 0:
+                        # Check if file is audio (by name first, content below)
+                        if not reader.filename:
+                            raise UploadRejected(status.HTTP_404_NOT_FOUND, "No file provided")
+                        if Path(reader.filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+                            raise UploadRejected(
+                                status.HTTP_404_NOT_FOUND,
+                                f"Invalid file type. Allowed file extensions: {ALLOWED_EXTENSIONS}")
+
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                             f"Upload larger than {max_bytes} bytes")
+                    digest.update(chunk)
+
+                    if probe is None:
+                        head += chunk
+                        probe = probe_audio(bytes(head))
+                        if probe is None and len(head) > MAX_SNIFF_BYTES:
+                            raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                                 "Could not recognise the audio format")
+                        if probe is not None:
+                            head = bytearray()
+                    if probe is not None:
+                        duration = probe.duration
+                        if duration is None and probe.byte_rate:
+                            duration = (size - probe.audio_offset) / probe.byte_rate
+                        if duration is not None and duration > max_seconds:
+                            raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                                 f"Audio longer than {max_seconds:.0f} seconds")
+
+                    await run_in_threadpool(out.write, chunk)
+
+        if size == 0:
+            raise UploadRejected(status.HTTP_404_NOT_FOUND, "No file provided")
+        if probe is None:
+            probe = probe_audio(bytes(head))
+            if probe is None:
+                raise UploadRejected(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                     "Truncated or unrecognised audio file")
+
+        sha256 = digest.hexdigest()
+        final_path = dest_dir / sha256[:16] / Path(reader.filename).name
+        final_path.parent.mkdir(exist_ok=True)
+        os.replace(part_path, final_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+    return IngestResult(final_path, sha256, size, probe, reader.filename)
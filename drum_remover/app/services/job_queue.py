@@ -0,0 +1,251 @@
+from pathlib import Path
+import logging
+import os
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+from services.audio_buffer import DecodedAudio
+from services.job_store import Job, JobStore, MemoryJobStore, QUEUED, RUNNING, DONE, FAILED
+from services.metrics import metrics, current_job, STAGES
+from services.event_bus import events
+
+if TYPE_CHECKING:   # torch / demucs, loaded by whoever builds the processor
+    from services.audio_processor import AudioProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the queue already holds the maximum number of pending jobs."""
+
+
+class JobQueue:
+    """
+    Bounded separation queue on top of a JobStore.
+    The API submits jobs to the store; worker threads (in the API process, or
+    in separate `python worker.py` processes sharing the store) claim them
+    one at a time, so a long track never holds an HTTP connection open.
+    """
+
+    def __init__(self, processor: Optional["AudioProcessor"], store: Optional[JobStore] = None,
+                 max_workers: int = 2, max_pending: int = 32,
+                 post_process: Optional[Callable[[Path, Optional[DecodedAudio]], None]] = None,
+                 poll_interval: float = 1.0, stale_after: float = 300.0,
+                 preview_seconds: float = 0.0):
+        """
+        Args:
+            processor: AudioProcessor shared by all workers, or a zero-argument
+                       callable building it on first use (keeps torch out of
+                       startup; never called by an enqueue-only API)
+            store: where jobs live, defaults to an in-process MemoryJobStore
+            max_workers: worker threads started by start(), 0 = leave the work to
+                         external worker processes
+            max_pending: queued + running jobs allowed before submit() refuses
+            post_process: called with the drums stem path (and the in-memory drums
+                          when available) once separation is done
+            poll_interval: seconds between store polls when the queue is empty
+            stale_after: running jobs without an update for this long are requeued;
+                         jobs running here heartbeat every stale_after / 4
+            preview_seconds: publish quick preview stems of this many seconds
+                             before the full separation, unless that is cached
+                             (0 = no preview tier)
+        """
+        self._processor = processor
+        self._processor_lock = threading.Lock()
+        self.store = store or MemoryJobStore()
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.post_process = post_process
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.preview_seconds = preview_seconds
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._owners: dict[str, str] = {}   # job id -> worker id, jobs running in this process
+        metrics.add_listener(self._on_stage)
+
+    @property
+    def processor(self) -> "AudioProcessor":
+        if callable(self._processor):
+            with self._processor_lock:
+                if callable(self._processor):
+                    self._processor = self._processor()
+        return self._processor
+
+    def start(self):
+        """
+        Start max_workers worker threads in this process.
+        """
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self.work, args=(f"{self.worker_prefix}:{i}",),
+                                      name=f"separation-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, input_file: Path) -> Job:
+        """
+        Queue a file for separation and return its Job immediately.
+        """
+        job = self.store.create(Path(input_file), max_pending=self.max_pending)
+        if job is None:
+            raise QueueFullError(f"Too many pending jobs (max {self.max_pending})")
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def counts(self) -> dict[str, int]:
+        """
+        Number of known jobs per status.
+        """
+        return self.store.counts()
+
+    def _on_stage(self, job_id: Optional[str], stage: str, event: str):
+        # Stage timers double as progress reports for the job they run under
+        worker = self._owners.get(job_id) if job_id else None
+        job = self.get(job_id) if worker else None
+        if job is not None and event == "start" and job.status == RUNNING:
+            self._update(job, worker, stage=stage,
+                         progress=max(job.progress, STAGES.get(stage, job.progress)))
+
+    def _update(self, job: Job, worker: str, **fields) -> bool:
+        # Only the worker holding the job writes to it: once the job was requeued
+        # (and maybe claimed elsewhere) this run's updates are dropped
+        if not self.store.update(job.id, expect_worker=worker, **fields):
+            logger.warning("Job %s is no longer held by %s, update dropped", job.id, worker)
+            return False
+        events.publish(job.id, {"type": "job", **fields})
+        return True
+
+    def _heartbeat(self, job: Job, worker: str, stop: threading.Event):
+        """
+        Refresh the job's updated_at while it runs, so a long separation is not
+        taken for a dead worker. Stops with the job or once the job was requeued.
+        """
+        while not stop.wait(self.stale_after / 4):
+            if not self.store.update(job.id, expect_worker=worker):
+                logger.warning("Job %s was requeued away from %s", job.id, worker)
+                return
+
+    def _relative(self, paths: dict) -> dict:
+        return {
+            "drums": paths["drums"].relative_to(self.processor.output_dir).as_posix(),
+            "rest": paths["rest"].relative_to(self.processor.output_dir).as_posix(),
+        }
+
+    def _tiered(self, job: Job, tier: str, paths: dict, preview: Optional[dict] = None) -> dict:
+        # result holds the stems to play now (drums / rest) and which tier they
+        # are; ready_s is the time from upload to that tier being playable
+        stems = {**self._relative(paths), "ready_s": round(time.time() - job.created_at, 3)}
+        if tier == "preview":
+            preview = stems
+        return {"tier": tier, **stems, "preview": preview}
+
+    def _preview(self, job: Job, worker: str, wav=None) -> Optional[dict]:
+        """
+        Publish the preview tier; a failed preview only costs the head start.
+        wav: the input already decoded for the full separation, if it was
+        """
+        if not self.preview_seconds:
+            return None
+        try:
+            paths = self.processor.separate_preview(job.input_file, self.preview_seconds, wav=wav)
+        except Exception:
+            logger.exception("Preview of job %s failed, continuing with the full separation", job.id)
+            return None
+        result = self._tiered(job, "preview", paths)
+        self._update(job, worker, result=result)
+        return result["preview"]
+
+    def work(self, worker_id: str):
+        """
+        Worker loop: claim the oldest queued job, run it, repeat until shutdown().
+        """
+        last_sweep = 0.0
+        while not self._stopping.is_set():
+            if time.time() - last_sweep > self.stale_after / 4:
+                requeued = self.store.requeue_stale(self.stale_after)
+                if requeued:
+                    logger.warning("Requeued %d stale job(s)", requeued)
+                last_sweep = time.time()
+
+            job = self.store.claim(worker_id)
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            logger.info("Worker %s picked up job %s", worker_id, job.id)
+            events.publish(job.id, {"type": "job", "status": job.status, "stage": job.stage,
+                                    "worker": worker_id})
+            self._run(job, worker_id)
+
+    def _run(self, job: Job, worker: str):
+        token = current_job.set(job.id)
+        self._owners[job.id] = worker
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, worker, stop),
+                         name=f"heartbeat-{job.id[:8]}", daemon=True).start()
+        try:
+            tiers = {}
+
+            def on_miss(wav):
+                # Not cached: something to listen to within seconds, full quality follows
+                tiers["preview"] = self._preview(job, worker, wav)
+
+            # Stems stay in memory: writing them runs in the background while the
+            # analysis consumes the drum tensor directly
+            separation = self.processor.separate_drums(job.input_file, in_memory=True, on_miss=on_miss)
+            preview = tiers.get("preview")
+            drums_path = separation.paths["drums"]
+
+            # The entry stays out of cache eviction while its stems are analysed
+            with self.processor.cache.in_use(separation.key):
+                audio = None
+                full = {}
+                if separation.on_disk:
+                    full["result"] = self._tiered(job, "full", separation.paths, preview)
+                    self._update(job, worker, result=full["result"])
+                else:
+                    def publish(write):
+                        # Full stems replace the preview as soon as they are on disk
+                        if write.exception() is None:
+                            full.setdefault("result", self._tiered(job, "full", write.result(), preview))
+                            self._update(job, worker, result=full["result"])
+
+                    write = self.processor.save_stems_async(separation)
+                    write.add_done_callback(publish)
+                    audio = DecodedAudio(separation.drums_mono(), separation.samplerate, drums_path)
+
+                if self.post_process:
+                    self.post_process(drums_path, audio)
+                if not separation.on_disk:
+                    write.result()   # surface write errors before reporting done
+                # The writer's callback may still be on its way: done always carries the full tier
+                result = full.get("result") or self._tiered(job, "full", separation.paths, preview)
+                if self._update(job, worker, status=DONE, stage="done", progress=1.0, result=result,
+                                finished_at=time.time()):
+                    logger.info("✅ Job %s finished", job.id)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            self._update(job, worker, status=FAILED, stage="failed", error=str(e), finished_at=time.time())
+        finally:
+            stop.set()
+            self._owners.pop(job.id, None)
+            current_job.reset(token)
+            events.close(job.id)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the worker threads after their current job (wait=True blocks until then).
+        Jobs still queued stay in the store for the next start.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
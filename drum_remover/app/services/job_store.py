@@ -0,0 +1,303 @@
+from pathlib import Path
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+PENDING_STATES = (QUEUED, RUNNING)
+
+
+class Job:
+    """
+    State of a single separation job.
+    progress goes 0.0 -> 1.0, stage names the step currently running.
+    """
+
+    def __init__(self, job_id: str, input_file: Path):
+        self.id = job_id
+        self.input_file = input_file
+        self.status = QUEUED
+        self.stage = "queued"
+        self.progress = 0.0
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.worker: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.updated_at = self.created_at
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "result": self.result,
+            "error": self.error,
+            "worker": self.worker,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore(ABC):
+    """
+    Where jobs live, shared by the API and the workers.
+    Backends implement create / get / update / claim; claim must hand every
+    queued job to exactly one worker, even across processes.
+    """
+    name = "base"
+
+    @abstractmethod
+    def create(self, input_file: Path, max_pending: Optional[int] = None) -> Optional[Job]:
+        """
+        Add a queued job. Returns None when max_pending queued + running jobs already exist.
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, expect_worker: Optional[str] = None, **fields) -> bool:
+        """
+        Set fields (and updated_at, so no fields is a heartbeat).
+        With expect_worker the update only applies while that worker still holds
+        the job, not once it was requeued or claimed by another worker.
+        Returns whether it applied.
+        """
+
+    @abstractmethod
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """
+        Atomically move the oldest queued job to running for worker_id.
+        """
+
+    @abstractmethod
+    def counts(self) -> dict[str, int]:
+        ...
+
+    @abstractmethod
+    def requeue_stale(self, max_age: float) -> int:
+        """
+        Put running jobs whose worker went quiet for max_age seconds back in the queue.
+        Returns how many were requeued.
+        """
+
+
+class MemoryJobStore(JobStore):
+    """
+    Jobs in a dict: single process only (the API runs the workers itself).
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, input_file: Path, max_pending: Optional[int] = None) -> Optional[Job]:
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.status in PENDING_STATES)
+            if max_pending is not None and pending >= max_pending:
+                return None
+            job = Job(uuid.uuid4().hex, Path(input_file))
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def update(self, job_id: str, expect_worker: Optional[str] = None, **fields) -> bool:
+        with self._lock:
+            job = self._jobs[job_id]
+            if expect_worker is not None and job.worker != expect_worker:
+                return False
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+            return True
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        with self._lock:
+            queued = [job for job in self._jobs.values() if job.status == QUEUED]
+            if not queued:
+                return None
+            job = min(queued, key=lambda j: j.created_at)
+            job.status, job.worker = RUNNING, worker_id
+            job.stage, job.started_at = "starting", time.time()
+            job.updated_at = job.started_at
+            return job
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def requeue_stale(self, max_age: float) -> int:
+        now = time.time()
+        with self._lock:
+            stale = [job for job in self._jobs.values()
+                     if job.status == RUNNING and now - job.updated_at > max_age]
+            for job in stale:
+                job.status, job.stage, job.worker = QUEUED, "queued", None
+            return len(stale)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a SQLite database (WAL mode), so several API processes and
+    separation workers on the same host / shared volume see one queue.
+    claim() runs in a write transaction, which SQLite serialises across processes.
+    """
+    name = "sqlite"
+    COLUMNS = ("id", "input_file", "status", "stage", "progress", "result", "error",
+               "worker", "created_at", "started_at", "finished_at", "updated_at")
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    input_file TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per call: safe from any thread or process
+        db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _to_job(self, row: sqlite3.Row) -> Job:
+        job = Job(row["id"], Path(row["input_file"]))
+        for column in self.COLUMNS[2:]:
+            setattr(job, column, row[column])
+        job.result = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def create(self, input_file: Path, max_pending: Optional[int] = None) -> Optional[Job]:
+        job = Job(uuid.uuid4().hex, Path(input_file))
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if max_pending is not None:
+                    (pending,) = db.execute(
+                        "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", PENDING_STATES).fetchone()
+                    if pending >= max_pending:
+                        db.execute("ROLLBACK")
+                        return None
+                db.execute(
+                    "INSERT INTO jobs (id, input_file, status, stage, progress, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, str(job.input_file), job.status, job.stage, job.progress,
+                     job.created_at, job.updated_at))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def update(self, job_id: str, expect_worker: Optional[str] = None, **fields) -> bool:
+        unknown = set(fields) - set(self.COLUMNS[2:])
+        if unknown:
+            raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        where, args = "id = ?", [job_id]
+        if expect_worker is not None:
+            where, args = "id = ? AND worker = ?", [job_id, expect_worker]
+        with self._connect() as db:
+            cursor = db.execute(f"UPDATE jobs SET {assignments} WHERE {where}", (*fields.values(), *args))
+            return cursor.rowcount > 0
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (QUEUED,)).fetchone()
+                if row is None:
+                    db.execute("ROLLBACK")
+                    return None
+                db.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, worker = ?, started_at = ?, updated_at = ?"
+                    " WHERE id = ?", (RUNNING, "starting", worker_id, now, now, row["id"]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def counts(self) -> dict[str, int]:
+        counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+        with self._connect() as db:
+            for row in db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+                counts[row["status"]] = row["n"]
+        return counts
+
+    def requeue_stale(self, max_age: float) -> int:
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, stage = 'queued', worker = NULL, updated_at = ?"
+                " WHERE status = ? AND updated_at < ?",
+                (QUEUED, time.time(), RUNNING, time.time() - max_age))
+            return cursor.rowcount
+
+
+STORES = {
+    "memory": MemoryJobStore,
+    "sqlite": SQLiteJobStore,
+}
+
+
+def make_job_store(kind: str, path: Optional[Path] = None) -> JobStore:
+    """
+    Build the configured job store ("memory", or "sqlite" at path).
+    """
+    store_cls = STORES.get(kind)
+    if store_cls is None:
+        raise ValueError(f"Unknown job store: {kind}. Use one of {sorted(STORES)}")
+    return store_cls(path) if store_cls is SQLiteJobStore else store_cls()
@@ -0,0 +1,33 @@
+import threading
+from contextlib import contextmanager
+from typing import Hashable, Iterator
+
+
+class KeyedLocks:
+    """
+    One lock per key (cache key, output path, ...), created on first use and
+    dropped again once nobody holds or waits for it, so a long-running process
+    does not keep a lock for every key it has ever seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: dict[Hashable, list] = {}   # key -> [lock, holders + waiters]
+
+    @contextmanager
+    def hold(self, key: Hashable) -> Iterator[None]:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._locks)
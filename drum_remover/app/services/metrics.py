@@ -0,0 +1,183 @@
+import contextvars
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# Pipeline stages with the job progress reached when each starts
+# (onset_envelope and mel_spectrogram, then onsets and bpm, run concurrently, see StageGraph)
+STAGES = {
+    "preview": 0.01,
+    "decode": 0.02,
+    "separation": 0.05,
+    "resample": 0.70,
+    "onset_envelope": 0.70,
+    "onsets": 0.70,
+    "mel_spectrogram": 0.70,
+    "bpm": 0.70,
+    "mel_prep": 0.80,
+    "classify": 0.88,
+    "midi": 0.97,
+}
+# Wall-time histogram buckets (seconds)
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Job the current thread is working for (set by the job runner)
+current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """
+    Handed out by Metrics.stage(); set .items to record how much work the stage did.
+    """
+
+    def __init__(self, stage: str, job_id: Optional[str]):
+        self.stage = stage
+        self.job_id = job_id
+        self.items = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = 0
+        self.peak_rss_growth = 0
+        self.ok = True
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "wall_seconds": round(self.wall, 4),
+            "cpu_seconds": round(self.cpu, 4),
+            "peak_rss_bytes": self.peak_rss,
+            "peak_rss_growth_bytes": self.peak_rss_growth,
+            "items": self.items,
+            "ok": self.ok,
+        }
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall_sum = 0.0
+        self.cpu_sum = 0.0
+        self.items = 0
+        self.peak_rss = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, timer: StageTimer):
+        self.count += 1
+        self.errors += 0 if timer.ok else 1
+        self.wall_sum += timer.wall
+        self.cpu_sum += timer.cpu
+        self.items += timer.items
+        self.peak_rss = max(self.peak_rss, timer.peak_rss)
+        for i, le in enumerate(BUCKETS):
+            if timer.wall <= le:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """
+    Per-job, per-stage instrumentation.
+    Every stage records wall time, CPU time (process-wide, so it includes torch /
+    BLAS worker threads), the process peak RSS and an item count. Aggregates are
+    exported in Prometheus text format; per-job records back the progress endpoint.
+    """
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._stages: dict[str, _StageStats] = {}
+        self._jobs: dict[str, list[StageTimer]] = {}
+        self._listeners: list[Callable[[Optional[str], str, str], None]] = []
+
+    def add_listener(self, listener: Callable[[Optional[str], str, str], None]):
+        """
+        listener(job_id, stage, event) is called with event "start" / "end".
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, job_id: Optional[str], stage: str, event: str):
+        for listener in self._listeners:
+            listener(job_id, stage, event)
+
+    @contextmanager
+    def stage(self, stage: str, job_id: Optional[str] = None, items: int = 0):
+        job_id = job_id or current_job.get()
+        timer = StageTimer(stage, job_id)
+        timer.items = items
+        self._notify(job_id, stage, "start")
+        rss_before = _peak_rss_bytes()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield timer
+        except BaseException:
+            timer.ok = False
+            raise
+        finally:
+            timer.wall = time.perf_counter() - wall0
+            timer.cpu = time.process_time() - cpu0
+            timer.peak_rss = _peak_rss_bytes()
+            timer.peak_rss_growth = timer.peak_rss - rss_before
+            self._record(timer)
+            self._notify(job_id, stage, "end")
+
+    def _record(self, timer: StageTimer):
+        with self._lock:
+            self._stages.setdefault(timer.stage, _StageStats()).add(timer)
+            if timer.job_id is not None:
+                self._jobs.setdefault(timer.job_id, []).append(timer)
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.pop(next(iter(self._jobs)))
+
+    def job_stages(self, job_id: str) -> list[dict]:
+        with self._lock:
+            return [t.to_dict() for t in self._jobs.get(job_id, [])]
+
+    def render_prometheus(self, extra_gauges: Optional[dict[str, dict[str, float]]] = None) -> str:
+        """
+        Prometheus text exposition (format 0.0.4).
+        extra_gauges: {metric_name: {label_value: value}} rendered with a "status" label.
+        """
+        lines = []
+        with self._lock:
+            stages = dict(self._stages)
+
+        lines += ["# HELP drum_stage_wall_seconds Wall time per pipeline stage.",
+                  "# TYPE drum_stage_wall_seconds histogram"]
+        for name, st in stages.items():
+            # buckets are already cumulative (each run counts in every le >= its time)
+            for le, count in zip(BUCKETS, st.buckets):
+                lines.append(f'drum_stage_wall_seconds_bucket{{stage="{name}",le="{le}"}} {count}')
+            lines.append(f'drum_stage_wall_seconds_bucket{{stage="{name}",le="+Inf"}} {st.count}')
+            lines.append(f'drum_stage_wall_seconds_sum{{stage="{name}"}} {st.wall_sum:.6f}')
+            lines.append(f'drum_stage_wall_seconds_count{{stage="{name}"}} {st.count}')
+
+        for metric, help_text, kind, attr in (
+            ("drum_stage_cpu_seconds_total", "Process CPU time spent in each stage.", "counter", "cpu_sum"),
+            ("drum_stage_items_total", "Items processed per stage (onsets, windows, hits...).", "counter", "items"),
+            ("drum_stage_errors_total", "Stage runs that raised.", "counter", "errors"),
+            ("drum_stage_peak_rss_bytes", "Highest process peak RSS seen at the end of a stage.", "gauge", "peak_rss"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for name, st in stages.items():
+                value = getattr(st, attr)
+                lines.append(f'{metric}{{stage="{name}"}} {value:.6f}' if isinstance(value, float)
+                             else f'{metric}{{stage="{name}"}} {value}')
+
+        for metric, values in (extra_gauges or {}).items():
+            lines += [f"# TYPE {metric} gauge"]
+            for label, value in values.items():
+                lines.append(f'{metric}{{status="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+metrics = Metrics()
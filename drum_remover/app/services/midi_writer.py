@@ -1,9 +1,9 @@
 # Create a MIDI file from classified hits!
 # services/midi_writer.py
-from mido import Message, MidiFile, MidiTrack
+from mido import Message, MetaMessage, MidiFile, MidiTrack
 from mido import bpm2tempo
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 # General MIDI drum mapping (standard)
 DRUM_MIDI = {
@@ -19,18 +19,33 @@ DRUM_MIDI = {
 }
 
 class MIDIWriter:
-    def __init__(self, bpm: int = 120):
+    def __init__(self, bpm: int = 120, tempo_map: Optional[List[Tuple[float, float]]] = None):
+        """
+        Args:
+            bpm: tempo used when there is no tempo map
+            tempo_map: [(seconds, bpm)] tempo changes (OnsetDetector.beat_grid),
+                       written as set_tempo events so the grid follows the song
+        """
         self.bpm = bpm
         self.tempo = bpm2tempo(bpm)
+        changes = sorted((float(t), float(b)) for t, b in (tempo_map or []) if b > 0)
+        if not changes or changes[0][0] > 0:
+            changes.insert(0, (0.0, float(bpm)))
+        self.tempo_map = changes
 
     def _seconds_to_ticks(self, seconds: float, mid: MidiFile) -> int:
         """
-        Convert seconds to ticks based on mid.ticks_per_beat and bpm.
-        ticks_per_second = ticks_per_beat * (bpm / 60)
+        Convert seconds to ticks based on mid.ticks_per_beat and the tempo map.
+        ticks_per_second = ticks_per_beat * (bpm / 60), piecewise per tempo segment
         """
         tpb = mid.ticks_per_beat
-        ticks_per_second = tpb * (self.bpm / 60.0)
-        return int(round(seconds * ticks_per_second))
+        ticks = 0.0
+        for i, (start, bpm) in enumerate(self.tempo_map):
+            if seconds <= start:
+                break
+            end = self.tempo_map[i + 1][0] if i + 1 < len(self.tempo_map) else seconds
+            ticks += (min(seconds, end) - start) * tpb * (bpm / 60.0)
+        return int(round(ticks))
 
     def write(self, hits: List[dict], out_path: Path):
         """
@@ -41,22 +56,22 @@ class MIDIWriter:
         track = MidiTrack()
         mid.tracks.append(track)
 
-        # Ensure hits sorted by time
-        hits_sorted = sorted(hits, key=lambda x: x["time"])
+        # (absolute tick, order, message): on the same tick, tempo changes first,
+        # then note_offs, so a new hit is never cut by the previous one's note_off
+        events = [(self._seconds_to_ticks(t, mid), 0,
+                   MetaMessage('set_tempo', tempo=bpm2tempo(bpm), time=0))
+                  for t, bpm in self.tempo_map]
+        for hit in hits:
+            note = DRUM_MIDI.get(hit["label"], DRUM_MIDI["unknown"])
+            tick = self._seconds_to_ticks(float(hit["time"]), mid)
+            # note_on then short note_off (small duration in ticks for percussion)
+            events.append((tick, 2, Message('note_on', channel=9, note=note, velocity=100, time=0)))
+            events.append((tick + 10, 1, Message('note_off', channel=9, note=note, velocity=0, time=0)))
 
         prev_tick = 0
-        for hit in hits_sorted:
-            t = float(hit["time"])
-            note = DRUM_MIDI.get(hit["label"], DRUM_MIDI["unknown"])
-            tick = self._seconds_to_ticks(t, mid)
-            delta = max(0, tick - prev_tick)
+        for tick, _, msg in sorted(events, key=lambda e: (e[0], e[1])):
+            track.append(msg.copy(time=tick - prev_tick))
             prev_tick = tick
 
-            # note_on then short note_off
-            track.append(Message('note_on', channel=9, note=note, velocity=100, time=delta))
-            # small duration in ticks for percussion
-            track.append(Message('note_off', channel=9, note=note, velocity=0, time=10))
-
         mid.save(str(out_path))
         print(f"🎹 MIDI exported → {out_path}")
-        
\ No newline at end of file
@@ -1,61 +1,281 @@
 import numpy as np
 import librosa
+import soundfile as sf
 from pathlib import Path
+from typing import Iterator, Optional
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import ANALYSIS_SR
+from services.audio_buffer import DecodedAudio, stft_sizes
+
+
+class BeatGrid:
+    """
+    Result of OnsetDetector.beat_grid().
+    bpm: global tempo
+    beats: beat times in seconds
+    tempo_map: [(seconds, bpm)] tempo changes, first entry at 0.0
+    """
+
+    def __init__(self, bpm: float, beats: list[float], tempo_map: list[tuple[float, float]]):
+        self.bpm = bpm
+        self.beats = beats
+        self.tempo_map = tempo_map
+
+    def to_dict(self) -> dict:
+        return {"bpm": self.bpm, "beats": self.beats, "tempo_map": self.tempo_map}
+
+
+class _StreamingPeakPicker:
+    """
+    Incremental version of librosa's onset_detect peak picking + backtracking.
+    Envelope frames are pushed in blocks; a frame is decided as soon as its
+    look-ahead window is complete, so onsets come out with ~0.1s of latency.
+    `wait` and backtracking state carry across block boundaries.
+    """
+
+    def __init__(self, sr: int, hop: int, delta: float, wait: int, lead: int):
+        # Same window sizes as librosa.onset.onset_detect
+        self.pre_max = int(np.ceil(0.03 * sr // hop))
+        self.post_max = int(0.00 * sr // hop + 1)
+        self.pre_avg = int(np.ceil(0.10 * sr // hop))
+        self.post_avg = int(0.10 * sr // hop + 1)
+        self.delta = delta
+        self.wait = wait
+
+        self.env = np.zeros(lead)     # envelope frames still needed, from global frame `base`
+        self.base = 0
+        self.next_frame = 0           # first global frame not decided yet
+        self.last_onset = -np.inf
+        self.env_max = 0.0            # running max, stands in for the global normalisation
+
+    def push(self, frames: np.ndarray) -> list[int]:
+        self.env = np.concatenate([self.env, frames])
+        self.env_max = max(self.env_max, float(frames.max(initial=0.0)))
+        return self._pick(final=False)
+
+    def flush(self) -> list[int]:
+        return self._pick(final=True)
+
+    def _pick(self, final: bool) -> list[int]:
+        env = self.env
+        end = len(env) if final else len(env) - max(self.post_max, self.post_avg)
+        first = self.next_frame - self.base
+        if end <= first:
+            return []
+
+        idx = np.arange(first, end)
+        x = env / (self.env_max + np.finfo(float).tiny)
+        # x[n] == max(x[n - pre_max : n + post_max])
+        padded = np.concatenate([np.full(self.pre_max, -np.inf), x, np.full(self.post_max, -np.inf)])
+        mov_max = sliding_window_view(padded, self.pre_max + self.post_max)[idx].max(axis=1)
+        # x[n] >= mean(x[n - pre_avg : n + post_avg]) + delta
+        csum = np.concatenate([[0.0], np.cumsum(x)])
+        lo = np.maximum(idx - self.pre_avg, 0)
+        hi = np.minimum(idx + self.post_avg, len(x))
+        mov_avg = (csum[hi] - csum[lo]) / (hi - lo)
+        candidates = idx[(x[idx] > 0) & (x[idx] == mov_max) & (x[idx] >= mov_avg + self.delta)]
+
+        # Local minima for backtracking (frame 0 always counts, as in librosa)
+        minima = np.flatnonzero((env[1:-1] <= env[:-2]) & (env[1:-1] < env[2:])) + 1 + self.base
+        if self.base == 0:
+            minima = np.concatenate([[0], minima])
+
+        onsets = []
+        for n in candidates + self.base:
+            if n > self.last_onset + self.wait:
+                self.last_onset = n
+                before = minima[minima <= n]
+                onsets.append(int(before[-1]) if before.size else int(n))
+
+        # Keep enough history for the next windows and the next backtrack
+        self.next_frame = end + self.base
+        keep = self.next_frame - max(self.pre_max, self.pre_avg)
+        before = minima[minima <= self.next_frame]
+        if before.size:
+            keep = min(keep, int(before[-1]))
+        keep = max(keep, self.base)
+        self.env = env[keep - self.base:]
+        self.base = keep
+        return onsets
+
 
 class OnsetDetector:
     def __init__(self, hop: int = 256, n_mels: int = 128, fmax: int = 12000,
-                 delta: float = 0.15, wait: int = 3):
+                 delta: float = 0.15, wait: int = 3, n_fft: int = 2048):
         """
         Args:
-            hop: hop length for onset detection
+            hop: hop length for onset detection (at 44.1 kHz, rescaled for other rates)
             n_mels: mel bins for onset envelope
             fmax: max frequency for spectral flux
             delta: sensitivity threshold
             wait: minimum frames between onsets
+            n_fft: FFT size for the envelope (at 44.1 kHz, rescaled for other rates)
         """
         self.hop = hop
+        self.n_fft = n_fft
         self.n_mels = n_mels
         self.fmax = fmax
         self.delta = delta
         self.wait = wait
 
-    def load_audio(self, path: Path, sr: int = None) -> tuple[np.ndarray, int]:
+    def params(self) -> dict:
         """
-        Load an audio file into memory as a waveform
+        Settings that change the detected onsets (for artefact manifests).
+        """
+        return {"hop": self.hop, "n_fft": self.n_fft, "n_mels": self.n_mels, "fmax": self.fmax,
+                "delta": self.delta, "wait": self.wait, "analysis_sr": ANALYSIS_SR}
+
+    def _stft(self, sr: int) -> tuple[int, int]:
+        # Same frame duration at any analysis rate, so onset times stay as precise
+        return stft_sizes(self.hop, self.n_fft, sr)
+
+    def load_audio(self, path: Path, sr: Optional[int] = ANALYSIS_SR) -> tuple[np.ndarray, int]:
+        """
+        Load an audio file as a waveform at the analysis rate (decoded once,
+        memory-mapped after)
         """
         try:
-            y, sr = librosa.load(path, sr=sr, mono=True)
-            return y, sr
+            audio = DecodedAudio.from_file(path, sr=sr)
+            return audio.y, audio.sr
         except Exception as e:
-            print(f"Failed to load audio {Path}: {e}")
+            print(f"Failed to load audio {path}: {e}")
             return np.array([]), 0
         
-    def detect_onsets(self, y: np.ndarray, sr: int) -> list[float]:
+    def onset_envelope(self, y: np.ndarray, sr: int) -> np.ndarray:
         """
-        Detect onsets from a waveform.
-        Returns list of onset times in seconds.
+        Onset strength envelope (one value per hop), shared by onset
+        detection and beat tracking.
         """
-        if y.size == 0 or sr == 0:
-            return []
-        
+        hop, n_fft = self._stft(sr)
         # Compute onset envelope using spectral fux with median filteing
-        onset_env = librosa.onset.onset_strength(
+        return librosa.onset.onset_strength(
             y=y,
             sr=sr,
-            hop_length = self.hop,
+            n_fft=n_fft,
+            hop_length = hop,
             aggregate=np.median,
             n_mels=self.n_mels,
-            fmax=self.fmax  # Capture cymbal and snare crack
+            fmax=min(self.fmax, sr / 2)  # Capture cymbal and snare crack
         )
 
+    def detect_onsets(self, y: np.ndarray, sr: int, onset_env: Optional[np.ndarray] = None) -> list[float]:
+        """
+        Detect onsets from a waveform.
+        onset_env: envelope from onset_envelope(), computed here when missing
+        Returns list of onset times in seconds.
+        """
+        if y.size == 0 or sr == 0:
+            return []
+        if onset_env is None:
+            onset_env = self.onset_envelope(y, sr)
+
+        hop, _ = self._stft(sr)
         onset_frames = librosa.onset.onset_detect(
             onset_envelope=onset_env,
             sr=sr,
-            hop_length=self.hop,
+            hop_length=hop,
             backtrack=True,
             units='frames',
             delta=self.delta,
             wait=self.wait  # prevent double hits but allow flams/rolls
         )
-        onset_times = librosa.frames_to_time(onset_frames, sr=sr, hop_length=self.hop)
+        onset_times = librosa.frames_to_time(onset_frames, sr=sr, hop_length=hop)
         return onset_times.tolist()
+
+    def beat_grid(self, onset_env: np.ndarray, sr: int, smooth_beats: int = 8,
+                  min_change: float = 0.02) -> BeatGrid:
+        """
+        Tempo and beats from an onset envelope (no second spectral analysis).
+        The tempo map follows the local tempo: the median inter-beat interval
+        over smooth_beats beats, with a new entry only when it moves by more
+        than min_change (relative).
+        """
+        if onset_env.size == 0:
+            return BeatGrid(0.0, [], [])
+        hop, _ = self._stft(sr)
+        tempo, beats = librosa.beat.beat_track(
+            onset_envelope=onset_env, sr=sr, hop_length=hop, units="time")
+        bpm = float(np.atleast_1d(tempo)[0])
+        beats = np.asarray(beats, dtype=np.float64)
+
+        tempo_map = [(0.0, bpm)]
+        if len(beats) > smooth_beats:
+            intervals = np.diff(beats)
+            local = np.array([np.median(intervals[max(0, i - smooth_beats // 2):i + smooth_beats // 2 + 1])
+                              for i in range(len(intervals))])
+            tempo_map = [(0.0, 60.0 / local[0])]
+            for t, interval in zip(beats[1:], local[1:]):
+                local_bpm = 60.0 / interval
+                if abs(local_bpm - tempo_map[-1][1]) > min_change * tempo_map[-1][1]:
+                    tempo_map.append((float(t), float(local_bpm)))
+        return BeatGrid(bpm, beats.tolist(), [(t, round(b, 3)) for t, b in tempo_map])
+
+    def analyze(self, y: np.ndarray, sr: int) -> tuple[list[float], BeatGrid]:
+        """
+        Onsets and beat grid from one onset envelope.
+        """
+        if y.size == 0 or sr == 0:
+            return [], BeatGrid(0.0, [], [])
+        onset_env = self.onset_envelope(y, sr)
+        return self.detect_onsets(y, sr, onset_env), self.beat_grid(onset_env, sr)
+
+    def stream_onsets(self, path: Path, block_sec: float = 30.0,
+                      envelope: Optional[list] = None) -> Iterator[float]:
+        """
+        Detect onsets without loading the whole stem.
+        Reads the file in overlapping blocks, extends the onset envelope block by
+        block and yields onset times (seconds) as soon as they are final.
+        Same features and peak picking as detect_onsets; the only difference is
+        that the envelope is normalised by its running max instead of the
+        global one, so the first seconds can be slightly more sensitive.
+        Runs at the file's native rate (blocks are not resampled).
+        envelope: list receiving the envelope, block by block, aligned with
+                  onset_envelope() frames at that rate (one float per hop, small
+                  enough to keep for beat_grid)
+        """
+        sr = sf.info(str(path)).samplerate
+        hop, n_fft = self._stft(sr)
+        # detect_onsets' envelope starts with lag + n_fft // (2 * hop) zeros and its
+        # frames are centred; our frames aren't, which is another n_fft // (2 * hop)
+        lead = 1 + 2 * (n_fft // (2 * hop))
+        picker = _StreamingPeakPicker(sr, hop, self.delta, self.wait, lead)
+        if envelope is not None:
+            envelope.append(np.zeros(lead, dtype=np.float32))
+
+        # Blocks overlap by n_fft - hop so frames continue seamlessly across them
+        blocksize = n_fft + hop * max(1, int(block_sec * sr) // hop)
+        prev_frame = None
+        db_max = -np.inf
+
+        for block in sf.blocks(str(path), blocksize=blocksize, overlap=n_fft - hop,
+                               dtype="float32", always_2d=True):
+            y = block.mean(axis=1)
+            if len(y) < n_fft:
+                y = np.pad(y, (0, n_fft - len(y)))
+            mel = librosa.feature.melspectrogram(
+                y=y,
+                sr=sr,
+                n_fft=n_fft,
+                hop_length=hop,
+                center=False,
+                n_mels=self.n_mels,
+                fmax=min(self.fmax, sr / 2)
+            )
+            S = librosa.power_to_db(mel, top_db=None)
+            db_max = max(db_max, float(S.max()))
+            S = np.maximum(S, db_max - 80.0)
+
+            # Spectral flux with median aggregation, continued from the previous block
+            if prev_frame is not None:
+                S = np.concatenate([prev_frame, S], axis=1)
+            flux = np.median(np.maximum(0.0, np.diff(S, axis=1)), axis=0)
+            prev_frame = S[:, -1:]
+            if envelope is not None:
+                envelope.append(flux.astype(np.float32))
+
+            for frame in picker.push(flux):
+                yield float(librosa.frames_to_time(frame, sr=sr, hop_length=hop))
+
+        for frame in picker.flush():
+            yield float(librosa.frames_to_time(frame, sr=sr, hop_length=hop))
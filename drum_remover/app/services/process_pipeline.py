@@ -1,13 +1,19 @@
 import json
+import threading
 from pathlib import Path
 from typing import Optional
 
-import numpy as np
-
+from config import ANALYSIS_SR, ANALYSIS_STAGE_WORKERS
+from services.audio_buffer import DecodedAudio
 from services.onset_detector import OnsetDetector
 from services.cnn_preparer import CNNPreparer
-from services.drum_classifier import DrumClassifier
+from services.drum_classifier import DrumClassifier, labels_to_names
 from services.midi_writer import MIDIWriter
+from services.feature_store import MelWindowStore
+from services.metrics import metrics
+from services.stage_graph import StageGraph
+from services.artifact_manifest import ArtifactManifest, fingerprint
+from services.hit_store import HitStore, hits_index_path
 
 # Instantiate reusable objects
 _detector = OnsetDetector()
@@ -20,81 +26,174 @@ def run_full_pipeline(
     force_rerun_onsets: bool = False,
     force_rerun_cnnprep: bool = False,
     save_midi: bool = True,
-    midi_bpm: int = 120
+    midi_bpm: int = 120,
+    max_workers: int = ANALYSIS_STAGE_WORKERS
 ) -> dict:
     """
     Run the pipeline end-to-end for a given drum stem file.
 
     Produces:
       - <stem>.onsets.json    (list of onset times)
-      - <stem>.mel_windows.npy (N, H, W, 1)
+      - <stem>.mel_windows.npy (N, H, W, 1), uint8/float16 (see MelWindowStore)
       - <stem>.hits.json      (list of {time, label})
+      - <stem>.hits.npy       (same hits, time-sorted index served by /hits)
       - <stem>.drums.mid      (if save_midi True)
+      - <stem>.manifest.json  (input hashes + parameters behind each file above)
+
+    The mel spectrogram is computed while onsets are detected; windows,
+    classification and MIDI follow as their inputs become ready (StageGraph
+    with max_workers threads). A failing stage raises StageFailed.
+
+    Existing files are reused only while the manifest says they were built
+    from the same audio, upstream outputs and stage parameters. force_rerun_*
+    recompute one stage; later stages follow only if its output changed.
 
     Returns a dict with paths and counts.
     """
     drums_path = Path(drums_path)
     if not drums_path.exists():
         raise FileNotFoundError(f"Drums stem not found: {drums_path}")
-    
+
+    # Decoded lazily at ANALYSIS_SR, at most once, and shared by the stages
+    # that need samples (stages run on several threads, hence the lock)
+    audio = None
+    audio_lock = threading.Lock()
+
+    def get_audio() -> DecodedAudio:
+        nonlocal audio
+        with audio_lock:
+            if audio is None:
+                with metrics.stage("decode") as st:
+                    audio = DecodedAudio.from_file(drums_path, sr=ANALYSIS_SR)
+                    st.items = len(audio.y)
+        return audio
+
+    onsets_json = drums_path.with_suffix(".onsets.json")
+    mel_npy = drums_path.with_suffix(".mel_windows.npy")
+    hits_json = drums_path.with_suffix(".hits.json")
+    hits_index = hits_index_path(drums_path)
+    midi_path = drums_path.with_suffix(".drums.mid")
+
+    # What produced each artefact: a stage reruns only when its inputs changed
+    manifest = ArtifactManifest(drums_path)
+    audio_hash = manifest.source_hash()
+    store = MelWindowStore()
+    onsets_fp = fingerprint("onsets", audio_hash, _detector.params())
+    onsets_fresh = not force_rerun_onsets and manifest.is_fresh("onsets", onsets_fp, onsets_json)
+
+    def windows_fingerprint(onsets_hash: str) -> str:
+        return fingerprint("mel_windows", audio_hash, onsets_hash, _cnn_preparer.params(), store.dtype.str)
+
     # ---------------------------
     # 1) Onsets (detect or load)
     # ---------------------------
-    onsets_json = drums_path.with_suffix(".onsets.json")
-    if onsets_json.exists() and not force_rerun_onsets:
-        with open(onsets_json, "r") as f:
-            data = json.load(f)
-            onset_times = data.get("onsets", [])
-        print(f"[Pipeline] Loaded {len(onset_times)} onsets from {onsets_json}")
-    else:
+    def onsets() -> tuple[list[float], str]:
+        if onsets_fresh:
+            with open(onsets_json, "r") as f:
+                data = json.load(f)
+                onset_times = data.get("onsets", [])
+            print(f"[Pipeline] Loaded {len(onset_times)} onsets from {onsets_json}")
+            return onset_times, manifest.output_hash("onsets")
         # load audio and detect
-        y, sr = _detector.load_audio(drums_path)
-        onset_times = _detector.detect_onsets(y, sr)
+        y, sr = get_audio().y, get_audio().sr
+        with metrics.stage("onsets") as st:
+            onset_times = _detector.detect_onsets(y, sr)
+            st.items = len(onset_times)
         with open(onsets_json, "w") as f:
             json.dump({"onsets": onset_times}, f)
+        onsets_hash = fingerprint(onset_times)
+        manifest.record("onsets", onsets_fp, onsets_json, onsets_hash, _detector.params())
         print(f"[Pipeline] Detected {len(onset_times)} onsets and saved to {onsets_json}")
+        return onset_times, onsets_hash
+
     # ---------------------------
-    # 2) CNN preparation (mel windows)
+    # 2) CNN preparation (mel spectrogram in parallel with onsets, then windows)
     # ---------------------------
-    mel_npy = drums_path.with_suffix(".mel_windows.npy")
-    if mel_npy.exists() and not force_rerun_cnnprep:
-        batch = np.load(mel_npy, allow_pickle=False)
-        print(f"[Pipeline] Loaded CNN batch from {mel_npy} shape={batch.shape}")
-    else:
-        batch = _cnn_preparer.prepare_for_cnn(drums_path, onset_times)
-        np.save(mel_npy, batch)
-        print(f"[Pipeline] Prepared CNN batch shape={batch.shape} saved to {mel_npy}")
+    def windows_reusable(onsets_hash: str) -> bool:
+        return not force_rerun_cnnprep and manifest.is_fresh(
+            "mel_windows", windows_fingerprint(onsets_hash), mel_npy)
+
+    def mel_spectrogram():
+        # Known up front only when the onsets are reused; otherwise compute it
+        # speculatively, the onsets are being redone anyway
+        if onsets_fresh and windows_reusable(manifest.output_hash("onsets")):
+            return None
+        y, sr = get_audio().y, get_audio().sr
+        with metrics.stage("mel_spectrogram"):
+            return _cnn_preparer.mel_spectrogram(y, sr)
+
+    def mel_windows(onsets_out, mel) -> tuple[int, str]:
+        onset_times, onsets_hash = onsets_out
+        windows_fp = windows_fingerprint(onsets_hash)
+        if windows_reusable(onsets_hash):
+            num_windows = MelWindowStore.count(mel_npy)
+            print(f"[Pipeline] Found {num_windows} CNN windows in {mel_npy}")
+            return num_windows, windows_fp
+        audio_buf = get_audio()
+        with metrics.stage("mel_prep") as st:
+            num_windows = _cnn_preparer.save_windows(audio_buf, onset_times, mel_npy, store, mel=mel)
+            st.items = int(num_windows)
+        # Windows are a pure function of their inputs: the fingerprint doubles as output hash
+        manifest.record("mel_windows", windows_fp, mel_npy, windows_fp,
+                        {**_cnn_preparer.params(), "dtype": store.dtype.str})
+        print(f"[Pipeline] Prepared {num_windows} CNN windows saved to {mel_npy}")
+        return num_windows, windows_fp
+
     # ---------------------------
     # 3) Classification
     # ---------------------------
-    hits_json = drums_path.with_suffix(".hits.json")
-    if hits_json.exists() and not (force_rerun_onsets or force_rerun_cnnprep):
-        with open(hits_json, "r") as f:
-            hits = json.load(f).get("hits", [])
-        print(f"[Pipeline] Loaded existing hits: {len(hits)}")
-    else:
-        if batch.shape[0] == 0:
+    def classify(onsets_out, windows_out) -> tuple[list[dict], str]:
+        onset_times, _ = onsets_out
+        num_windows, windows_fp = windows_out
+        hits_fp = fingerprint("hits", windows_fp, _classifier.params())
+        if manifest.is_fresh("hits", hits_fp, hits_json):
+            with open(hits_json, "r") as f:
+                hits = json.load(f).get("hits", [])
+            print(f"[Pipeline] Loaded existing hits: {len(hits)}")
+            if not hits_index.exists():
+                HitStore.write_hits(hits_index, hits)
+            return hits, manifest.output_hash("hits")
+        if num_windows == 0:
             hits = []
             print("[Pipeline] No windows to classify.")
         else:
-            labels = _classifier.classify_batch(batch)
+            with metrics.stage("classify", items=int(num_windows)):
+                labels = labels_to_names(_classifier.classify_from_file(mel_npy))
             hits = [{"time": float(t), "label": str(l)} for t, l in zip(onset_times, labels)]
-            with open(hits_json, "w") as f:
-                json.dump({"hits": hits}, f)
             print(f"[Pipeline] Classified {len(hits)} hits and saved to {hits_json}")
+        with open(hits_json, "w") as f:
+            json.dump({"hits": hits}, f)
+        HitStore.write_hits(hits_index, hits)
+        hits_hash = fingerprint(hits)
+        manifest.record("hits", hits_fp, hits_json, hits_hash, _classifier.params())
+        return hits, hits_hash
+
     # ---------------------------
     # 4) MIDI export
     # ---------------------------
-    midi_path = drums_path.with_suffix(".drums.mid")
-    if save_midi and (not midi_path.exists() or force_rerun_onsets or force_rerun_cnnprep):
-        writer = MIDIWriter(bpm=midi_bpm)
-        writer.write(hits, midi_path)
+    def midi(hits_out):
+        hits, hits_hash = hits_out
+        midi_fp = fingerprint("midi", hits_hash, midi_bpm)
+        if save_midi and not manifest.is_fresh("midi", midi_fp, midi_path):
+            writer = MIDIWriter(bpm=midi_bpm)
+            with metrics.stage("midi", items=len(hits)):
+                writer.write(hits, midi_path)
+            manifest.record("midi", midi_fp, midi_path, midi_fp, {"bpm": midi_bpm})
+
+    results = (StageGraph(max_workers=max_workers)
+               .add("onsets", onsets)
+               .add("mel", mel_spectrogram)
+               .add("windows", mel_windows, deps=("onsets", "mel"))
+               .add("hits", classify, deps=("onsets", "windows"))
+               .add("midi", midi, deps=("hits",))
+               .run())
 
     return {
         "onsets_json": str(onsets_json),
         "mel_npy": str(mel_npy),
         "hits_json": str(hits_json),
         "midi": str(midi_path) if save_midi else None,
-        "num_onsets": len(onset_times),
-        "num_windows": int(batch.shape[0])
-    }
\ No newline at end of file
+        "manifest": str(manifest.path),
+        "num_onsets": len(results["onsets"][0]),
+        "num_windows": int(results["windows"][0])
+    }
@@ -0,0 +1,162 @@
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import ContextManager, Iterator, Optional
+
+import numpy as np
+
+from config import OUTPUT_DIR, CACHE_MAX_BYTES
+from services.key_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FILE = "entry.json"
+
+
+class ResultCache:
+    """
+    Content-addressed cache of separation outputs.
+    Every entry is a directory OUTPUT_DIR/<key>/ holding the stems (and whatever
+    analysis files get written next to them). The key hashes the decoded audio
+    plus the model name and separation parameters, so identical audio is never
+    separated twice and different songs with the same file name never collide.
+    Entries are evicted least-recently-used once the total size passes max_bytes;
+    entries held with in_use() (a job analysing its stems, a transcode reading
+    them) are skipped until released.
+    """
+
+    # Shared by every ResultCache in the process: the API and the in-process
+    # workers may each build their own over the same root
+    _in_use: Counter = Counter()
+    _in_use_lock = threading.Lock()
+
+    def __init__(self, root: Path = OUTPUT_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = KeyedLocks()
+
+    @staticmethod
+    def make_key(wav, model_name: str, params: dict) -> str:
+        """
+        wav: decoded audio (numpy array or CPU torch tensor)
+        params: separation settings that change the output (shifts, overlap, ...)
+        """
+        audio = np.ascontiguousarray(np.asarray(wav, dtype=np.float32))
+        h = hashlib.sha256()
+        h.update(str(audio.shape).encode())
+        h.update(audio)
+        h.update(json.dumps({"model": model_name, **params}, sort_keys=True).encode())
+        return h.hexdigest()[:32]
+
+    @staticmethod
+    def make_file_key(input_file: Path, model_name: str, params: dict) -> str:
+        """
+        Key from the raw file bytes, for inputs too long to decode in one go.
+        """
+        h = hashlib.sha256()
+        with open(input_file, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        h.update(json.dumps({"model": model_name, "mode": "long", **params}, sort_keys=True).encode())
+        return h.hexdigest()[:32]
+
+    def key_lock(self, key: str) -> ContextManager[None]:
+        """
+        Per-key lock so two jobs with the same audio don't both run the model.
+        """
+        return self._key_locks.hold(key)
+
+    @contextmanager
+    def in_use(self, key: str) -> Iterator[None]:
+        """
+        Keep the entry for key out of eviction for the duration of the with block.
+        Only covers this process: separate worker processes rely on LRU order.
+        """
+        with self._in_use_lock:
+            self._in_use[key] += 1
+        try:
+            yield
+        finally:
+            with self._in_use_lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+
+    def is_in_use(self, key: str) -> bool:
+        with self._in_use_lock:
+            return key in self._in_use
+
+    def entry_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def paths(self, key: str, song_name: str) -> dict:
+        entry = self.entry_dir(key)
+        return {
+            "drums": entry / f"{song_name}_drums.wav",
+            "rest": entry / f"{song_name}_no_drums.wav",
+        }
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        Return the stored stem paths for key, or None on a miss.
+        A hit refreshes the entry's LRU timestamp.
+        """
+        entry_file = self.entry_dir(key) / ENTRY_FILE
+        try:
+            with open(entry_file, "r") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        paths = self.paths(key, meta["song_name"])
+        if not all(p.exists() for p in paths.values()):
+            return None
+        os.utime(entry_file)
+        logger.info("Cache hit %s (%s)", key, meta["song_name"])
+        return paths
+
+    def commit(self, key: str, song_name: str, model_name: str, params: dict):
+        """
+        Mark an entry complete once its stems are written, then enforce the size bound.
+        """
+        entry_file = self.entry_dir(key) / ENTRY_FILE
+        with open(entry_file, "w") as f:
+            json.dump({"song_name": song_name, "model": model_name, "params": params,
+                       "created_at": time.time()}, f)
+        self.evict(keep=key)
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.root.exists():
+            return entries
+        for entry in self.root.iterdir():
+            entry_file = entry / ENTRY_FILE
+            if not entry.is_dir() or not entry_file.exists():
+                continue
+            size = sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            entries.append((entry_file.stat().st_mtime, size, entry))
+        return entries
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Delete least-recently-used entries until the cache fits in max_bytes.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry.name == keep or self.is_in_use(entry.name):
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                logger.info("Evicted cached result %s (%d bytes)", entry.name, size)
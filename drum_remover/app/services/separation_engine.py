@@ -0,0 +1,368 @@
+from pathlib import Path
+import logging
+import math
+import threading
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+import torch
+from demucs.apply import apply_model
+from demucs.audio import AudioFile, save_audio
+from demucs.pretrained import get_model
+
+from config import DEMUCS_MODEL, DEMUCS_SHIFTS, DEMUCS_OVERLAP, DEMUCS_SEGMENT
+from config import SEPARATION_MAX_MEMORY_MB, LONG_AUDIO_CROSSFADE
+
+# Rough working memory of one forward pass (activations), on top of the weights
+_ACTIVATION_BYTES = 512 * 1024**2
+
+logger = logging.getLogger(__name__)
+
+
+def decode_audio(input_file: Path, samplerate: int, channels: int,
+                 duration: Optional[float] = None) -> np.ndarray:
+    """
+    Decode an audio file (its first `duration` seconds if given) to a
+    (channels, samples) float32 array.
+    Module level so it can run in a process pool.
+    """
+    wav = AudioFile(Path(input_file)).read(streams=0, samplerate=samplerate, channels=channels,
+                                           duration=duration)
+    return wav.numpy()
+
+
+def encode_audio(wav: np.ndarray, out_path: Path, samplerate: int):
+    """
+    Write a (channels, samples) array as 16-bit WAV.
+    Module level so it can run in a process pool.
+    """
+    save_audio(torch.from_numpy(wav), str(out_path), samplerate=samplerate)
+
+
+class SeparationEngine:
+    """
+    Long-lived Demucs wrapper.
+    The model is loaded once (on first use or on warm_up()) and stays resident,
+    every separation calls apply_model directly on in-memory tensors.
+    """
+
+    def __init__(self, model_name: str = DEMUCS_MODEL, shifts: int = DEMUCS_SHIFTS,
+                 overlap: float = DEMUCS_OVERLAP, segment: Optional[float] = DEMUCS_SEGMENT,
+                 device: str = "cpu", model: Optional[torch.nn.Module] = None):
+        """
+        Args:
+            model_name: pretrained Demucs model name (htdemucs, htdemucs_ft, ...)
+            shifts: number of random shifts averaged (shift trick, 0 disables it)
+            overlap: overlap between split segments, 0..1
+            segment: segment length in seconds, None uses the model default
+            device: torch device to run on
+            model: already loaded model to use instead of the pretrained one
+                   (a small stand-in in benchmarks)
+        """
+        self.model_name = model_name
+        self.device = device
+        self._model = model.to(device).eval() if model is not None else None
+        self._load_lock = threading.Lock()
+        self.configure(shifts=shifts, overlap=overlap, segment=segment)
+
+    def configure(self, shifts: Optional[int] = None, overlap: Optional[float] = None,
+                  segment: Optional[float] = None):
+        """
+        Update runtime separation settings. Arguments left as None keep their value,
+        except segment which is always applied (None = model default).
+        """
+        if shifts is not None:
+            if shifts < 0:
+                raise ValueError(f"shifts must be >= 0, got {shifts}")
+            self.shifts = int(shifts)
+        if overlap is not None:
+            if not 0 <= overlap < 1:
+                raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+            self.overlap = float(overlap)
+        if segment is not None and segment <= 0:
+            raise ValueError(f"segment must be > 0, got {segment}")
+        self.segment = segment
+
+    def settings(self) -> dict:
+        """
+        Current parameters that affect the separation output.
+        """
+        return {"shifts": self.shifts, "overlap": self.overlap, "segment": self.segment}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info("Loading Demucs model %s", self.model_name)
+                    model = get_model(self.model_name)
+                    model.to(self.device)
+                    model.eval()
+                    self._model = model
+        return self._model
+
+    @property
+    def samplerate(self) -> int:
+        return self.model.samplerate
+
+    @property
+    def sources(self) -> list[str]:
+        return list(self.model.sources)
+
+    def warm_up(self):
+        """
+        Load the model now instead of on the first request.
+        """
+        return self.model
+
+    def load(self, input_file: Path, duration: Optional[float] = None) -> torch.Tensor:
+        """
+        Decode an audio file to a (channels, samples) tensor at the model rate.
+        duration: decode only the first seconds (previews)
+        """
+        return torch.from_numpy(
+            decode_audio(input_file, self.model.samplerate, self.model.audio_channels, duration))
+
+    def duration(self, input_file: Path) -> float:
+        """
+        Length of an audio file in seconds, without decoding it.
+        """
+        return float(AudioFile(Path(input_file)).duration)
+
+    def separate(self, wav: torch.Tensor, shifts: Optional[int] = None,
+                 overlap: Optional[float] = None, segment: Optional[float] = None,
+                 stats: Optional[tuple[float, float]] = None) -> dict:
+        """
+        Separate a (channels, samples) tensor into drums and no_drums.
+        Per-call arguments override the engine settings.
+        stats: (mean, std) to normalise with, default computed from wav
+        Returns {"drums": tensor, "no_drums": tensor}, both (channels, samples).
+        """
+        model = self.model
+        shifts = self.shifts if shifts is None else shifts
+        overlap = self.overlap if overlap is None else overlap
+        segment = self.segment if segment is None else segment
+
+        # Same normalisation as the demucs CLI
+        if stats is None:
+            ref = wav.mean(0)
+            mean, std = ref.mean(), ref.std()
+        else:
+            mean, std = stats
+        mix = (wav - mean) / (std + 1e-8)
+
+        with torch.no_grad():
+            sources = apply_model(
+                model, mix[None],
+                device=self.device,
+                shifts=shifts,
+                split=True,
+                overlap=overlap,
+                segment=segment,
+                progress=False)[0]
+        sources = sources * std + mean
+
+        drums_idx = model.sources.index("drums")
+        drums = sources[drums_idx]
+        no_drums = sources.sum(0) - drums
+        return {"drums": drums, "no_drums": no_drums}
+
+    def _read_region(self, audio_file: AudioFile, start: int, length: int) -> torch.Tensor:
+        """
+        Decode `length` samples from `start` (model-rate samples), exact length.
+        """
+        sr = self.model.samplerate
+        wav = audio_file.read(seek_time=start / sr, duration=length / sr, streams=0,
+                              samplerate=sr, channels=self.model.audio_channels)
+        if wav.shape[-1] < length:
+            wav = torch.nn.functional.pad(wav, (0, length - wav.shape[-1]))
+        return wav[:, :length]
+
+    def window_samples(self, max_memory_mb: int, segment: Optional[float] = None) -> int:
+        """
+        Longest window (in samples) that should separate within max_memory_mb.
+        Estimate: weights + one forward pass of activations + float32 buffers for
+        the mix, its normalised copy and ~3 copies of every source per sample.
+        """
+        model = self.model
+        weights = sum(p.numel() * p.element_size() for p in model.parameters())
+        per_sample = 4 * model.audio_channels * (2 + 3 * len(model.sources))
+        budget = max_memory_mb * 1024**2 - weights - _ACTIVATION_BYTES
+        min_window = int(2 * self._segment_seconds(segment) * model.samplerate)
+        return max(min_window, budget // per_sample)
+
+    @staticmethod
+    def long_windows(total: int, window: int, fade: int) -> list[tuple[int, int]]:
+        """
+        (start, length) of the windows covering `total` samples, consecutive
+        windows overlapping by `fade`. The last one ends exactly at total, and
+        every window after the first is longer than fade, so there is always a
+        full crossfade region (a short remainder is merged into the window before).
+        """
+        if total <= 0:
+            return []
+        hop = window - fade
+        windows = [(0, min(window, total))]
+        while windows[-1][0] + windows[-1][1] < total:
+            start = windows[-1][0] + hop
+            if total - start <= fade:
+                # Remainder too short to crossfade into: stretch the previous window
+                prev = windows.pop()
+                windows.append((prev[0], total - prev[0]))
+                break
+            windows.append((start, min(window, total - start)))
+        return windows
+
+    def separate_long(self, input_file: Path, out_paths: dict,
+                      max_memory_mb: int = SEPARATION_MAX_MEMORY_MB,
+                      crossfade: float = LONG_AUDIO_CROSSFADE, **kwargs) -> dict:
+        """
+        Memory-bounded separation for very long audio (DJ mixes, concerts).
+        The input is decoded window by window; consecutive windows overlap by
+        `crossfade` seconds and are joined with a linear crossfade. Each finished
+        region of drums / no_drums is appended to out_paths right away, so peak
+        RAM depends on max_memory_mb, not on the track length.
+        kwargs (shifts, overlap, segment) are passed to separate().
+        Returns out_paths ({"drums": path, "rest": path}).
+        """
+        model = self.model
+        sr = model.samplerate
+        audio_file = AudioFile(Path(input_file))
+        total = int(math.ceil(self.duration(input_file) * sr))
+        window = self.window_samples(max_memory_mb, kwargs.get("segment"))
+        fade = min(int(crossfade * sr), window // 4)
+        logger.info("Long separation: %.0fs in windows of %.0fs", total / sr, window / sr)
+
+        # Pass 1: whole-track normalisation stats, like separate() would use
+        count, s1, s2 = 0, 0.0, 0.0
+        for start in range(0, total, window):
+            ref = self._read_region(audio_file, start, min(window, total - start)).mean(0).double()
+            count += ref.numel()
+            s1 += float(ref.sum())
+            s2 += float((ref ** 2).sum())
+        mean = s1 / max(count, 1)
+        std = math.sqrt(max(s2 / max(count, 1) - mean ** 2, 0.0))
+
+        # Pass 2: separate windows and stream finished regions to disk
+        ramp = torch.linspace(0.0, 1.0, fade)
+        tails = {"drums": None, "no_drums": None}
+        writers = {
+            "drums": sf.SoundFile(str(out_paths["drums"]), "w", samplerate=sr,
+                                  channels=model.audio_channels, subtype="PCM_16"),
+            "no_drums": sf.SoundFile(str(out_paths["rest"]), "w", samplerate=sr,
+                                     channels=model.audio_channels, subtype="PCM_16"),
+        }
+
+        def write(name: str, wav: torch.Tensor):
+            writers[name].write(np.clip(wav.numpy().T, -1.0, 1.0))
+
+        try:
+            windows = self.long_windows(total, window, fade)
+            for i, (start, length) in enumerate(windows):
+                last = i == len(windows) - 1
+                wav = self._read_region(audio_file, start, length)
+                stems = self.separate(wav, stats=(mean, std), **kwargs)
+                for name, stem in stems.items():
+                    head = 0
+                    if tails[name] is not None:
+                        # Crossfade the previous window's tail into this window's head
+                        head = fade
+                        write(name, tails[name] * (1 - ramp) + stem[:, :fade] * ramp)
+                    if last:
+                        write(name, stem[:, head:])
+                    else:
+                        write(name, stem[:, head:length - fade])
+                        tails[name] = stem[:, length - fade:]
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return out_paths
+
+    def _segment_seconds(self, segment: Optional[float]) -> float:
+        """
+        Segment length the model can take in one forward pass.
+        """
+        if segment:
+            return float(segment)
+        models = getattr(self.model, "models", [self.model])
+        return min(float(getattr(m, "segment", 10.0)) for m in models)
+
+    def separate_batch(self, wavs: list[torch.Tensor], batch_size: int = 8,
+                       shifts: Optional[int] = None, overlap: Optional[float] = None,
+                       segment: Optional[float] = None) -> list[dict]:
+        """
+        Separate several (channels, samples) tensors at once.
+        Every track is cut into overlapping segments, segments from all tracks are
+        packed into shared batches of batch_size for the forward pass, and the
+        outputs are overlap-added back per track with triangular weights.
+        Returns one {"drums": tensor, "no_drums": tensor} per input, in order.
+        """
+        model = self.model
+        shifts = self.shifts if shifts is None else shifts
+        overlap = self.overlap if overlap is None else overlap
+        sr = model.samplerate
+
+        # apply_model pads by up to 2 * 0.5s for the shift trick, keep room for it
+        chunk_len = int(sr * self._segment_seconds(segment))
+        if shifts:
+            chunk_len -= 2 * int(0.5 * sr)
+        stride = max(1, int((1 - overlap) * chunk_len))
+        weight = torch.cat([torch.arange(1, chunk_len // 2 + 1),
+                            torch.arange(chunk_len - chunk_len // 2, 0, -1)]).float()
+        weight = weight / weight.max()
+
+        mixes, stats, outs, totals, chunks = [], [], [], [], []
+        for i, wav in enumerate(wavs):
+            ref = wav.mean(0)
+            mean, std = ref.mean(), ref.std()
+            mix = (wav - mean) / (std + 1e-8)
+            mixes.append(mix)
+            stats.append((mean, std))
+            outs.append(torch.zeros(len(model.sources), *mix.shape))
+            totals.append(torch.zeros(mix.shape[-1]))
+            chunks.extend((i, offset) for offset in range(0, mix.shape[-1], stride))
+
+        for start in range(0, len(chunks), batch_size):
+            group = chunks[start:start + batch_size]
+            batch = torch.zeros(len(group), model.audio_channels, chunk_len)
+            for b, (i, offset) in enumerate(group):
+                piece = mixes[i][:, offset:offset + chunk_len]
+                batch[b, :, :piece.shape[-1]] = piece
+            with torch.no_grad():
+                est = apply_model(model, batch, device=self.device, shifts=shifts,
+                                  split=False, progress=False).cpu()
+            for b, (i, offset) in enumerate(group):
+                n = min(chunk_len, mixes[i].shape[-1] - offset)
+                outs[i][..., offset:offset + n] += est[b, ..., :n] * weight[:n]
+                totals[i][offset:offset + n] += weight[:n]
+
+        drums_idx = model.sources.index("drums")
+        results = []
+        for out, total, (mean, std) in zip(outs, totals, stats):
+            sources = out / total.clamp_min(1e-8) * std + mean
+            drums = sources[drums_idx]
+            results.append({"drums": drums, "no_drums": sources.sum(0) - drums})
+        return results
+
+    def save(self, wav: torch.Tensor, out_path: Path):
+        """
+        Write a (channels, samples) tensor as 16-bit WAV.
+        """
+        encode_audio(wav.cpu().numpy(), out_path, self.model.samplerate)
+
+
+_engines: dict[str, SeparationEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(model_name: str = DEMUCS_MODEL) -> SeparationEngine:
+    """
+    Process-wide engine per model name, so the weights are loaded only once.
+    """
+    with _engines_lock:
+        engine = _engines.get(model_name)
+        if engine is None:
+            engine = SeparationEngine(model_name=model_name)
+            _engines[model_name] = engine
+        return engine
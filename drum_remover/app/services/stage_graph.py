@@ -0,0 +1,76 @@
+import contextvars
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class StageFailed(RuntimeError):
+    """Raised by StageGraph.run() when a stage raises; the original error is the __cause__."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+
+
+class StageGraph:
+    """
+    Small DAG executor for the analysis stages.
+    Every stage is a function of its dependencies' results; a stage is started
+    on the thread pool as soon as all of its dependencies are done, so
+    independent stages (onsets, mel spectrogram, beat tracking) overlap.
+    Dependencies must be added before the stages that use them, which keeps
+    the graph acyclic by construction.
+    """
+
+    def __init__(self, max_workers: int = 3):
+        self.max_workers = max_workers
+        self._stages: dict[str, tuple[Callable[..., Any], tuple[str, ...]]] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], deps: tuple[str, ...] = ()) -> "StageGraph":
+        """
+        Args:
+            name: stage name, also the key of its result
+            fn: called with the results of deps, in order
+            deps: names of stages already added
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage already defined: {name}")
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+        self._stages[name] = (fn, tuple(deps))
+        return self
+
+    def run(self) -> dict[str, Any]:
+        """
+        Run every stage and return {name: result}.
+        The first failure cancels the stages not yet started and raises StageFailed.
+        Stages run in a copy of the caller's context (so metrics stay attributed
+        to the current job).
+        """
+        results: dict[str, Any] = {}
+        pending = dict(self._stages)
+        running: dict[Future, str] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as pool:
+            while pending or running:
+                for name, (fn, deps) in list(pending.items()):
+                    if all(d in results for d in deps):
+                        args = [results[d] for d in deps]
+                        ctx = contextvars.copy_context()
+                        running[pool.submit(ctx.run, fn, *args)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        for other in running:
+                            other.cancel()
+                        logger.error("Stage %s failed: %s", name, e)
+                        raise StageFailed(name, e) from e
+        return results
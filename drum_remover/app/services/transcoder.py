@@ -0,0 +1,87 @@
+from pathlib import Path
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from config import STEM_MP3_BITRATE
+from services.key_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# Bitrates (kbps) LAME accepts for MPEG-1 layer III
+MP3_BITRATES = (64, 96, 128, 160, 192, 224, 256, 320)
+MEDIA_TYPES = {"mp3": "audio/mpeg"}
+
+
+class StemTranscoder:
+    """
+    On-demand compressed copies of the WAV stems, cached next to them
+    (<stem>.<bitrate>k.mp3). The WAV is read and encoded block by block,
+    so memory stays flat for long stems; concurrent requests for the same
+    transcode wait for one encoder instead of running several.
+    """
+
+    def __init__(self, bitrate: int = STEM_MP3_BITRATE, quality: int = 2,
+                 block_frames: int = 1 << 16):
+        """
+        Args:
+            bitrate: default MP3 bitrate in kbps
+            quality: LAME algorithm quality, 2 = high, 7 = fast
+            block_frames: frames read and encoded per step
+        """
+        self.bitrate = bitrate
+        self.quality = quality
+        self.block_frames = block_frames
+        self._locks = KeyedLocks()
+
+    def cached_path(self, source: Path, bitrate: int) -> Path:
+        return source.with_suffix(f".{bitrate}k.mp3")
+
+    def _is_current(self, source: Path, target: Path) -> bool:
+        return target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns
+
+    def mp3(self, source: Path, bitrate: int = None) -> Path:
+        """
+        Path to an MP3 of source at bitrate kbps, encoding it on first use.
+        """
+        bitrate = bitrate or self.bitrate
+        if bitrate not in MP3_BITRATES:
+            raise ValueError(f"Unsupported bitrate {bitrate}. Use one of {MP3_BITRATES}")
+        source = Path(source)
+        target = self.cached_path(source, bitrate)
+        if self._is_current(source, target):
+            return target
+
+        with self._locks.hold(target):
+            if not self._is_current(source, target):   # another request may have finished it
+                self._encode_mp3(source, target, bitrate)
+        return target
+
+    def _encode_mp3(self, source: Path, target: Path, bitrate: int):
+        import lameenc
+        import soundfile as sf
+
+        info = sf.info(str(source))
+        if info.channels > 2:
+            raise ValueError(f"MP3 supports at most 2 channels, {source} has {info.channels}")
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(bitrate)
+        encoder.set_in_sample_rate(info.samplerate)
+        encoder.set_channels(info.channels)
+        encoder.set_quality(self.quality)
+
+        # Write-then-rename: a half-written file is never served
+        tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(tmp, "wb") as out:
+                for block in sf.blocks(str(source), blocksize=self.block_frames, dtype="int16",
+                                       always_2d=True):
+                    out.write(encoder.encode(np.ascontiguousarray(block).tobytes()))
+                out.write(encoder.flush())
+            os.replace(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        logger.info("Transcoded %s -> %s (%d kbps)", source.name, target.name, bitrate)
@@ -0,0 +1,58 @@
+"""
+Standalone separation worker.
+
+    cd drum_remover/app
+    SEPARATION_WORKERS=0 uvicorn main:app --workers 4     # API: enqueue only
+    python worker.py --workers 2                          # as many as the hardware allows
+
+Claims jobs from the shared job store (JOB_STORE / JOB_DB_PATH, see config.py),
+runs separation + analysis and writes results to OUTPUT_DIR, so API processes
+and workers scale independently. SIGINT / SIGTERM finish the current jobs first.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from config import OUTPUT_DIR, JOB_STORE, JOB_DB_PATH, JOB_STALE_SECONDS, PREWARM_ANALYSIS, ensure_dirs
+from config import PREVIEW_SECONDS
+from services.audio_processor import AudioProcessor
+from services import background_tasks
+from services.job_queue import JobQueue
+from services.job_store import make_job_store, MemoryJobStore
+
+logger = logging.getLogger("worker")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="separation threads in this process")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between polls when idle")
+    args = parser.parse_args(argv)
+
+    store = make_job_store(JOB_STORE, JOB_DB_PATH)
+    if isinstance(store, MemoryJobStore):
+        parser.error("JOB_STORE=memory can't be shared with the API, use sqlite")
+
+    ensure_dirs()
+    processor = AudioProcessor(output_dir=OUTPUT_DIR)
+    processor.engine.warm_up()
+    if PREWARM_ANALYSIS:
+        background_tasks.warm_up()
+    queue = JobQueue(processor, store=store, max_workers=args.workers,
+                     post_process=background_tasks.detect_onsets_task, poll_interval=args.poll_interval,
+                     stale_after=JOB_STALE_SECONDS, preview_seconds=PREVIEW_SECONDS)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    queue.start()
+    logger.info("Worker %s running %d thread(s) on %s store", queue.worker_prefix, args.workers, store.name)
+    stop.wait()
+    logger.info("Stopping, waiting for running jobs to finish")
+    queue.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Speed / accuracy of the analysis stages at different analysis sample rates.
+
+    python benchmarks/bench_analysis_sr.py --seconds 60 --rates 44100 32000 24000 22050 16000
+
+A seeded synthetic drum stem is generated at 44.1 kHz (what separation
+produces) and, for every rate, resampled once (DecodedAudio.resampled) and
+run through the onset envelope, onset detection, the mel spectrogram and the
+mel windows / classifier, as in the app (ANALYSIS_SR).
+
+Reported per rate:
+  - stage timings (median / min seconds) and the buffer + mel sizes in bytes
+  - onset F1, precision and recall against the ground truth (--tolerance)
+  - mean absolute onset error of the matched hits, in milliseconds
+  - label agreement with the native rate: windows are taken at the true hit
+    times so only the features differ, then classified (null if the label
+    counts differ)
+
+Writes a JSON report like bench_pipeline.py.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+import synthetic  # noqa: E402
+from services.audio_buffer import DecodedAudio, stft_sizes  # noqa: E402
+from services.onset_detector import OnsetDetector  # noqa: E402
+from services.cnn_preparer import CNNPreparer  # noqa: E402
+from services.drum_classifier import DrumClassifier  # noqa: E402
+
+SAMPLE_RATE = 44100
+
+
+def timed(fn, repeats: int) -> tuple[dict, object]:
+    """
+    One warm-up call, then `repeats` timed calls. Returns (timings, last result).
+    """
+    result = fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return {"median_s": round(float(np.median(times)), 5), "min_s": round(min(times), 5)}, result
+
+
+def match_onsets(detected: list[float], truth: list[float], tolerance: float) -> dict:
+    """
+    Greedy one-to-one matching of detected to true onsets within tolerance seconds.
+    """
+    detected = np.sort(np.asarray(detected, dtype=np.float64))
+    used = np.zeros(len(detected), dtype=bool)
+    errors = []
+    for t in truth:
+        if detected.size == 0:
+            break
+        i = int(np.searchsorted(detected, t))
+        best = None
+        for j in (i - 1, i, i + 1):
+            if 0 <= j < len(detected) and not used[j] and abs(detected[j] - t) <= tolerance:
+                if best is None or abs(detected[j] - t) < abs(detected[best] - t):
+                    best = j
+        if best is not None:
+            used[best] = True
+            errors.append(abs(detected[best] - t))
+    hits = len(errors)
+    precision = hits / len(detected) if len(detected) else 0.0
+    recall = hits / len(truth) if truth else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"f1": round(f1, 4), "precision": round(precision, 4), "recall": round(recall, 4),
+            "mean_abs_error_ms": round(1000 * float(np.mean(errors)), 3) if errors else None}
+
+
+def label_agreement(labels: np.ndarray, native_labels: Optional[np.ndarray]) -> Optional[float]:
+    """
+    Share of windows labelled as at the native rate; 1.0 for the native rate
+    itself, None when there is nothing to compare one to one (the label
+    counts differ, or there are no labels).
+    """
+    if native_labels is None:
+        return 1.0
+    if len(labels) != len(native_labels) or not len(labels):
+        return None
+    return round(float(np.mean(labels == native_labels)), 4)
+
+
+def bench_rate(native: DecodedAudio, sr: int, truth: list[dict], native_labels: np.ndarray,
+               repeats: int, tolerance: float) -> tuple[dict, np.ndarray]:
+    detector = OnsetDetector()
+    preparer = CNNPreparer()
+    classifier = DrumClassifier()
+    true_times = [h["time"] for h in truth]
+    stages = {}
+
+    stages["resample"], audio = timed(lambda: native.resampled(sr), repeats)
+    stages["onset_envelope"], env = timed(lambda: detector.onset_envelope(audio.y, audio.sr), repeats)
+    stages["onsets"], onsets = timed(lambda: detector.detect_onsets(audio.y, audio.sr, env), repeats)
+    stages["mel_spectrogram"], mel = timed(lambda: preparer.mel_spectrogram(audio.y, audio.sr), repeats)
+    stages["mel_prep"], windows = timed(
+        lambda: np.concatenate(list(preparer.iter_windows(audio.y, audio.sr, true_times, mel=mel))), repeats)
+    labels = classifier.classify_batch(windows)
+    total = sum(stage["median_s"] for name, stage in stages.items() if name != "resample")
+
+    hop, n_fft = stft_sizes(detector.hop, detector.n_fft, sr)
+    result = {
+        "sr": sr,
+        "onset_hop": hop,
+        "onset_n_fft": n_fft,
+        "stages": stages,
+        "analysis_median_s": round(total, 5),
+        "bytes": {"audio": int(audio.y.nbytes), "mel": int(mel.nbytes)},
+        "onsets": {"detected": len(onsets), **match_onsets(onsets, true_times, tolerance)},
+        "label_agreement": label_agreement(labels, native_labels),
+    }
+    return result, labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--density", type=float, default=4.0, help="hits per second")
+    parser.add_argument("--rates", type=int, nargs="+", default=[44100, 32000, 24000, 22050, 16000])
+    parser.add_argument("--tolerance", type=float, default=0.025, help="onset match window in seconds")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    y, truth = synthetic.drum_stem(args.seconds, SAMPLE_RATE, args.density, args.seed)
+    native = DecodedAudio(y, SAMPLE_RATE)
+
+    # Native rate first: its labels are the reference for the others
+    rates = [SAMPLE_RATE] + [sr for sr in args.rates if sr != SAMPLE_RATE]
+    cases, native_labels = [], None
+    for sr in rates:
+        case, labels = bench_rate(native, sr, truth, native_labels, args.repeats, args.tolerance)
+        if native_labels is None:
+            native_labels = labels
+        cases.append(case)
+        agreement = case["label_agreement"]
+        print(f"{sr:>6} Hz  analysis {case['analysis_median_s']:.3f}s  onset F1 {case['onsets']['f1']:.3f}"
+              f"  labels {'n/a' if agreement is None else f'{agreement:.3f}'}", file=sys.stderr)
+
+    base = cases[0]["analysis_median_s"]
+    for case in cases:
+        case["speedup"] = round(base / case["analysis_median_s"], 3) if case["analysis_median_s"] else None
+
+    report = {
+        "benchmark": "analysis_sr",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "numpy": np.__version__},
+        "params": {"seconds": args.seconds, "hits_per_sec": args.density, "true_hits": len(truth),
+                   "tolerance_s": args.tolerance, "repeats": args.repeats, "seed": args.seed},
+        "cases": cases,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text)
+        print(f"Benchmark report written to {args.out}", file=sys.stderr)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Throughput / latency of the drum classifier backends.
+
+    python benchmarks/bench_classifier.py --windows 2000 --model model.onnx --model model.pt
+
+Always measures the heuristic backend; every --model adds a CNN backend.
+Prints a JSON report (windows/s and per-micro-batch latency percentiles).
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+from services.drum_classifier import HeuristicBackend, load_backend, CNNBackend  # noqa: E402
+
+
+def bench_backend(backend, batch: np.ndarray, micro_batch: int, repeats: int) -> dict:
+    # Warm-up pass (lazy allocations, kernel selection)
+    backend.predict(batch[:micro_batch])
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(batch), micro_batch):
+            t0 = time.perf_counter()
+            backend.predict(batch[i:i + micro_batch])
+            latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "backend": backend.name,
+        "windows": int(len(batch) * repeats),
+        "seconds": round(total, 4),
+        "windows_per_sec": round(len(batch) * repeats / total, 1),
+        "micro_batch": micro_batch,
+        "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies_ms, 95)), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=int, default=1000, help="windows per run")
+    parser.add_argument("--shape", type=int, nargs=2, default=(256, 256), help="window height width")
+    parser.add_argument("--micro-batch", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--model", action="append", default=[], help="ONNX / TorchScript model to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    batch = rng.random((args.windows, *args.shape, 1), dtype=np.float32)
+
+    backends = [HeuristicBackend()]
+    for model_path in args.model:
+        backend = load_backend(model_path, micro_batch=args.micro_batch, num_threads=args.threads)
+        if not isinstance(backend, CNNBackend):
+            print(f"Skipping {model_path}: could not be loaded", file=sys.stderr)
+            continue
+        backends.append(backend)
+
+    results = [bench_backend(b, batch, args.micro_batch, args.repeats) for b in backends]
+    print(json.dumps({"benchmark": "classifier", "results": results}, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
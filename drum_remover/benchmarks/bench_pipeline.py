@@ -0,0 +1,200 @@
+"""
+End-to-end benchmark of the drum pipeline on synthetic audio.
+
+    python benchmarks/bench_pipeline.py --seconds 30 120 --density 4 --out baseline.json
+    python benchmarks/bench_pipeline.py --seconds 30 --skip separate_drums
+
+For every (length, density) case a seeded drum stem / mix is generated
+offline and each stage is timed on it:
+
+    detect_onsets, prepare_for_cnn, classify_batch, midi_write,
+    run_full_pipeline, separate_preview, separate_drums
+
+separate_drums runs the real AudioProcessor / SeparationEngine code path
+with a tiny untrained model in place of the pretrained Demucs weights, so
+it measures decoding, chunking, overlap-add, caching and encoding rather
+than network inference (decoding still needs ffmpeg, like the app).
+separate_preview is the preview tier (first --preview-seconds, no shifts):
+the time until a job has something to play.
+
+Writes a JSON report (median / min seconds per stage, plus the environment)
+so two runs can be compared for regressions.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+import torch  # noqa: E402
+
+import synthetic  # noqa: E402
+from services.audio_buffer import DecodedAudio  # noqa: E402
+from services.onset_detector import OnsetDetector  # noqa: E402
+from services.cnn_preparer import CNNPreparer  # noqa: E402
+from services.drum_classifier import DrumClassifier  # noqa: E402
+from services.midi_writer import MIDIWriter  # noqa: E402
+from services.process_pipeline import run_full_pipeline  # noqa: E402
+from services.separation_engine import SeparationEngine  # noqa: E402
+from services.audio_processor import AudioProcessor  # noqa: E402
+
+STAGES = ("detect_onsets", "prepare_for_cnn", "classify_batch", "midi_write",
+          "run_full_pipeline", "separate_preview", "separate_drums")
+SAMPLE_RATE = 44100
+
+
+class TinySeparator(torch.nn.Module):
+    """
+    Stand-in for a Demucs model: same interface (sources, samplerate,
+    audio_channels, segment; (B, C, T) -> (B, S, C, T)), one small convolution.
+    """
+
+    def __init__(self, samplerate: int = SAMPLE_RATE, channels: int = 2, segment: float = 7.8):
+        super().__init__()
+        self.sources = ["drums", "bass", "other", "vocals"]
+        self.samplerate = samplerate
+        self.audio_channels = channels
+        self.segment = segment
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv1d(channels, channels * len(self.sources), kernel_size=9, padding=4)
+
+    def forward(self, mix: torch.Tensor) -> torch.Tensor:
+        b, c, t = mix.shape
+        return self.conv(mix).view(b, len(self.sources), c, t)
+
+
+def timed(fn, repeats: int) -> tuple[dict, object]:
+    """
+    One warm-up call, then `repeats` timed calls. Returns (timings, last result).
+    """
+    result = fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return {"median_s": round(float(np.median(times)), 5), "min_s": round(min(times), 5),
+            "repeats": repeats}, result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_case(seconds: float, density: float, seed: int, repeats: int, skip: set,
+               workdir: Path, preview_seconds: float = 30.0) -> dict:
+    stem_path = workdir / f"drums_{seconds:g}s_{density:g}.wav"
+    truth = synthetic.write_drum_stem(stem_path, seconds, SAMPLE_RATE, density, seed)
+    audio = DecodedAudio.from_file(stem_path, cache=False)
+
+    detector = OnsetDetector()
+    preparer = CNNPreparer()
+    classifier = DrumClassifier()
+    stages = {}
+
+    onsets = [h["time"] for h in truth]
+    if "detect_onsets" not in skip:
+        stages["detect_onsets"], onsets = timed(lambda: detector.detect_onsets(audio.y, audio.sr), repeats)
+        stages["detect_onsets"]["items"] = len(onsets)
+
+    windows = None
+    if "prepare_for_cnn" not in skip or "classify_batch" not in skip:
+        stages["prepare_for_cnn"], windows = timed(lambda: preparer.prepare_for_cnn(audio, onsets), repeats)
+        stages["prepare_for_cnn"]["items"] = len(windows)
+        if "prepare_for_cnn" in skip:
+            del stages["prepare_for_cnn"]
+
+    if "classify_batch" not in skip and len(windows):
+        stages["classify_batch"], _ = timed(lambda: classifier.classify_batch(windows), repeats)
+        stages["classify_batch"]["items"] = len(windows)
+
+    if "midi_write" not in skip:
+        midi_path = workdir / "bench.mid"
+        stages["midi_write"], _ = timed(lambda: MIDIWriter(bpm=120).write(truth, midi_path), repeats)
+        stages["midi_write"]["items"] = len(truth)
+
+    if "run_full_pipeline" not in skip:
+        # Every artefact forced, so each run does the full work
+        stages["run_full_pipeline"], summary = timed(
+            lambda: run_full_pipeline(stem_path, force_rerun_onsets=True, force_rerun_cnnprep=True),
+            repeats)
+        stages["run_full_pipeline"]["items"] = summary["num_onsets"]
+
+    if "separate_preview" not in skip or "separate_drums" not in skip:
+        mix_path = workdir / f"mix_{seconds:g}s_{density:g}.wav"
+        synthetic.write_mix(mix_path, seconds, SAMPLE_RATE, density, seed)
+        engine = SeparationEngine(model_name="bench-tiny", model=TinySeparator())
+        run = 0
+
+        def processor():
+            # Fresh output dir each call: the result cache would otherwise turn
+            # every repeat into a hit
+            nonlocal run
+            run += 1
+            return AudioProcessor(output_dir=workdir / f"separated_{run}", engine=engine,
+                                  preview_engine=engine)
+
+        if "separate_preview" not in skip:
+            stages["separate_preview"], _ = timed(
+                lambda: processor().separate_preview(mix_path, preview_seconds), repeats)
+            stages["separate_preview"]["items"] = preview_seconds
+        if "separate_drums" not in skip:
+            stages["separate_drums"], _ = timed(lambda: processor().separate_drums(mix_path), repeats)
+
+    return {"seconds": seconds, "hits_per_sec": density, "true_hits": len(truth),
+            "stages": stages}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[30.0], help="stem lengths to test")
+    parser.add_argument("--density", type=float, nargs="+", default=[4.0], help="hits per second")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=STAGES, help="stages to leave out")
+    parser.add_argument("--preview-seconds", type=float, default=30.0, help="length of the preview tier")
+    parser.add_argument("--out", type=Path, default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="drum-bench-") as tmp:
+        cases = [bench_case(s, d, args.seed, args.repeats, set(args.skip), Path(tmp), args.preview_seconds)
+                 for s in args.seconds for d in args.density]
+
+    report = {
+        "benchmark": "pipeline",
+        "revision": git_revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "params": {"repeats": args.repeats, "seed": args.seed, "sample_rate": SAMPLE_RATE,
+                   "preview_seconds": args.preview_seconds},
+        "cases": cases,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text)
+        print(f"Benchmark report written to {args.out}", file=sys.stderr)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Startup guard: time `import main` in a fresh interpreter and check that no
+heavy library came with it.
+
+    python benchmarks/bench_startup.py --budget 2.0 --repeat 3
+
+torch, demucs, librosa, numba, mido and onnxruntime must load on first use
+(worker threads or the pre-warm thread), never when the app is imported.
+Prints a JSON report and exits 1 if one of them was imported or the median
+import time is over --budget seconds.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+HEAVY_MODULES = ("torch", "demucs", "librosa", "numba", "mido", "onnxruntime")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def probe() -> dict:
+    # Memory job store: importing the app must not need (or create) the shared db
+    env = dict(os.environ, JOB_STORE="memory", SEPARATION_WORKERS="0")
+    out = subprocess.run([sys.executable, "-c", PROBE % (HEAVY_MODULES,)], cwd=APP_DIR, env=env,
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise SystemExit(f"importing main failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=2.0, help="max median import time in seconds")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    runs = [probe() for _ in range(args.repeat)]
+    loaded = sorted({m for run in runs for m in run["loaded"]})
+    median_s = statistics.median(run["seconds"] for run in runs)
+    print(json.dumps({"import_main_s": [round(r["seconds"], 4) for r in runs], "median_s": round(median_s, 4),
+                      "budget_s": args.budget, "heavy_modules_loaded": loaded}, indent=2))
+
+    if loaded:
+        print(f"FAIL: importing main pulled in {', '.join(loaded)}", file=sys.stderr)
+        return 1
+    if median_s > args.budget:
+        print(f"FAIL: import took {median_s:.2f}s (budget {args.budget:.2f}s)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Compare two bench_pipeline.py reports.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 1.10
+
+Prints the median time ratio (candidate / baseline) for every stage of every
+case both reports share, and exits 1 if any ratio exceeds --threshold.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def case_key(case: dict) -> tuple:
+    return case["seconds"], case["hits_per_sec"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.10, help="max allowed slowdown ratio")
+    args = parser.parse_args(argv)
+
+    baseline = {case_key(c): c for c in json.loads(args.baseline.read_text())["cases"]}
+    candidate = {case_key(c): c for c in json.loads(args.candidate.read_text())["cases"]}
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        base_stages, cand_stages = baseline[key]["stages"], candidate[key]["stages"]
+        for stage in base_stages.keys() & cand_stages.keys():
+            before = base_stages[stage]["median_s"]
+            after = cand_stages[stage]["median_s"]
+            ratio = after / before if before else float("inf")
+            flag = "REGRESSION" if ratio > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{key[0]:>7g}s {key[1]:>4g}/s  {stage:<18} {before:>9.4f}s -> {after:>9.4f}s  x{ratio:.2f} {flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
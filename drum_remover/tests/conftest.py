@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+# Nothing under test may need (or create) the shared job db or start workers
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("SEPARATION_WORKERS", "0")
@@ -0,0 +1,46 @@
+import json
+
+from services.artifact_manifest import ArtifactManifest, MANIFEST_VERSION, file_sha256, fingerprint
+
+
+def test_fingerprint_is_order_independent_for_dicts():
+    assert fingerprint("abc", {"hop": 256, "sr": 24000}) == fingerprint("abc", {"sr": 24000, "hop": 256})
+    assert fingerprint("abc", {"hop": 256}) != fingerprint("abc", {"hop": 512})
+
+
+def test_record_and_reload(tmp_path):
+    drums = tmp_path / "song_drums.wav"
+    drums.write_bytes(b"drums")
+    onsets = tmp_path / "song_drums.onsets.json"
+    onsets.write_text("[]")
+
+    manifest = ArtifactManifest(drums)
+    fp = fingerprint(manifest.source_hash(), {"hop": 256})
+    assert not manifest.is_fresh("onsets", fp, onsets)
+    manifest.record("onsets", fp, onsets, "out-hash", {"hop": 256})
+
+    reloaded = ArtifactManifest(drums)
+    assert reloaded.is_fresh("onsets", fp, onsets)
+    assert not reloaded.is_fresh("onsets", fingerprint("other"), onsets)
+    assert reloaded.output_hash("onsets") == "out-hash"
+    assert reloaded.entry("onsets")["params"] == {"hop": 256}
+
+    onsets.unlink()
+    assert not reloaded.is_fresh("onsets", fp, onsets)
+
+
+def test_source_hash_follows_the_stem(tmp_path):
+    drums = tmp_path / "song_drums.wav"
+    drums.write_bytes(b"drums")
+    manifest = ArtifactManifest(drums)
+    assert manifest.source_hash() == file_sha256(drums)
+    drums.write_bytes(b"other drums")
+    assert manifest.source_hash() == file_sha256(drums)
+
+
+def test_other_versions_are_ignored(tmp_path):
+    drums = tmp_path / "song_drums.wav"
+    drums.write_bytes(b"drums")
+    drums.with_suffix(".manifest.json").write_text(json.dumps(
+        {"version": MANIFEST_VERSION + 1, "source": {}, "stages": {"onsets": {"fingerprint": "x"}}}))
+    assert ArtifactManifest(drums).entry("onsets") is None
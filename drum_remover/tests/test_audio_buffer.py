@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from services.audio_buffer import DecodedAudio, stft_sizes
+
+
+def test_cache_paths_carry_the_rate(tmp_path):
+    path = tmp_path / "song_drums.wav"
+    assert DecodedAudio.cache_paths(path)[0].name == "song_drums.pcm.native.npy"
+    assert DecodedAudio.cache_paths(path, 24000) == (tmp_path / "song_drums.pcm.24000.npy",
+                                                     tmp_path / "song_drums.pcm.24000.json")
+
+
+def test_from_file_caches_each_rate_separately(tmp_path):
+    pytest.importorskip("librosa")
+    sf = pytest.importorskip("soundfile")
+    path = tmp_path / "song_drums.wav"
+    sf.write(str(path), np.random.default_rng(0).standard_normal(44100).astype(np.float32) * 0.1, 44100)
+
+    native = DecodedAudio.from_file(path)
+    low = DecodedAudio.from_file(path, sr=22050)
+    assert (native.sr, low.sr) == (44100, 22050)
+    # Both caches coexist, a mapped buffer is never rewritten in place
+    again = DecodedAudio.from_file(path)
+    assert isinstance(again.y, np.memmap)
+    np.testing.assert_array_equal(again.y, native.y)
+    assert len(DecodedAudio.from_file(path, sr=22050).y) == len(low.y)
+    assert not list(tmp_path.glob(".*.part"))
+
+
+def test_stft_sizes_keep_durations():
+    assert stft_sizes(256, 2048, 44100) == (256, 2048)
+    hop, n_fft = stft_sizes(256, 2048, 22050)
+    assert (hop, n_fft) == (128, 1024)
+    hop, n_fft = stft_sizes(256, 2048, 24000)
+    assert hop == 139                       # 5.8 ms either way
+    assert n_fft == 1024                    # nearest power of two to 1114
+    assert stft_sizes(512, 2048, 16000, ref_sr=16000) == (512, 2048)
+    assert stft_sizes(1, 1, 8000) == (1, 1)
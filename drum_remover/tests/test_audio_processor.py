@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("demucs")
+sf = pytest.importorskip("soundfile")
+
+from services import audio_processor  # noqa: E402
+from services.audio_processor import AudioProcessor  # noqa: E402
+from services.result_cache import ResultCache  # noqa: E402
+from services.separation_engine import SeparationEngine  # noqa: E402
+
+SR = 1000
+
+
+class StubModel(torch.nn.Module):
+    """Demucs stand-in: pointwise, a different gain per source."""
+    samplerate = SR
+    audio_channels = 2
+    sources = ["drums", "bass", "other", "vocals"]
+    segment = 0.5
+
+    def forward(self, mix):
+        gains = torch.tensor([0.5, 0.2, 0.2, 0.1])[None, :, None, None]
+        return torch.tanh(mix)[:, None] * gains
+
+
+def read_wav(input_file, samplerate, channels, duration=None):
+    wav, _ = sf.read(str(input_file), dtype="float32", always_2d=True)
+    return np.ascontiguousarray(wav.T)
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    # Decoding runs in-process (no ffmpeg here, and threads keep the patch visible)
+    monkeypatch.setattr(audio_processor, "decode_audio", read_wav)
+    engine = SeparationEngine(model=StubModel(), shifts=0)
+    processor = AudioProcessor(output_dir=tmp_path / "out", engine=engine,
+                               cache=ResultCache(tmp_path / "out"))
+    monkeypatch.setattr(processor, "_bulk_pool", lambda workers: ThreadPoolExecutor(workers))
+    calls = []
+    separate_batch = engine.separate_batch
+    monkeypatch.setattr(engine, "separate_batch",
+                        lambda wavs, **kw: calls.append(len(wavs)) or separate_batch(wavs, **kw))
+    processor.batch_calls = calls
+    return processor
+
+
+def write_inputs(tmp_path, seconds):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, s in enumerate(seconds):
+        path = tmp_path / f"song{i}.wav"
+        sf.write(str(path), rng.uniform(-0.5, 0.5, (int(s * SR), 2)).astype(np.float32), SR)
+        paths.append(path)
+    return paths
+
+
+def test_separate_many_groups_files_and_keeps_order(processor, tmp_path):
+    inputs = write_inputs(tmp_path, [1.0, 0.8, 1.5, 0.6])
+
+    results = processor.separate_many(inputs, workers=2, group_seconds=2.0)
+
+    # Files share separate_batch calls up to the group budget
+    assert processor.batch_calls == [2, 1, 1]
+    assert len(results) == len(inputs)
+    for input_file, paths in zip(inputs, results):
+        assert paths["drums"].name == f"{input_file.stem}_drums.wav"
+        mix = torch.from_numpy(read_wav(input_file, SR, 2))
+        expected = processor.engine.separate(mix)
+        drums, sr = sf.read(str(paths["drums"]), dtype="float32", always_2d=True)
+        assert sr == SR
+        np.testing.assert_allclose(drums.T, expected["drums"].numpy(), atol=2 / 32768)
+
+
+def test_separate_many_skips_cached_and_repeated_audio(processor, tmp_path):
+    inputs = write_inputs(tmp_path, [0.5, 0.7])
+    copy = tmp_path / "copy.wav"
+    copy.write_bytes(inputs[0].read_bytes())
+
+    first = processor.separate_many([inputs[0], copy], workers=1)
+    assert processor.batch_calls == [1]               # same audio in one group, separated once
+    assert first[0] == first[1]
+
+    processor.batch_calls.clear()
+    again = processor.separate_many([inputs[1], copy, inputs[0]], workers=1)
+    assert processor.batch_calls == [1]               # only the new file reaches the model
+    assert again[1] == again[2] == first[0]
+    assert again[0]["drums"].name == "song1_drums.wav"
+
+
+def test_separate_many_rejects_missing_input(processor, tmp_path):
+    inputs = write_inputs(tmp_path, [0.5])
+    with pytest.raises(FileNotFoundError, match="missing.wav"):
+        processor.separate_many([inputs[0], tmp_path / "missing.wav"])
+    assert processor.batch_calls == []
+    assert processor.separate_many([]) == []
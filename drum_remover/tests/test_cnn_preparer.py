@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip("librosa")
+ndimage = pytest.importorskip("scipy.ndimage")
+
+from services.cnn_preparer import CNNPreparer, _resize_matrix  # noqa: E402
+
+SR = 22050
+
+
+def zoom(x: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    # What skimage resize(order=1, mode="constant") runs for an upscale
+    return ndimage.zoom(x, (shape[0] / x.shape[0], shape[1] / x.shape[1]), order=1,
+                        mode="grid-constant", cval=0.0, grid_mode=True)
+
+
+def per_window_loop(cnn: CNNPreparer, y: np.ndarray, sr: int, onset_times: list[float]) -> np.ndarray:
+    """
+    The pre-vectorisation loop: one mel spectrogram per extracted window.
+    Windows running past the end are padded with silence (the loop used to
+    stretch the shorter spectrogram instead).
+    """
+    hop, n_fft = cnn._stft(sr)
+    padded = np.concatenate([y, np.zeros(int(cnn.window_size_sec * sr), dtype=y.dtype)])
+    out = []
+    for onset in onset_times:
+        if max(int((onset - cnn.pre_offset_sec) * sr), 0) >= len(y):
+            continue
+        window = cnn._extract_window(padded, sr, onset)
+        mel = librosa.feature.melspectrogram(y=window, sr=sr, n_fft=n_fft, hop_length=hop,
+                                             n_mels=cnn.n_mels, fmax=min(cnn.fmax, sr / 2))
+        mel_db = zoom(librosa.power_to_db(mel, ref=np.max), cnn.target_shape)
+        out.append((mel_db - mel_db.min()) / (mel_db.max() - mel_db.min() + 1e-6))
+    return np.stack(out)[..., np.newaxis]
+
+
+@pytest.mark.parametrize("shape_in,shape_out", [((64, 28), (256, 256)), ((10, 7), (4, 15)), ((5, 5), (5, 5))])
+def test_resize_matrix_matches_linear_zoom(shape_in, shape_out):
+    x = np.random.default_rng(0).standard_normal(shape_in)
+    resized = _resize_matrix(shape_in[0], shape_out[0]) @ x @ _resize_matrix(shape_in[1], shape_out[1]).T
+    np.testing.assert_allclose(resized, zoom(x, shape_out), atol=1e-12)
+
+
+def test_iter_windows_matches_per_window_loop():
+    cnn = CNNPreparer()
+    hop, _ = cnn._stft(SR)
+    rng = np.random.default_rng(0)
+    # Onsets whose window starts fall on a frame: the first clamps to the start
+    # of the signal, the last runs past its end, the one after that is skipped
+    frames = [0, 50, 100, 150]
+    onsets = [0.01] + [cnn.pre_offset_sec + (f + 0.001) * hop / SR for f in frames[1:]]
+    y = np.zeros(int((onsets[-1] + 0.15) * SR), dtype=np.float32)
+    burst = int(0.08 * SR)
+    for onset in onsets:
+        start = int(onset * SR)
+        y[start:start + burst] = rng.standard_normal(burst) * np.exp(-np.linspace(0, 6, burst)) * 0.5
+    onsets.append(len(y) / SR + 0.1)
+
+    chunks = list(cnn.iter_windows(y, SR, onsets, chunk_size=3))
+    windows = np.concatenate(chunks)
+
+    assert [len(c) for c in chunks] == [3, 1]
+    assert windows.shape == (4, 256, 256, 1) and windows.dtype == np.float32
+    np.testing.assert_allclose(windows, per_window_loop(cnn, y, SR, onsets), atol=1e-3)
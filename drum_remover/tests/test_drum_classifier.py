@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from services.drum_classifier import (BANDS, CLASS_LABELS, ClassifierBackend, CNNBackend, HeuristicBackend,
+                                      load_backend)
+
+
+def test_backend_interfaces_are_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        ClassifierBackend()
+    with pytest.raises(TypeError):
+        CNNBackend(tmp_path / "model.onnx")
+
+
+def test_cnn_backend_micro_batches_and_layout(tmp_path):
+    class Fixed(CNNBackend):
+        name = "fixed"
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.shapes = []
+
+        def _forward(self, x):
+            self.shapes.append(x.shape)
+            scores = np.zeros((len(x), len(CLASS_LABELS)), dtype=np.float32)
+            scores[:, 2] = 1.0
+            return scores
+
+    backend = Fixed(tmp_path / "model.pt", micro_batch=4, num_threads=1, layout="NCHW")
+    labels = backend.predict(np.zeros((10, 8, 6, 1), dtype=np.float32))
+    assert labels.tolist() == [2] * 10
+    assert backend.shapes == [(4, 1, 8, 6), (4, 1, 8, 6), (2, 1, 8, 6)]
+
+
+def test_heuristic_labels_are_class_indices():
+    labels = HeuristicBackend().predict(np.random.default_rng(0).random((16, 64, 12, 1), dtype=np.float32))
+    assert labels.dtype == np.uint8
+    assert labels.max() < len(CLASS_LABELS)
+
+
+def test_load_backend_falls_back_to_heuristic(tmp_path):
+    assert isinstance(load_backend(None), HeuristicBackend)
+    assert isinstance(load_backend(str(tmp_path / "model.bin")), HeuristicBackend)
+    assert isinstance(load_backend(str(tmp_path / "missing.onnx")), HeuristicBackend)
+
+
+def scalar_rules(low, low_mid, mid, high_mid, high) -> str:
+    # The per-window if/elif chain _apply_rules replaced
+    if low > max(low_mid * 1.2, mid * 1.4, high * 1.5):
+        return "kick"
+    if high > max(high_mid * 1.1, mid * 1.5, low * 2.0):
+        return "hihat"
+    if (high + high_mid) > mid * 1.6 and (high + high_mid) > low_mid * 1.2:
+        return "crash"
+    if (mid + high_mid) > low_mid * 1.2 and mid > low * 0.9:
+        return "snare"
+    if low_mid > mid * 1.1 and low_mid > low * 1.0:
+        return "tom1"
+    if low_mid > low and mid > low_mid * 0.8:
+        return "tom2"
+    if low > low_mid * 1.1 and low_mid > mid * 0.8:
+        return "tom3"
+    if mid > low or high_mid > low:
+        return "snare"
+    if high > 0.01:
+        return "hihat"
+    return "kick"
+
+
+RULE_CASES = [
+    # (low, low_mid, mid, high_mid, high), label
+    ((1.21, 1.0, 0.5, 0.1, 0.1), "kick"),
+    ((1.2, 1.0, 0.5, 0.1, 0.1), "tom3"),      # kick needs strictly more than 1.2 x low_mid
+    ((2.0, 0.1, 0.1, 0.5, 1.0), "kick"),      # crash matches too, kick comes first
+    ((0.1, 0.1, 0.5, 0.5, 1.0), "hihat"),
+    ((0.1, 0.1, 0.5, 1.0, 1.0), "crash"),     # hihat fails on high_mid, crash beats snare
+    ((0.5, 0.5, 1.0, 0.3, 0.2), "snare"),
+    ((0.5, 1.0, 0.5, 0.0, 0.0), "tom1"),
+    ((0.5, 1.0, 1.0, 0.0, 0.0), "tom2"),
+    ((1.0, 1.0, 1.05, 0.0, 0.0), "snare"),    # only the fallback matches
+    ((1.0, 1.0, 1.0, 0.0, 0.02), "hihat"),    # fallback on any high energy
+    ((1.0, 1.0, 1.0, 0.0, 0.01), "kick"),     # high must exceed 0.01
+    ((0.0, 0.0, 0.0, 0.0, 0.0), "kick"),      # nothing matches: default
+]
+
+
+@pytest.mark.parametrize("energies,label", RULE_CASES)
+def test_heuristic_rules_match_scalar_chain(energies, label):
+    assert scalar_rules(*energies) == label
+    ids = HeuristicBackend()._apply_rules(np.array([energies]))
+    assert CLASS_LABELS[ids[0]] == label
+
+
+def test_heuristic_batch_matches_scalar_chain_per_window():
+    rng = np.random.default_rng(0)
+    backend = HeuristicBackend()
+    # Mel windows with the energy piled into different bands
+    batch = rng.random((500, 64, 24)) * rng.random((500, 64, 1)) ** 4
+    energies = backend._band_energies(batch)
+    for window, row in zip(batch[:20], energies):
+        bands = backend._energy_bands(window)
+        np.testing.assert_allclose([bands[b] for b in BANDS], row)
+        np.testing.assert_allclose(row[0], window[:int(64 * 0.12)].mean())
+
+    expected = [scalar_rules(*row) for row in energies]
+    assert len(set(expected)) >= 5
+    assert [CLASS_LABELS[i] for i in backend.predict(batch[..., None])] == expected
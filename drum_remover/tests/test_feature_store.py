@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from services.feature_store import MelWindowStore
+
+
+def windows(n: int, shape=(16, 12)) -> np.ndarray:
+    w = np.random.default_rng(0).random((n, *shape, 1)).astype(np.float32)
+    w[0] = 0.0
+    w[-1] = 1.0   # both ends of the 0-1 range
+    return w
+
+
+def chunked(w: np.ndarray, size: int):
+    for i in range(0, len(w), size):
+        yield w[i:i + size]
+
+
+@pytest.mark.parametrize("dtype,atol", [("uint8", 0.5 / 255), ("float16", 5e-4), ("float32", 0.0)])
+def test_round_trip_within_quantisation(tmp_path, dtype, atol):
+    w = windows(23)
+    path = MelWindowStore(dtype).write(tmp_path / "song.mel_windows.npy", chunked(w, 5), len(w), (16, 12))
+
+    assert MelWindowStore.open(path).dtype == np.dtype(dtype)
+    assert MelWindowStore.count(path) == 23
+    # Read batches straddle the write chunks (5) and end on a short batch
+    batches = list(MelWindowStore.iter_batches(path, batch_size=7))
+    assert [len(b) for b in batches] == [7, 7, 7, 2]
+    assert all(b.dtype == np.float32 for b in batches)
+    np.testing.assert_allclose(np.concatenate(batches), w, atol=atol)
+
+
+def test_uint8_clips_out_of_range(tmp_path):
+    w = np.array([-0.5, 0.5, 1.5], dtype=np.float32).reshape(3, 1, 1, 1)
+    path = MelWindowStore("uint8").write(tmp_path / "w.npy", [w], 3, (1, 1))
+    np.testing.assert_allclose(next(MelWindowStore.iter_batches(path)).ravel(), [0.0, 128 / 255, 1.0])
+
+
+@pytest.mark.parametrize("count", [22, 24])
+def test_wrong_window_count_leaves_no_file(tmp_path, count):
+    path = tmp_path / "w.npy"
+    with pytest.raises(ValueError, match="Expected 23 windows"):
+        MelWindowStore().write(path, chunked(windows(count), 5), 23, (16, 12))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_write_keeps_previous_file(tmp_path):
+    path = MelWindowStore().write(tmp_path / "w.npy", [windows(3)], 3, (16, 12))
+
+    def failing():
+        yield windows(2)
+        raise RuntimeError("mel stage failed")
+
+    with pytest.raises(RuntimeError):
+        MelWindowStore().write(path, failing(), 3, (16, 12))
+    assert MelWindowStore.count(path) == 3
+    assert [p.name for p in tmp_path.iterdir()] == ["w.npy"]
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:-7],             # truncated windows
+    lambda data: data[:40],             # truncated header
+    lambda data: b"X" + data[1:],       # bad magic
+    lambda data: b"",
+])
+def test_damaged_file_is_rejected(tmp_path, damage):
+    path = MelWindowStore().write(tmp_path / "w.npy", [windows(4)], 4, (16, 12))
+    path.write_bytes(damage(path.read_bytes()))
+    with pytest.raises(ValueError, match="Unreadable mel window store"):
+        list(MelWindowStore.iter_batches(path))
+
+
+def test_foreign_array_is_rejected(tmp_path):
+    np.save(tmp_path / "w.npy", np.zeros((4, 16, 12, 1), dtype=np.float64))
+    np.save(tmp_path / "flat.npy", np.zeros((4, 16), dtype=np.uint8))
+    for name in ("w.npy", "flat.npy"):
+        with pytest.raises(ValueError, match="Not a mel window store"):
+            MelWindowStore.count(tmp_path / name)
@@ -0,0 +1,69 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from services.hit_store import HitIndex, HitStore, HIT_DTYPE, hits_index_path
+from services.drum_classifier import LABEL_INDEX
+
+
+def make_index(times, labels) -> HitIndex:
+    records = np.empty(len(times), dtype=HIT_DTYPE)
+    records["time"], records["label"] = times, [LABEL_INDEX[l] for l in labels]
+    return HitIndex(records)
+
+
+@pytest.fixture
+def index():
+    return make_index([0.0, 0.5, 1.0, 1.0, 1.5, 2.0], ["kick", "hihat", "snare", "kick", "hihat", "kick"])
+
+
+def test_query_time_window_is_end_exclusive(index):
+    page, total = index.query(0.5, 1.5)
+    assert page["time"].tolist() == [0.5, 1.0, 1.0]
+    assert total == 3
+    assert index.query(start=1.0)[1] == 4
+    assert index.query(end=1.0)[1] == 2
+    assert index.query(2.0, 1.0)[1] == 0
+
+
+def test_query_labels_and_pagination(index):
+    page, total = index.query(labels=["kick"], offset=1, limit=1)
+    assert (page["time"].tolist(), total) == ([1.0], 3)
+    page, total = index.query(labels=["kick", "hihat"], offset=4)
+    assert (page["time"].tolist(), total) == ([2.0], 5)
+    with pytest.raises(ValueError):
+        index.query(labels=["cowbell"])
+
+
+def test_write_sorts_and_reopens(tmp_path):
+    path = HitStore.write(tmp_path / "song_drums.hits.npy", [1.0, 0.25, 0.5], [0, 1, 2])
+    store = HitStore()
+    index, st = store.open(path)
+    assert index.times.tolist() == [0.25, 0.5, 1.0]
+    assert index.records["label"].tolist() == [1, 2, 0]
+    assert store.open(path)[0] is index
+    assert not list(tmp_path.glob(".*.part"))
+
+
+def test_ensure_index_migrates_legacy_json_once(tmp_path, monkeypatch):
+    drums = tmp_path / "song_drums.wav"
+    assert HitStore().ensure_index(drums) is None
+    drums.with_suffix(".hits.json").write_text(json.dumps(
+        [{"time": 0.5, "label": "snare"}, {"time": 0.1, "label": "kick"}]))
+
+    calls = []
+    migrate = HitStore.migrate_json
+    monkeypatch.setattr(HitStore, "migrate_json",
+                        classmethod(lambda cls, *a: (calls.append(a), migrate(*a))[1]))
+    store = HitStore()
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(store.ensure_index(drums))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert paths == [hits_index_path(drums)] * 8
+    assert len(calls) == 1
+    assert store.open(paths[0])[0].times.tolist() == [0.1, 0.5]
@@ -0,0 +1,101 @@
+import hashlib
+import io
+import wave
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from services.ingest import UploadRejected, ingest_upload, probe_audio
+
+
+def wav_bytes(seconds: float = 1.0, sr: int = 8000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(b"\0\0" * int(seconds * sr))
+    return buf.getvalue()
+
+
+def flac_head(sr: int = 44100, total_samples: int = 441000) -> bytes:
+    bits = (sr << 44) | (1 << 41) | (15 << 36) | total_samples   # stereo, 16 bit
+    info = bytes(10) + bits.to_bytes(8, "big") + bytes(16)
+    return b"fLaC" + bytes(4) + info
+
+
+def mp3_head(frames: int = 100, id3: bytes = b"") -> bytes:
+    # MPEG-1 layer III, 128 kbps, 44.1 kHz, joint stereo; Xing header after the side info
+    frame = (0xFFFB9064).to_bytes(4, "big") + bytes(32) + b"Xing" + (1).to_bytes(4, "big")
+    return id3 + frame + frames.to_bytes(4, "big") + bytes(64)
+
+
+def test_probe_wav():
+    probe = probe_audio(wav_bytes(2.0))
+    assert (probe.format, probe.codec, probe.byte_rate) == ("wav", "pcm", 16000)
+    assert probe.duration == pytest.approx(2.0)
+    assert probe.audio_offset == 44
+
+
+def test_probe_flac():
+    probe = probe_audio(flac_head())
+    assert (probe.format, probe.codec) == ("flac", "flac")
+    assert probe.duration == pytest.approx(10.0)
+
+
+def test_probe_mp3_with_id3_and_xing():
+    id3 = b"ID3\x04\x00\x00" + bytes([0, 0, 0, 10]) + bytes(10)
+    probe = probe_audio(mp3_head(100, id3))
+    assert (probe.format, probe.audio_offset, probe.byte_rate) == ("mp3", 20, 16000)
+    assert probe.duration == pytest.approx(100 * 1152 / 44100)
+
+
+def test_probe_needs_more_bytes():
+    assert probe_audio(b"RIFF") is None
+    assert probe_audio(wav_bytes()[:30]) is None
+    assert probe_audio(flac_head()[:20]) is None
+
+
+def test_probe_rejects_other_content():
+    with pytest.raises(UploadRejected) as e:
+        probe_audio(b"%PDF-1.7 not audio at all")
+    assert e.value.status_code == 415
+    with pytest.raises(UploadRejected):
+        probe_audio(b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"no frame sync here")
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        try:
+            result = await ingest_upload(request, tmp_path, max_bytes=100_000, max_seconds=3.0)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        return {"path": str(result.path), **result.to_dict()}
+
+    return TestClient(app)
+
+
+def test_ingest_stores_under_content_hash(client, tmp_path):
+    data = wav_bytes(1.0)
+    body = client.post("/upload", files={"file": ("take.wav", data, "audio/wav")}).json()
+    sha256 = hashlib.sha256(data).hexdigest()
+    assert body["path"] == str(tmp_path / sha256[:16] / "take.wav")
+    assert (body["sha256"], body["size"], body["format"]) == (sha256, len(data), "wav")
+    assert not list(tmp_path.glob(".*.part"))
+
+
+@pytest.mark.parametrize("name,data,status_code", [
+    ("take.ogg", wav_bytes(1.0), 404),           # extension not allowed
+    ("take.wav", b"RIFF" + bytes(200), 415),     # not what the name says
+    ("take.wav", wav_bytes(5.0), 413),           # longer than max_seconds
+    ("take.wav", wav_bytes(1.0, 96000), 413),    # more than max_bytes
+])
+def test_ingest_rejects(client, tmp_path, name, data, status_code):
+    response = client.post("/upload", files={"file": (name, data, "audio/wav")})
+    assert response.status_code == status_code
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
@@ -0,0 +1,100 @@
+import time
+
+from services.job_queue import JobQueue
+from services.job_store import MemoryJobStore, DONE, FAILED, RUNNING
+from services.result_cache import ResultCache
+
+
+class Separation:
+    def __init__(self, paths: dict):
+        self.key = "key"
+        self.paths = paths
+        self.on_disk = True
+
+
+class Processor:
+    """Stands in for AudioProcessor: stems written straight to disk (or already cached)."""
+
+    def __init__(self, output_dir, cached: bool = True):
+        self.output_dir = output_dir
+        self.cache = ResultCache(output_dir)
+        self.cached = cached
+        self.previews = []
+
+    def _paths(self, key):
+        entry = self.output_dir / key
+        entry.mkdir(exist_ok=True)
+        return {"drums": entry / "song_drums.wav", "rest": entry / "song_no_drums.wav"}
+
+    def separate_drums(self, input_file, in_memory=False, on_miss=None):
+        if not self.cached and on_miss:
+            on_miss("decoded")
+        return Separation(self._paths("key"))
+
+    def separate_preview(self, input_file, seconds, wav=None):
+        self.previews.append(wav)
+        return self._paths("preview")
+
+
+def run_one(queue: JobQueue, tmp_path, worker: str = "w1"):
+    job = queue.submit(tmp_path / "song.wav")
+    queue._run(queue.store.claim(worker), worker)
+    return queue.get(job.id)
+
+
+def test_job_reports_stems(tmp_path):
+    job = run_one(JobQueue(Processor(tmp_path), max_workers=0), tmp_path)
+    assert (job.status, job.progress) == (DONE, 1.0)
+    assert job.result["drums"] == "key/song_drums.wav"
+
+
+def test_preview_tier_only_when_not_cached(tmp_path):
+    processor = Processor(tmp_path, cached=False)
+    job = run_one(JobQueue(processor, max_workers=0, preview_seconds=10), tmp_path)
+    assert processor.previews == ["decoded"]    # reuses the decoded input
+    assert (job.result["tier"], job.result["preview"]["drums"]) == ("full", "preview/song_drums.wav")
+
+    processor = Processor(tmp_path, cached=True)
+    job = run_one(JobQueue(processor, max_workers=0, preview_seconds=10), tmp_path)
+    assert processor.previews == []
+    assert (job.result["tier"], job.result["preview"]) == ("full", None)
+
+
+def test_analysis_error_fails_the_job(tmp_path):
+    def analyse(drums_path, audio):
+        raise ValueError("no onsets")
+
+    job = run_one(JobQueue(Processor(tmp_path), max_workers=0, post_process=analyse), tmp_path)
+    assert (job.status, job.error) == (FAILED, "no onsets")
+
+
+def test_heartbeat_keeps_long_jobs_from_going_stale(tmp_path):
+    store = MemoryJobStore()
+    swept = []
+
+    def analyse(drums_path, audio):
+        for _ in range(6):
+            time.sleep(0.05)
+            swept.append(store.requeue_stale(0.1))
+
+    queue = JobQueue(Processor(tmp_path), store=store, max_workers=0, post_process=analyse,
+                     stale_after=0.1)
+    job = run_one(queue, tmp_path)
+    assert swept == [0] * 6
+    assert job.status == DONE
+
+
+def test_requeued_job_is_not_finished_by_the_old_worker(tmp_path):
+    store = MemoryJobStore()
+
+    def analyse(drums_path, audio):
+        # The job was taken for dead and claimed by another worker meanwhile
+        job = store.get(queue.current)
+        store.update(job.id, status="queued", worker=None)
+        store.claim("w2")
+
+    queue = JobQueue(Processor(tmp_path), store=store, max_workers=0, post_process=analyse)
+    queue.current = queue.submit(tmp_path / "song.wav").id
+    queue._run(store.claim("w1"), "w1")
+    job = queue.get(queue.current)
+    assert (job.status, job.worker) == (RUNNING, "w2")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from services.job_store import (JobStore, MemoryJobStore, SQLiteJobStore, QUEUED, RUNNING, DONE,
+                                make_job_store)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path) -> JobStore:
+    return make_job_store(request.param, tmp_path / "jobs.sqlite3")
+
+
+def test_job_store_is_abstract():
+    with pytest.raises(TypeError):
+        JobStore()
+
+
+def test_create_get_update(store, tmp_path):
+    job = store.create(tmp_path / "song.wav")
+    assert store.get(job.id).status == QUEUED
+    assert store.update(job.id, stage="separation", progress=0.3, result={"tier": "preview"})
+    stored = store.get(job.id)
+    assert (stored.stage, stored.progress, stored.result) == ("separation", 0.3, {"tier": "preview"})
+    assert store.get("missing") is None
+
+
+def test_create_respects_max_pending(store, tmp_path):
+    assert store.create(tmp_path / "a.wav", max_pending=2)
+    assert store.create(tmp_path / "b.wav", max_pending=2)
+    assert store.create(tmp_path / "c.wav", max_pending=2) is None
+    job = store.claim("w1")
+    store.update(job.id, status=DONE)
+    assert store.create(tmp_path / "c.wav", max_pending=2)
+    assert store.counts() == {QUEUED: 2, RUNNING: 0, DONE: 1, "failed": 0}
+
+
+def test_claim_oldest_first(store, tmp_path):
+    first = store.create(tmp_path / "a.wav")
+    time.sleep(0.01)
+    second = store.create(tmp_path / "b.wav")
+    claimed = store.claim("w1")
+    assert (claimed.id, claimed.status, claimed.worker) == (first.id, RUNNING, "w1")
+    assert store.claim("w2").id == second.id
+    assert store.claim("w3") is None
+
+
+def test_claim_hands_each_job_to_one_worker(store, tmp_path):
+    jobs = {store.create(tmp_path / f"{i}.wav").id for i in range(20)}
+    claimed, lock = [], threading.Lock()
+
+    def worker(name):
+        while (job := store.claim(name)) is not None:
+            with lock:
+                claimed.append(job.id)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(jobs)
+
+
+def test_update_with_expect_worker(store, tmp_path):
+    job = store.create(tmp_path / "a.wav")
+    store.claim("w1")
+    assert store.update(job.id, expect_worker="w1", stage="separation")
+    assert not store.update(job.id, expect_worker="w2", status=DONE)
+    assert store.get(job.id).status == RUNNING
+
+
+def test_requeue_stale(store, tmp_path):
+    job = store.create(tmp_path / "a.wav")
+    store.claim("w1")
+    assert store.requeue_stale(60) == 0
+    time.sleep(0.05)
+    assert store.update(job.id, expect_worker="w1")   # heartbeat
+    assert store.requeue_stale(0.04) == 0
+    time.sleep(0.05)
+    assert store.requeue_stale(0.04) == 1
+    requeued = store.get(job.id)
+    assert (requeued.status, requeued.worker) == (QUEUED, None)
+    # The old worker can no longer finish it
+    assert not store.update(job.id, expect_worker="w1", status=DONE)
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    job = SQLiteJobStore(path).create(tmp_path / "a.wav")
+    assert SQLiteJobStore(path).claim("w1").id == job.id
+    assert isinstance(make_job_store("memory"), MemoryJobStore)
+    with pytest.raises(ValueError):
+        make_job_store("redis")
@@ -0,0 +1,155 @@
+import re
+
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient  # noqa: E402
+
+from conftest import APP_DIR  # noqa: E402
+from services.event_bus import events  # noqa: E402
+from services.job_queue import JobQueue  # noqa: E402
+from services.metrics import metrics, current_job  # noqa: E402
+from services.result_cache import ResultCache  # noqa: E402
+
+
+class Separation:
+    def __init__(self, paths: dict):
+        self.key = "key"
+        self.paths = paths
+        self.on_disk = True
+
+
+class Processor:
+    """Stands in for AudioProcessor: stems already on disk."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.cache = ResultCache(output_dir)
+
+    def separate_drums(self, input_file, in_memory=False, on_miss=None):
+        entry = self.output_dir / input_file.stem
+        entry.mkdir(exist_ok=True)
+        return Separation({"drums": entry / "song_drums.wav", "rest": entry / "song_no_drums.wav"})
+
+
+# Hits the stub analysis publishes, per input file
+HITS = {"song": [{"time": 0.5, "label": "kick"}, {"time": 1.0, "label": "snare"}],
+        "other": [{"time": 7.0, "label": "crash"}]}
+
+
+def analyse(drums_path, audio):
+    # Two timed stages, like detect_onsets_task; broken.wav fails in the second
+    with metrics.stage("onsets") as st:
+        st.items = 3
+    events.publish(current_job.get(), {"type": "hits", "offset": 0,
+                                       "hits": HITS.get(drums_path.parent.name, [])}, keep=True)
+    with metrics.stage("midi", items=3):
+        if drums_path.parent.name == "broken":
+            raise ValueError("no tempo")
+
+
+@pytest.fixture
+def main(monkeypatch, tmp_path):
+    monkeypatch.chdir(APP_DIR)   # main mounts ./static
+    import main
+    queue = JobQueue(Processor(tmp_path), max_workers=0, post_process=analyse)
+    monkeypatch.setattr(main, "jobs", queue)
+    return main
+
+
+def run_next(queue: JobQueue):
+    # The oldest queued job, run on this thread as a worker would
+    queue._run(queue.store.claim("w1"), "w1")
+
+
+def run_job(queue: JobQueue, input_file):
+    job = queue.submit(input_file)
+    run_next(queue)
+    return queue.get(job.id)
+
+
+def scrape(client: TestClient) -> dict[str, float]:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+def test_metrics_after_a_job(main, tmp_path):
+    client = TestClient(main.app)
+    before = scrape(client)
+
+    assert run_job(main.jobs, tmp_path / "song.wav").status == "done"
+    assert run_job(main.jobs, tmp_path / "broken.wav").status == "failed"
+    after = scrape(client)
+
+    def delta(name):
+        return after[name] - before.get(name, 0.0)
+
+    text = client.get("/metrics").text
+    for metric, kind in (("drum_stage_wall_seconds", "histogram"), ("drum_stage_cpu_seconds_total", "counter"),
+                         ("drum_stage_items_total", "counter"), ("drum_stage_errors_total", "counter"),
+                         ("drum_stage_peak_rss_bytes", "gauge"), ("drum_jobs", "gauge")):
+        assert f"# TYPE {metric} {kind}\n" in text
+
+    assert delta('drum_stage_wall_seconds_count{stage="onsets"}') == 2
+    assert delta('drum_stage_wall_seconds_count{stage="midi"}') == 2
+    assert delta('drum_stage_items_total{stage="onsets"}') == 6
+    assert delta('drum_stage_errors_total{stage="onsets"}') == 0
+    assert delta('drum_stage_errors_total{stage="midi"}') == 1
+    assert after['drum_stage_peak_rss_bytes{stage="midi"}'] > 0
+    # Cumulative buckets ending in +Inf == count
+    buckets = [v for k, v in after.items() if k.startswith('drum_stage_wall_seconds_bucket{stage="midi"')]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == after['drum_stage_wall_seconds_count{stage="midi"}']
+    assert after['drum_stage_wall_seconds_sum{stage="midi"}'] >= 0
+    # Job gauges come from this queue only
+    assert {k: v for k, v in after.items() if k.startswith("drum_jobs")} == {
+        'drum_jobs{status="queued"}': 0, 'drum_jobs{status="running"}': 0,
+        'drum_jobs{status="done"}': 1, 'drum_jobs{status="failed"}': 1}
+    assert all(re.fullmatch(r'[a-z_]+\{[a-z]+="[^"]+"(,le="[^"]+")?\}', k) for k in after)
+
+
+def test_websocket_streams_own_job_and_closes_at_the_end(main, tmp_path):
+    from starlette.websockets import WebSocketDisconnect
+
+    other = main.jobs.submit(tmp_path / "other.wav")
+    song = main.jobs.submit(tmp_path / "song.wav")
+    client = TestClient(main.app)
+
+    with client.websocket_connect(f"/ws/jobs/{song.id}") as ws:
+        first = ws.receive_json()
+        assert (first["type"], first["job_id"], first["status"]) == ("job", song.id, "queued")
+
+        # Claimed oldest first: other runs (and finishes) while song still waits
+        run_next(main.jobs)
+        run_next(main.jobs)
+
+        messages = []
+        while not messages or messages[-1]["type"] != "end":
+            messages.append(ws.receive_json())
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1000
+
+    jobs = [m for m in messages if m["type"] == "job"]
+    assert {"stage": "onsets", "progress": 0.7} in [{k: m.get(k) for k in ("stage", "progress")} for m in jobs]
+    assert jobs[-1]["status"] == "done" and jobs[-1]["progress"] == 1.0
+    assert [m for m in messages if m["type"] == "hits"] == [{"type": "hits", "offset": 0, "hits": HITS["song"]}]
+    assert messages[-1] == {"type": "end", "status": "done", "total_hits": 2}
+    assert other.id not in str(messages)
+
+
+def test_websocket_rejects_unknown_job(main):
+    from starlette.websockets import WebSocketDisconnect
+
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with TestClient(main.app).websocket_connect("/ws/jobs/nope") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
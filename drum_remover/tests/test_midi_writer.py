@@ -0,0 +1,39 @@
+import pytest
+
+mido = pytest.importorskip("mido")
+
+from services.midi_writer import DRUM_MIDI, MIDIWriter  # noqa: E402
+
+
+def test_seconds_to_ticks_constant_tempo():
+    mid = mido.MidiFile(ticks_per_beat=480)
+    writer = MIDIWriter(bpm=120)
+    assert writer._seconds_to_ticks(0.0, mid) == 0
+    assert writer._seconds_to_ticks(0.5, mid) == 480      # one beat at 120 BPM
+    assert writer._seconds_to_ticks(2.0, mid) == 4 * 480
+
+
+def test_seconds_to_ticks_follows_the_tempo_map():
+    mid = mido.MidiFile(ticks_per_beat=480)
+    writer = MIDIWriter(bpm=120, tempo_map=[(0.0, 120.0), (2.0, 60.0)])
+    assert writer._seconds_to_ticks(2.0, mid) == 4 * 480
+    assert writer._seconds_to_ticks(3.0, mid) == 5 * 480   # one beat per second after 2 s
+    # A map starting late gets the default tempo in front
+    late = MIDIWriter(bpm=60, tempo_map=[(1.0, 120.0)])
+    assert late.tempo_map[0] == (0.0, 60.0)
+    assert late._seconds_to_ticks(1.5, mid) == 480 + 480
+
+
+def test_write_round_trips_hit_times(tmp_path):
+    writer = MIDIWriter(bpm=120, tempo_map=[(0.0, 120.0), (1.0, 90.0)])
+    hits = [{"time": 0.0, "label": "kick"}, {"time": 0.75, "label": "snare"},
+            {"time": 1.5, "label": "cowbell"}]
+    path = tmp_path / "song.mid"
+    writer.write(hits, path)
+
+    now, notes = 0.0, []
+    for msg in mido.MidiFile(str(path)):   # iterating a file yields times in seconds
+        now += msg.time
+        if msg.type == "note_on":
+            notes.append((round(now, 3), msg.note))
+    assert notes == [(0.0, DRUM_MIDI["kick"]), (0.75, DRUM_MIDI["snare"]), (1.5, DRUM_MIDI["unknown"])]
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip("librosa")
+sf = pytest.importorskip("soundfile")
+
+from services.onset_detector import OnsetDetector
+
+
+def click_track(sr: int, seconds: float) -> np.ndarray:
+    # Decaying noise bursts at uneven intervals, so blocks cut through hits and gaps
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(int(seconds * sr)).astype(np.float32) * 0.002
+    burst = (rng.standard_normal(int(0.05 * sr)) * np.exp(-np.linspace(0, 8, int(0.05 * sr)))).astype(np.float32)
+    t = 0.25
+    while t < seconds - 0.1:
+        start = int(t * sr)
+        y[start:start + len(burst)] += burst * rng.uniform(0.5, 1.0)
+        t += rng.uniform(0.2, 0.45)
+    return y
+
+
+@pytest.mark.parametrize("block_sec", [0.7, 30.0])
+def test_stream_onsets_matches_detect_onsets(tmp_path, block_sec):
+    sr = 44100
+    y = click_track(sr, 6.0)
+    path = tmp_path / "song_drums.wav"
+    sf.write(str(path), y, sr)
+    detector = OnsetDetector()
+    hop, _ = detector._stft(sr)
+
+    expected = detector.detect_onsets(y, sr)
+    envelope = []
+    streamed = list(detector.stream_onsets(path, block_sec=block_sec, envelope=envelope))
+
+    assert len(expected) > 10
+    assert len(streamed) == len(expected)
+    np.testing.assert_allclose(streamed, expected, atol=2 * hop / sr)
+
+    # The collected envelope lines up with onset_envelope frame for frame
+    env = np.concatenate(envelope)
+    ref = detector.onset_envelope(y, sr)
+    n = min(len(env), len(ref))
+    assert abs(len(env) - len(ref)) <= 2
+    assert np.corrcoef(env[:n], ref[:n])[0, 1] > 0.95
+
+
+def test_long_stems_on_disk_use_the_streaming_path(tmp_path, monkeypatch):
+    from services import background_tasks
+
+    sr = 44100
+    path = tmp_path / "song_drums.wav"
+    sf.write(str(path), click_track(sr, 4.0), sr)
+    monkeypatch.setattr(background_tasks, "LONG_AUDIO_SECONDS", 1.0)
+    calls = []
+    stream_onsets = background_tasks.detector.stream_onsets
+    monkeypatch.setattr(background_tasks.detector, "stream_onsets",
+                        lambda *a, **kw: calls.append(a) or stream_onsets(*a, **kw))
+
+    background_tasks.detect_onsets_task(path)
+
+    assert calls
+    onsets = json.loads(path.with_suffix(".onsets.json").read_text())["onsets"]
+    assert onsets == list(stream_onsets(path))
+    assert path.with_suffix(".beats.json").exists()
+    assert path.with_suffix(".mid").exists()
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from services.result_cache import ResultCache, ENTRY_FILE
+
+
+def make_entry(cache: ResultCache, key: str, size: int = 1000):
+    paths = cache.paths(key, "song")
+    paths["drums"].parent.mkdir(parents=True)
+    for path in paths.values():
+        path.write_bytes(b"\0" * size)
+    cache.commit(key, "song", "htdemucs", {})
+
+
+def test_lookup_hit_and_miss(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=10 ** 9)
+    assert cache.lookup("missing") is None
+    make_entry(cache, "a")
+    assert cache.lookup("a") == cache.paths("a", "song")
+    assert json.loads((tmp_path / "a" / ENTRY_FILE).read_text())["song_name"] == "song"
+
+
+def test_evict_drops_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=5000)
+    make_entry(cache, "a")
+    make_entry(cache, "b")
+    make_entry(cache, "c")
+    assert not (tmp_path / "a").exists()
+    assert cache.lookup("b") and cache.lookup("c")
+
+
+def test_evict_skips_entries_in_use(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=5000)
+    make_entry(cache, "a")
+    with ResultCache(tmp_path).in_use("a"):   # another instance, same process
+        make_entry(cache, "b")
+        make_entry(cache, "c")
+        assert cache.lookup("a")
+        assert not (tmp_path / "b").exists()
+    assert not cache.is_in_use("a")
+    os.utime(tmp_path / "a" / ENTRY_FILE, (0, 0))
+    make_entry(cache, "d")
+    assert not (tmp_path / "a").exists()
+
+
+def test_key_locks_are_dropped_once_released(tmp_path):
+    cache = ResultCache(tmp_path)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with cache.key_lock("k"):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    entered.wait()
+    assert len(cache._key_locks) == 1
+    assert not cache._key_locks._locks["k"][0].acquire(blocking=False)
+    release.set()
+    thread.join()
+    assert len(cache._key_locks) == 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("demucs")
+sf = pytest.importorskip("soundfile")
+
+from services.separation_engine import SeparationEngine  # noqa: E402
+
+SR = 1000
+
+
+class StubModel(torch.nn.Module):
+    """Demucs stand-in: the attributes the engine reads, no weights."""
+    samplerate = SR
+    audio_channels = 2
+    sources = ["drums", "bass", "other", "vocals"]
+    segment = 0.5
+
+    def forward(self, mix):
+        # Pointwise and different per source, so every way of cutting a track
+        # into segments must give the same result
+        gains = torch.tensor([0.5, 0.2, 0.2, 0.1])[None, :, None, None]
+        return torch.tanh(mix)[:, None] * gains
+
+
+@pytest.fixture
+def engine():
+    return SeparationEngine(model=StubModel(), shifts=0)
+
+
+def test_long_windows_cover_the_track_once():
+    for total in (1, 199, 200, 1000, 1001, 1200, 1801, 2500, 2600, 3400, 10_000):
+        windows = SeparationEngine.long_windows(total, 1000, 200)
+        assert windows[0][0] == 0
+        assert sum(w[0] + w[1] >= total for w in windows) == 1    # only the last reaches the end
+        assert windows[-1][0] + windows[-1][1] == total
+        for (start, length), (next_start, next_length) in zip(windows, windows[1:]):
+            assert next_start == start + length - 200            # overlap is exactly the fade
+            assert next_length > 200
+    assert SeparationEngine.long_windows(0, 1000, 200) == []
+
+
+@pytest.mark.parametrize("total", [700, 1000, 1800, 2500, 2600, 3401])
+def test_separate_long_output_matches_input(engine, tmp_path, monkeypatch, total):
+    # A ramp shows any duplicated or dropped region as a jump at the seams
+    signal = torch.linspace(-0.9, 0.9, total).repeat(2, 1)
+    monkeypatch.setattr(engine, "duration", lambda input_file: total / SR)
+    monkeypatch.setattr(engine, "_read_region",
+                        lambda audio_file, start, length: signal[:, start:start + length])
+    monkeypatch.setattr(engine, "separate",
+                        lambda wav, stats=None, **kwargs: {"drums": wav * 0.5, "no_drums": wav * 0.25})
+
+    out = {"drums": tmp_path / "drums.wav", "rest": tmp_path / "rest.wav"}
+    engine.separate_long(tmp_path / "mix.wav", out, max_memory_mb=1, crossfade=0.2)
+
+    for name, gain in (("drums", 0.5), ("rest", 0.25)):
+        stem, sr = sf.read(str(out[name]), dtype="float32")
+        assert sr == SR
+        assert stem.shape == (total, 2)
+        np.testing.assert_allclose(stem[:, 0], gain * signal[0].numpy(), atol=2 / 32768)
+        assert np.abs(np.diff(stem[:, 0])).max() < 2 * gain * 1.8 / total + 2 / 32768
+
+
+def test_separate_batch_matches_per_track(engine):
+    rng = np.random.default_rng(0)
+    # Lengths that end mid-segment, shorter than one segment, and across several batches
+    wavs = [torch.from_numpy(rng.standard_normal((2, n)).astype(np.float32)) for n in (1234, 300, 2750)]
+
+    together = engine.separate_batch(wavs, batch_size=3, overlap=0.25)
+    for wav, stems in zip(wavs, together):
+        alone = engine.separate_batch([wav], batch_size=3, overlap=0.25)[0]
+        reference = engine.separate(wav, overlap=0.25)
+        for name in ("drums", "no_drums"):
+            assert stems[name].shape == wav.shape
+            torch.testing.assert_close(stems[name], alone[name])
+            torch.testing.assert_close(stems[name], reference[name], atol=1e-5, rtol=1e-5)
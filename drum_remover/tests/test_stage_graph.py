@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from services.stage_graph import StageFailed, StageGraph
+
+
+def test_results_flow_along_dependencies():
+    results = (StageGraph()
+               .add("a", lambda: 2)
+               .add("b", lambda: 3)
+               .add("sum", lambda a, b: a + b, deps=("a", "b"))
+               .add("double", lambda s: 2 * s, deps=("sum",))
+               .run())
+    assert results == {"a": 2, "b": 3, "sum": 5, "double": 10}
+
+
+def test_independent_stages_overlap():
+    barrier = threading.Barrier(2, timeout=5)
+    # Each stage waits for the other: only passes if both run at once
+    StageGraph(max_workers=2).add("a", barrier.wait).add("b", barrier.wait).run()
+
+
+def test_add_rejects_unknown_and_duplicate_stages():
+    graph = StageGraph().add("a", lambda: 1)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: 2)
+    with pytest.raises(ValueError):
+        graph.add("b", lambda x: x, deps=("missing",))
+
+
+def test_failure_raises_and_skips_dependents():
+    ran = []
+
+    def boom():
+        raise KeyError("no onsets")
+
+    graph = (StageGraph(max_workers=1)
+             .add("a", boom)
+             .add("b", lambda a: ran.append("b"), deps=("a",)))
+    with pytest.raises(StageFailed) as e:
+        graph.run()
+    assert e.value.stage == "a"
+    assert isinstance(e.value.__cause__, KeyError)
+    assert ran == []
+
+
+def test_stages_see_the_callers_context():
+    from services.metrics import current_job
+
+    token = current_job.set("job-1")
+    try:
+        results = StageGraph().add("job", lambda: (time.sleep(0.01), current_job.get())[1]).run()
+    finally:
+        current_job.reset(token)
+    assert results["job"] == "job-1"
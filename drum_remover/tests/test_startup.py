@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Loaded on first use (worker threads, the pre-warm thread), never by `import main`
+HEAVY_MODULES = ("torch", "demucs", "librosa", "numba", "mido", "onnxruntime")
+
+PROBE = """
+import json, sys
+import main
+print(json.dumps([m for m in %r if m in sys.modules]))
+"""
+
+
+def test_importing_main_loads_no_heavy_libraries():
+    # Fresh interpreter: other tests may already have imported some of them
+    env = dict(os.environ, JOB_STORE="memory", SEPARATION_WORKERS="0")
+    out = subprocess.run([sys.executable, "-c", PROBE % (HEAVY_MODULES,)], cwd=APP_DIR, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    assert json.loads(out.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,39 @@
+import threading
+
+import numpy as np
+import pytest
+
+from services.transcoder import StemTranscoder
+
+
+@pytest.fixture
+def stem(tmp_path):
+    sf = pytest.importorskip("soundfile")
+    pytest.importorskip("lameenc")
+    path = tmp_path / "song_drums.wav"
+    sf.write(str(path), np.zeros((44100, 2), dtype=np.float32), 44100)
+    return path
+
+
+def test_mp3_is_encoded_once_and_locks_are_dropped(stem, monkeypatch):
+    transcoder = StemTranscoder()
+    encodes = []
+    encode = transcoder._encode_mp3
+    monkeypatch.setattr(transcoder, "_encode_mp3", lambda *a: (encodes.append(a), encode(*a)))
+
+    targets = []
+    threads = [threading.Thread(target=lambda: targets.append(transcoder.mp3(stem, 128))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert targets == [stem.with_suffix(".128k.mp3")] * 4
+    assert targets[0].stat().st_size > 0
+    assert len(encodes) == 1
+    assert len(transcoder._locks) == 0
+    assert not list(stem.parent.glob(".*.part"))
+
+
+def test_mp3_rejects_unknown_bitrates(stem):
+    with pytest.raises(ValueError):
+        StemTranscoder().mp3(stem, 100)